@@ -1,7 +1,18 @@
+import asyncio
+import json
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterable
+from itertools import islice
 from datetime import datetime, timedelta
 
 import aiosqlite
+from config import settings
 from config.settings import DB_PATH
+from database.migrations import STATS_REBUILD, migrate
+from database.pool import ConnectionPool
+from utils.cache import BloomFilter, LRUCache
+from utils.metrics import db_metrics
 
 PLAN_DURATION = {
     "plan_1": 30,
@@ -11,217 +22,588 @@ PLAN_DURATION = {
     "plan_test": 1,
 }
 
+DB_READERS = getattr(settings, "DB_READERS", 4)
+# Сколько свободных UUID сервера держать в памяти за раз
+FREE_UUIDS_BATCH = getattr(settings, "FREE_UUIDS_BATCH", 512)
+# Сколько истёкших подписок гасить одной транзакцией
+EXPIRY_BATCH = getattr(settings, "EXPIRY_BATCH", 500)
+# Сколько последних записей журнала subscription_changes хранить
+SUBSCRIPTION_CHANGES_KEEP = getattr(settings, "SUBSCRIPTION_CHANGES_KEEP", 100_000)
+# Сколько известных пользователей (telegram_id → имя) держать в памяти для /start
+KNOWN_USERS_CACHE_SIZE = getattr(settings, "KNOWN_USERS_CACHE_SIZE", 50_000)
+# Сколько дней хранить отправленные и отклонённые сообщения outbox
+OUTBOX_KEEP_DAYS = getattr(settings, "OUTBOX_KEEP_DAYS", 7)
+# Сколько хранить минутные и часовые строки трафика до свёртки, сек
+TRAFFIC_MINUTE_KEEP = getattr(settings, "TRAFFIC_MINUTE_KEEP", 2 * 3600)
+TRAFFIC_HOUR_KEEP = getattr(settings, "TRAFFIC_HOUR_KEEP", 2 * 86400)
+# Сколько дней хранить дневные строки трафика (не меньше самого длинного тарифа)
+TRAFFIC_KEEP_DAYS = getattr(settings, "TRAFFIC_KEEP_DAYS", 400)
 
-async def init_db():
-    """Инициализация базы данных и создание таблиц."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                full_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER NOT NULL,
-                plan_id TEXT NOT NULL,
-                uuid TEXT NOT NULL,
-                vless_key TEXT NOT NULL,
-                start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                end_date TIMESTAMP NOT NULL,
-                is_active INTEGER DEFAULT 1,
-                FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS uuid_pool (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid TEXT UNIQUE NOT NULL,
-                server_name TEXT NOT NULL,
-                is_used INTEGER DEFAULT 0,
-                telegram_id INTEGER DEFAULT NULL
-            )
-        """)
-        await db.commit()
+TRAFFIC_MINUTE, TRAFFIC_HOUR, TRAFFIC_DAY = 60, 3600, 86400
+
+_pool: ConnectionPool | None = None
+
+# Свободные UUID по серверам. Прогреваются в init_db и добираются из таблицы,
+# когда список сервера опустел. Истина — всегда uuid_pool: claim_uuid
+# перепроверяет is_used, так что лишние или устаревшие элементы безопасны.
+_free_uuids: dict[str, deque[str]] = {}
+
+# Вызываются с UUID подписки после её изменения (сброс кэшей /sub)
+_subscription_listeners: list = []
+
+# Последняя запись журнала subscription_changes, уже применённая в этом процессе
+_changes_cursor = 0
+
+# telegram_id → (username, full_name) недавних пользователей. Пока в кэш помещаются
+# все, промах означает нового пользователя; дальше «точно нет» отвечает bloom-фильтр
+_known_users = LRUCache(KNOWN_USERS_CACHE_SIZE)
+_known_filter: BloomFilter | None = None
+_known_filter_lock: asyncio.Lock | None = None
+
+
+def add_subscription_listener(callback):
+    """Подписаться на изменения подписок: callback(uuid)."""
+    _subscription_listeners.append(callback)
+
+
+def _notify_subscription_changed(uuids):
+    for uuid in uuids:
+        for callback in _subscription_listeners:
+            callback(uuid)
+
+
+def _get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("База данных не инициализирована — сначала вызовите init_db()")
+    return _pool
+
+
+async def init_db(path: str = DB_PATH):
+    """Инициализация пула соединений и миграция схемы до последней версии."""
+    global _pool, _changes_cursor
+    if _pool is not None:
+        await close_db()
+
+    pool = ConnectionPool(path, readers=DB_READERS)
+    await pool.open()
+
+    try:
+        await migrate(pool)
+
+        # Кэши пусты, прошлые изменения из журнала им не нужны
+        async with pool.read() as db:
+            rows = await db.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM subscription_changes")
+        _changes_cursor = rows[0][0]
+
+        await _warm_known_users(pool)
+
+        _free_uuids.clear()
+        async with pool.write() as db:
+            rows = await db.execute_fetchall("SELECT DISTINCT server_name FROM uuid_pool WHERE is_used = 0")
+            for row in rows:
+                await _refill_free_uuids(db, row[0])
+    except BaseException:
+        await pool.close()
+        raise
+
+    _pool = pool
+
+
+async def close_db():
+    """Закрыть пул соединений."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def _warm_known_users(pool: ConnectionPool):
+    """Заполнить кэш известных пользователей самыми новыми из базы."""
+    global _known_filter, _known_filter_lock
+    _known_users.clear()
+    _known_filter = None
+    _known_filter_lock = asyncio.Lock()
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT telegram_id, username, full_name FROM users "
+            "ORDER BY created_at DESC, telegram_id DESC LIMIT ?",
+            (_known_users.maxsize,),
+        )
+    # Самые новые — последними, их LRU вытеснит позже всех
+    for row in reversed(rows):
+        _known_users.set(row[0], (row[1], row[2]))
+
+
+async def _build_known_filter():
+    """Построить bloom-фильтр по всем telegram_id, читая их порциями."""
+    global _known_filter
+    async with _known_filter_lock:
+        if _known_filter is not None:
+            return
+        pool = _get_pool()
+        async with pool.read() as db:
+            rows = await db.execute_fetchall("SELECT COUNT(*) FROM users")
+        # Запас вдвое: новые пользователи не сразу портят точность
+        known = BloomFilter(max(rows[0][0] * 2, _known_users.maxsize * 2))
+        after = -(2 ** 63)
+        while True:
+            async with pool.read() as db:
+                rows = await db.execute_fetchall(
+                    "SELECT telegram_id FROM users WHERE telegram_id > ? ORDER BY telegram_id LIMIT 10000",
+                    (after,),
+                )
+            for row in rows:
+                known.add(row[0])
+            if len(rows) < 10000:
+                break
+            after = rows[-1][0]
+        _known_filter = known
 
 
+async def _may_be_known(telegram_id: int) -> bool:
+    """Может ли пользователь, которого нет в кэше, уже быть в базе."""
+    global _known_filter
+    if _known_filter is None:
+        if len(_known_users) < _known_users.maxsize:
+            # Из кэша ещё никого не вытеснили: в нём все пользователи этого процесса
+            return False
+        await _build_known_filter()
+    elif len(_known_filter) > _known_filter.capacity:
+        # Фильтр переполнен и врёт чаще — пересобираем побольше
+        _known_filter = None
+        await _build_known_filter()
+    return telegram_id in _known_filter
+
+
+@db_metrics
 async def add_user(telegram_id: int, username: str | None, full_name: str) -> bool:
-    """Добавить пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
+    """Добавить пользователя или обновить его username/full_name. True — пользователь новый.
+
+    Повторный /start с тем же именем отвечается из кэша без записи в базу.
+    """
+    names = (username, full_name)
+    cached = _known_users.get(telegram_id)
+    if cached == names:
+        return False
+    if cached is None and await _may_be_known(telegram_id):
+        # Вероятно, уже есть: проверяем чтением, писатель не нужен
+        async with _get_pool().read() as db:
+            rows = await db.execute_fetchall(
+                "SELECT username, full_name FROM users WHERE telegram_id = ?", (telegram_id,),
+            )
+        if rows and tuple(rows[0]) == names:
+            _known_users.set(telegram_id, names)
+            return False
+
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall("SELECT 1 FROM users WHERE telegram_id = ?", (telegram_id,))
+        if rows:
+            await db.execute(
+                "UPDATE users SET username = ?, full_name = ? WHERE telegram_id = ?",
+                (username, full_name, telegram_id),
+            )
+        else:
             await db.execute(
                 "INSERT INTO users (telegram_id, username, full_name) VALUES (?, ?, ?)",
                 (telegram_id, username, full_name),
             )
-            await db.commit()
-            return True
-        except aiosqlite.IntegrityError:
-            return False
+    _known_users.set(telegram_id, names)
+    if _known_filter is not None:
+        _known_filter.add(telegram_id)
+    return not rows
 
 
+@db_metrics
 async def get_free_uuid(server_name: str) -> str | None:
     """Получить свободный UUID из пула."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    async with _get_pool().read() as db:
+        async with db.execute(
             "SELECT uuid FROM uuid_pool WHERE server_name = ? AND is_used = 0 LIMIT 1",
             (server_name,),
-        )
-        row = await cursor.fetchone()
+        ) as cursor:
+            row = await cursor.fetchone()
         if row:
             return row[0]
         return None
 
 
-async def assign_uuid(uuid: str, telegram_id: int):
-    """Пометить UUID как занятый."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE uuid_pool SET is_used = 1, telegram_id = ? WHERE uuid = ?",
-            (telegram_id, uuid),
-        )
-        await db.commit()
+async def _refill_free_uuids(db: aiosqlite.Connection, server_name: str) -> deque[str]:
+    rows = await db.execute_fetchall(
+        "SELECT uuid FROM uuid_pool WHERE server_name = ? AND is_used = 0 LIMIT ?",
+        (server_name, FREE_UUIDS_BATCH),
+    )
+    free = deque(row[0] for row in rows)
+    _free_uuids[server_name] = free
+    return free
 
 
+@db_metrics
+async def claim_uuid(server_name: str, telegram_id: int) -> str | None:
+    """Атомарно занять свободный UUID сервера за пользователем."""
+    async with _get_pool().write() as db:
+        free = _free_uuids.get(server_name)
+        while True:
+            if not free:
+                free = await _refill_free_uuids(db, server_name)
+                if not free:
+                    return None
+            uuid = free.popleft()
+            cursor = await db.execute(
+                "UPDATE uuid_pool SET is_used = 1, telegram_id = ? WHERE uuid = ? AND is_used = 0",
+                (telegram_id, uuid),
+            )
+            if cursor.rowcount:
+                return uuid
+
+
+@db_metrics
 async def release_uuid(uuid: str):
     """Освободить UUID."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE uuid_pool SET is_used = 0, telegram_id = NULL WHERE uuid = ?",
+    async with _get_pool().write() as db:
+        async with db.execute("SELECT server_name FROM uuid_pool WHERE uuid = ?", (uuid,)) as cursor:
+            row = await cursor.fetchone()
+        cursor = await db.execute(
+            "UPDATE uuid_pool SET is_used = 0, telegram_id = NULL WHERE uuid = ? AND is_used = 1",
             (uuid,),
         )
-        await db.commit()
+        if row and cursor.rowcount and row[0] in _free_uuids:
+            _free_uuids[row[0]].append(uuid)
+
+
+def _batched(items: Iterable, size: int):
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@db_metrics
+async def bulk_load_uuids(
+    uuids: Iterable[str],
+    server_name: str,
+    batch_size: int = 5000,
+    progress: Callable[[int, int], None] | None = None,
+) -> tuple[int, int]:
+    """Загрузить UUID в пул пачками в одной транзакции, дубликаты пропускаются.
+
+    uuids читается потоково. progress(прочитано, добавлено) вызывается после каждой пачки.
+    Возвращает (прочитано, добавлено).
+    """
+    seen = added = 0
+    async with _get_pool().write() as db:
+        for batch in _batched(uuids, batch_size):
+            # rowcount, а не total_changes: тот считает и строки триггеров pool_stats
+            cursor = await db.executemany(
+                "INSERT OR IGNORE INTO uuid_pool (uuid, server_name) VALUES (?, ?)",
+                [(uuid, server_name) for uuid in batch],
+            )
+            seen += len(batch)
+            added += cursor.rowcount
+            if progress:
+                progress(seen, added)
+    return seen, added
+
+
+@db_metrics
+async def diff_uuids(uuids: Iterable[str], server_name: str, batch_size: int = 500) -> dict:
+    """Сравнить UUID с содержимым пула, ничего не меняя (для dry-run загрузки)."""
+    result = {"total": 0, "new": 0, "same_server": 0, "other_server": 0, "duplicates": 0}
+    seen = set()
+    async with _get_pool().read() as db:
+        for batch in _batched(uuids, batch_size):
+            result["total"] += len(batch)
+            unique = []
+            for uuid in batch:
+                if uuid in seen:
+                    result["duplicates"] += 1
+                else:
+                    seen.add(uuid)
+                    unique.append(uuid)
+            if not unique:
+                continue
+            placeholders = ",".join("?" * len(unique))
+            rows = await db.execute_fetchall(
+                f"SELECT server_name FROM uuid_pool WHERE uuid IN ({placeholders})",
+                unique,
+            )
+            for row in rows:
+                result["same_server" if row[0] == server_name else "other_server"] += 1
+            result["new"] += len(unique) - len(rows)
+    return result
 
 
 async def load_uuids_to_pool(uuids: list[str], server_name: str):
     """Загрузить UUID в пул."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        for uuid in uuids:
-            try:
-                await db.execute(
-                    "INSERT INTO uuid_pool (uuid, server_name) VALUES (?, ?)",
-                    (uuid, server_name),
-                )
-            except aiosqlite.IntegrityError:
-                pass
-        await db.commit()
+    await bulk_load_uuids(uuids, server_name)
 
 
-async def activate_subscription(telegram_id: int, plan_id: str, user_uuid: str, vless_key: str):
-    """Активировать подписку после оплаты."""
+@db_metrics
+async def activate_subscription(
+    telegram_id: int,
+    plan_id: str,
+    user_uuid: str,
+    vless_key: str,
+    payment_id: str | None = None,
+    amount: int = 0,
+):
+    """Активировать подписку после оплаты.
+
+    amount — оплаченная сумма в копейках. С payment_id повторная активация
+    той же оплаты падает с IntegrityError. UUID прежней подписки, на котором
+    не осталось активных, возвращается в пул той же транзакцией.
+    """
     days = PLAN_DURATION.get(plan_id, 30)
     end_date = datetime.now() + timedelta(days=days)
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall(
+            "SELECT uuid FROM subscriptions WHERE telegram_id = ? AND is_active = 1",
+            (telegram_id,),
+        )
         await db.execute(
             "UPDATE subscriptions SET is_active = 0 WHERE telegram_id = ? AND is_active = 1",
             (telegram_id,),
         )
         await db.execute(
-            "INSERT INTO subscriptions (telegram_id, plan_id, uuid, vless_key, end_date) VALUES (?, ?, ?, ?, ?)",
-            (telegram_id, plan_id, user_uuid, vless_key, end_date.isoformat()),
+            "INSERT INTO subscriptions (telegram_id, plan_id, uuid, vless_key, end_date, payment_id, amount) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (telegram_id, plan_id, user_uuid, vless_key, end_date.isoformat(), payment_id, amount),
+        )
+        # Продление выдаёт новый UUID: старый иначе остался бы занятым навсегда,
+        # истечение смотрит только активные подписки
+        for old_uuid in {row[0] for row in rows} - {user_uuid}:
+            released = await db.execute_fetchall(
+                """
+                UPDATE uuid_pool SET is_used = 0, telegram_id = NULL
+                WHERE uuid = ? AND is_used = 1
+                  AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.uuid = uuid_pool.uuid AND s.is_active = 1)
+                RETURNING server_name
+                """,
+                (old_uuid,),
+            )
+            if released and released[0][0] in _free_uuids:
+                _free_uuids[released[0][0]].append(old_uuid)
+
+    _notify_subscription_changed({user_uuid, *(row[0] for row in rows)})
+
+
+@db_metrics
+async def expire_due_subscriptions(now: datetime | None = None, batch_size: int = EXPIRY_BATCH) -> list[str]:
+    """Деактивировать пачку истёкших подписок и вернуть их UUID в пул.
+
+    Возвращает UUID обработанных подписок; пустой список — истёкших больше нет.
+    """
+    now = (now or datetime.now()).isoformat()
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall(
+            "SELECT id, uuid FROM subscriptions WHERE is_active = 1 AND end_date <= ? ORDER BY end_date LIMIT ?",
+            (now, batch_size),
+        )
+        if not rows:
+            return []
+        await db.executemany(
+            "UPDATE subscriptions SET is_active = 0 WHERE id = ?",
+            [(row[0],) for row in rows],
+        )
+        # UUID освобождается, только если на нём не осталось другой активной подписки.
+        # В списки свободных он попадёт при их следующем пополнении.
+        await db.executemany(
+            """
+            UPDATE uuid_pool SET is_used = 0, telegram_id = NULL
+            WHERE uuid = ? AND is_used = 1
+              AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.uuid = uuid_pool.uuid AND s.is_active = 1)
+            """,
+            [(row[1],) for row in rows],
         )
-        await db.commit()
 
+    uuids = [row[1] for row in rows]
+    _notify_subscription_changed(uuids)
+    return uuids
 
+
+@db_metrics
 async def get_active_subscription(telegram_id: int) -> dict | None:
     """Получить активную подписку пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with _get_pool().read() as db:
+        async with db.execute(
             "SELECT * FROM subscriptions WHERE telegram_id = ? AND is_active = 1",
             (telegram_id,),
-        )
-        row = await cursor.fetchone()
+        ) as cursor:
+            row = await cursor.fetchone()
         if row:
             return dict(row)
         return None
-    
+
+
+@db_metrics
 async def get_admin_stats() -> dict:
-    """Статистика для админки."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Всего пользователей
-        cursor = await db.execute("SELECT COUNT(*) FROM users")
-        total_users = (await cursor.fetchone())[0]
-
-        # Активные подписки
-        cursor = await db.execute("SELECT COUNT(*) FROM subscriptions WHERE is_active = 1")
-        active_subs = (await cursor.fetchone())[0]
-
-        # Доход
-        cursor = await db.execute("""
-            SELECT COALESCE(SUM(
-                CASE plan_id
-                    WHEN 'plan_1' THEN 99
-                    WHEN 'plan_3' THEN 199
-                    WHEN 'plan_6' THEN 499
-                    WHEN 'plan_12' THEN 999
-                    WHEN 'plan_test' THEN 1
-                    ELSE 0
-                END
-            ), 0) FROM subscriptions
-        """)
-        total_income = (await cursor.fetchone())[0]
-
-        # Свободные UUID
-        cursor = await db.execute("SELECT COUNT(*) FROM uuid_pool WHERE is_used = 0")
-        free_uuids = (await cursor.fetchone())[0]
-
-        # Серверы
-        cursor = await db.execute("""
-            SELECT server_name,
-                   SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used,
-                   COUNT(*) as total
-            FROM uuid_pool GROUP BY server_name
-        """)
-        servers = []
-        for row in await cursor.fetchall():
-            servers.append({"name": row[0], "used": row[1], "max": row[2]})
-
-        return {
-            "total_users": total_users,
-            "active_subs": active_subs,
-            "total_income": total_income,
-            "free_uuids": free_uuids,
-            "servers": servers,
+    """Статистика для админки из счётчиков, которые ведут триггеры (миграция 6)."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("SELECT key, value FROM stats")
+        counters = dict(rows)
+        rows = await db.execute_fetchall(
+            "SELECT server_name, used, total FROM pool_stats WHERE total > 0 ORDER BY server_name"
+        )
+
+    servers = [{"name": row[0], "used": row[1], "max": row[2]} for row in rows]
+    return {
+        "total_users": counters.get("total_users", 0),
+        "active_subs": counters.get("active_subs", 0),
+        # Сумма хранится в копейках
+        "total_income": counters.get("revenue", 0) / 100,
+        "free_uuids": sum(server["max"] - server["used"] for server in servers),
+        "servers": servers,
+    }
+
+
+async def _read_stats(db: aiosqlite.Connection) -> dict:
+    rows = await db.execute_fetchall("SELECT key, value FROM stats")
+    stats = {f"stats.{key}": value for key, value in rows}
+    rows = await db.execute_fetchall("SELECT server_name, total, used FROM pool_stats WHERE total > 0")
+    for server_name, total, used in rows:
+        stats[f"pool.{server_name}.total"] = total
+        stats[f"pool.{server_name}.used"] = used
+    return stats
+
+
+@db_metrics
+async def rebuild_stats(apply: bool = True) -> dict:
+    """Пересчитать счётчики с нуля. Вернуть расхождения {счётчик: (было, стало)}.
+
+    С apply=False только сверить: пересчёт откатывается.
+    """
+    async with _get_pool().write() as db:
+        before = await _read_stats(db)
+        for sql in STATS_REBUILD:
+            await db.execute(sql)
+        after = await _read_stats(db)
+        if not apply:
+            await db.rollback()
+
+    return {
+        key: (before.get(key, 0), after.get(key, 0))
+        for key in sorted(before.keys() | after.keys())
+        if before.get(key, 0) != after.get(key, 0)
+    }
+
+
+# Ключи сортировки списка пользователей: колонки keyset-курсора
+ADMIN_USERS_SORTS = {
+    "created_at": ("u.created_at", "u.telegram_id"),
+    "telegram_id": ("u.telegram_id",),
+}
+
+ADMIN_USERS_STATUSES = {
+    "active": "s.is_active = 1",
+    "expired": "s.id IS NOT NULL AND s.is_active = 0",
+    "none": "s.id IS NULL",
+}
+
+
+@db_metrics
+async def iter_admin_users(
+    limit: int,
+    after: list | None = None,
+    sort: str = "created_at",
+    descending: bool = True,
+    status: str | None = None,
+    plan_id: str | None = None,
+    search: str | None = None,
+) -> AsyncIterator[dict]:
+    """Пользователи с последней подпиской, по одному, в порядке keyset-сортировки.
+
+    after — значения ключа сортировки последней строки предыдущей страницы.
+    Страница (не больше limit строк) читается целиком, и соединение
+    возвращается в пул до первой строки — пока ответ отдаётся клиенту,
+    читатель не занят.
+    """
+    columns = ADMIN_USERS_SORTS[sort]
+    direction = "DESC" if descending else "ASC"
+    where = []
+    params = []
+
+    if after:
+        keys = ", ".join(columns)
+        marks = ", ".join("?" * len(columns))
+        where.append(f"({keys}) {'<' if descending else '>'} ({marks})")
+        params.extend(after)
+    if status:
+        where.append(ADMIN_USERS_STATUSES[status])
+    if plan_id:
+        where.append("s.plan_id = ?")
+        params.append(plan_id)
+    if search:
+        term = search.lstrip("@")
+        if term.isdigit():
+            where.append("u.telegram_id = ?")
+            params.append(int(term))
+        else:
+            where.append("(u.username LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\')")
+            like = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            params.extend([like, like])
+
+    sql = f"""
+        SELECT u.telegram_id, u.username, u.full_name, u.created_at,
+               s.plan_id, s.is_active, s.end_date
+        FROM users u
+        LEFT JOIN subscriptions s ON s.id = u.last_subscription_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {", ".join(f"{column} {direction}" for column in columns)}
+        LIMIT ?
+    """
+    params.append(limit)
+
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(sql, params)
+    for r in rows:
+        yield {
+            "telegram_id": r[0],
+            "username": r[1],
+            "full_name": r[2],
+            "created_at": r[3],
+            "plan_id": r[4],
+            "is_active": r[5],
+            "end_date": r[6],
         }
 
 
-async def get_admin_users() -> list:
-    """Список пользователей с подписками."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT u.telegram_id, u.username, u.full_name,
-                   s.plan_id, s.is_active, s.end_date
-            FROM users u
-            LEFT JOIN subscriptions s ON u.telegram_id = s.telegram_id
-                AND s.id = (SELECT MAX(id) FROM subscriptions WHERE telegram_id = u.telegram_id)
-            ORDER BY u.created_at DESC
-        """)
-        rows = await cursor.fetchall()
-        return [
-            {
-                "telegram_id": r[0],
-                "username": r[1],
-                "full_name": r[2],
-                "plan_id": r[3],
-                "is_active": r[4],
-                "end_date": r[5],
-            }
-            for r in rows
-        ]
+@db_metrics
+async def get_pool_counts() -> dict[str, dict]:
+    """Размер пула и число выданных UUID по серверам (счётчики pool_stats)."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("SELECT server_name, total, used FROM pool_stats")
+    return {row[0]: {"total": row[1], "used": row[2]} for row in rows}
+
+
+@db_metrics
+async def record_placement(server_name: str, placed_at: float, keep_since: float):
+    """Записать выдачу ключа на сервер и забыть выдачи старше keep_since."""
+    async with _get_pool().write() as db:
+        await db.execute(
+            "INSERT INTO placements (server_name, placed_at) VALUES (?, ?)", (server_name, placed_at),
+        )
+        await db.execute("DELETE FROM placements WHERE placed_at < ?", (keep_since,))
 
 
+@db_metrics
+async def get_recent_placements(since: float) -> dict[str, list[float]]:
+    """Времена выдач ключей после since по серверам, по возрастанию (всеми воркерами)."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT server_name, placed_at FROM placements WHERE placed_at > ? ORDER BY placed_at", (since,),
+        )
+    placed: dict[str, list[float]] = {}
+    for name, placed_at in rows:
+        placed.setdefault(name, []).append(placed_at)
+    return placed
+
+
+@db_metrics
 async def get_admin_pool() -> list:
     """UUID пул для админки."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
             "SELECT uuid, server_name, is_used, telegram_id FROM uuid_pool ORDER BY is_used DESC, id LIMIT 200"
         )
-        rows = await cursor.fetchall()
         return [
             {
                 "uuid": r[0],
@@ -231,17 +613,18 @@ async def get_admin_pool() -> list:
             }
             for r in rows
         ]
-    
+
+
+@db_metrics
 async def get_admin_connections() -> list:
     """Получить подключения по ключам с данными пользователей."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("""
             SELECT up.uuid, u.telegram_id, u.username, u.full_name
             FROM uuid_pool up
             LEFT JOIN users u ON up.telegram_id = u.telegram_id
             WHERE up.is_used = 1
         """)
-        rows = await cursor.fetchall()
         return [
             {
                 "uuid": r[0],
@@ -251,16 +634,470 @@ async def get_admin_connections() -> list:
             }
             for r in rows
         ]
-    
+
+
+@db_metrics
 async def get_subscription_by_uuid(uuid: str) -> dict | None:
     """Получить подписку по UUID."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with _get_pool().read() as db:
+        async with db.execute(
             "SELECT * FROM subscriptions WHERE uuid = ? ORDER BY id DESC LIMIT 1",
             (uuid,),
-        )
-        row = await cursor.fetchone()
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row:
+            return dict(row)
+        return None
+
+
+@db_metrics
+async def get_subscription_by_payment(payment_id: str) -> dict | None:
+    """Получить подписку, созданную по оплате."""
+    async with _get_pool().read() as db:
+        async with db.execute(
+            "SELECT * FROM subscriptions WHERE payment_id = ?",
+            (payment_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
         if row:
             return dict(row)
-        return None
\ No newline at end of file
+        return None
+
+
+@db_metrics
+async def enqueue_payment_job(payment_id: str, telegram_id: int, plan_id: str, payload: str) -> bool:
+    """Сохранить оплату в очередь. False — такая оплата уже была."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO payment_jobs (payment_id, telegram_id, plan_id, payload, available_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (payment_id, telegram_id, plan_id, payload, time.time()),
+        )
+        return cursor.rowcount == 1
+
+
+@db_metrics
+async def claim_payment_job() -> dict | None:
+    """Взять в работу самую старую готовую задачу очереди оплат."""
+    async with _get_pool().write() as db:
+        async with db.execute(
+            "SELECT * FROM payment_jobs WHERE status = 'pending' AND available_at <= ? "
+            "ORDER BY available_at LIMIT 1",
+            (time.time(),),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        await db.execute(
+            "UPDATE payment_jobs SET status = 'processing', attempts = attempts + 1, "
+            "updated_at = CURRENT_TIMESTAMP WHERE payment_id = ?",
+            (row["payment_id"],),
+        )
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+
+@db_metrics
+async def finish_payment_job(payment_id: str, error: str | None = None, retry_at: float | None = None):
+    """Закрыть задачу: done, отложить на retry_at или failed, если повторов больше не будет."""
+    if error is None:
+        status = "done"
+    elif retry_at is not None:
+        status = "pending"
+    else:
+        status = "failed"
+    async with _get_pool().write() as db:
+        await db.execute(
+            "UPDATE payment_jobs SET status = ?, last_error = ?, available_at = COALESCE(?, available_at), "
+            "updated_at = CURRENT_TIMESTAMP WHERE payment_id = ?",
+            (status, error, retry_at, payment_id),
+        )
+
+
+@db_metrics
+async def requeue_stale_payment_jobs() -> int:
+    """Вернуть в очередь задачи, прерванные остановкой процесса."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "UPDATE payment_jobs SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'processing'"
+        )
+        return cursor.rowcount
+
+
+@db_metrics
+async def sync_subscription_changes() -> int:
+    """Применить изменения подписок, сделанные другими процессами: вызвать слушателей.
+
+    Возвращает число новых записей журнала.
+    """
+    global _changes_cursor
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT id, uuid FROM subscription_changes WHERE id > ? ORDER BY id",
+            (_changes_cursor,),
+        )
+    if rows:
+        _changes_cursor = rows[-1][0]
+        _notify_subscription_changed({row[1] for row in rows})
+    return len(rows)
+
+
+@db_metrics
+async def prune_subscription_changes(keep: int = SUBSCRIPTION_CHANGES_KEEP) -> int:
+    """Удалить старые записи журнала, оставив последние keep."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "DELETE FROM subscription_changes WHERE id <= (SELECT MAX(id) FROM subscription_changes) - ?",
+            (keep,),
+        )
+        return cursor.rowcount
+
+
+@db_metrics
+async def save_server_loads(loads: list[dict]):
+    """Записать замеры нагрузки серверов в общую таблицу (более старые не затирают новые)."""
+    async with _get_pool().write() as db:
+        await db.executemany(
+            "INSERT INTO server_load (server_name, online, connections, sampled_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (server_name) DO UPDATE SET online = excluded.online, "
+            "connections = excluded.connections, sampled_at = excluded.sampled_at "
+            "WHERE excluded.sampled_at > server_load.sampled_at",
+            [
+                (
+                    load["name"],
+                    load["online"],
+                    None if load["connections"] is None else json.dumps(load["connections"]),
+                    load["sampled_at"],
+                )
+                for load in loads
+            ],
+        )
+
+
+@db_metrics
+async def accept_agent_push(server_name: str, sent_at: float) -> bool:
+    """Запомнить время снапшота агента, если оно новее принятого ранее любым воркером.
+
+    False — снапшот не новее последнего принятого (повтор).
+    """
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "INSERT INTO agent_pushes (server_name, sent_at) VALUES (?, ?) "
+            "ON CONFLICT (server_name) DO UPDATE SET sent_at = excluded.sent_at "
+            "WHERE excluded.sent_at > agent_pushes.sent_at",
+            (server_name, sent_at),
+        )
+        return cursor.rowcount > 0
+
+
+@db_metrics
+async def get_server_loads() -> list[dict]:
+    """Замеры нагрузки серверов из общей таблицы."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("SELECT server_name, online, connections, sampled_at FROM server_load")
+    return [
+        {
+            "name": row[0],
+            "online": row[1],
+            "connections": None if row[2] is None else json.loads(row[2]),
+            "sampled_at": row[3],
+        }
+        for row in rows
+    ]
+
+
+@db_metrics
+async def save_worker_metrics(worker: int, payload: dict):
+    """Записать снапшот метрик воркера."""
+    async with _get_pool().write() as db:
+        await db.execute(
+            "INSERT INTO worker_metrics (worker, payload, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at",
+            (worker, json.dumps(payload), time.time()),
+        )
+
+
+@db_metrics
+async def get_worker_metrics() -> dict[int, dict]:
+    """Последние снапшоты метрик всех воркеров: {номер: снапшот}."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("SELECT worker, payload FROM worker_metrics")
+    return {row[0]: json.loads(row[1]) for row in rows}
+
+
+@db_metrics
+async def clear_worker_metrics():
+    """Забыть метрики прошлого запуска (перед стартом воркеров)."""
+    async with _get_pool().write() as db:
+        await db.execute("DELETE FROM worker_metrics")
+
+
+@db_metrics
+async def enqueue_message(
+    chat_id: int, payload: str, dedup_key: str | None = None, available_at: float | None = None,
+) -> bool:
+    """Поставить сообщение в outbox. False — сообщение с таким dedup_key уже было."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO outbox (chat_id, payload, dedup_key, available_at) VALUES (?, ?, ?, ?)",
+            (chat_id, payload, dedup_key, available_at or time.time()),
+        )
+        return cursor.rowcount == 1
+
+
+@db_metrics
+async def claim_messages(limit: int) -> list[dict]:
+    """Взять в отправку до limit готовых сообщений, старые первыми."""
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall(
+            "SELECT * FROM outbox WHERE status = 'pending' AND available_at <= ? "
+            "ORDER BY available_at LIMIT ?",
+            (time.time(), limit),
+        )
+        if not rows:
+            return []
+        await db.executemany(
+            "UPDATE outbox SET status = 'sending', attempts = attempts + 1, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(row["id"],) for row in rows],
+        )
+    messages = [dict(row) for row in rows]
+    for message in messages:
+        message["attempts"] += 1
+    return messages
+
+
+@db_metrics
+async def finish_message(message_id: int, error: str | None = None, retry_at: float | None = None):
+    """Закрыть сообщение: sent, отложить на retry_at или failed."""
+    if error is None:
+        status = "sent"
+    elif retry_at is not None:
+        status = "pending"
+    else:
+        status = "failed"
+    async with _get_pool().write() as db:
+        await db.execute(
+            "UPDATE outbox SET status = ?, last_error = ?, available_at = COALESCE(?, available_at), "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (status, error, retry_at, message_id),
+        )
+
+
+@db_metrics
+async def requeue_stale_messages() -> int:
+    """Вернуть в очередь сообщения, прерванные остановкой процесса."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "UPDATE outbox SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'sending'"
+        )
+        return cursor.rowcount
+
+
+@db_metrics
+async def prune_outbox(keep_days: int = OUTBOX_KEEP_DAYS) -> int:
+    """Удалить давно отправленные и отклонённые сообщения."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < datetime('now', ?)",
+            (f"-{keep_days} days",),
+        )
+        return cursor.rowcount
+
+
+@db_metrics
+async def start_broadcast(payload: str) -> int:
+    """Создать рассылку всем пользователям; вернуть её id."""
+    async with _get_pool().write() as db:
+        cursor = await db.execute("INSERT INTO broadcasts (payload) VALUES (?)", (payload,))
+        return cursor.lastrowid
+
+
+@db_metrics
+async def queue_broadcast_batch(window: int, batch_size: int) -> int:
+    """Дописать в outbox следующую порцию получателей активной рассылки.
+
+    Получатели идут по telegram_id от курсора рассылки прямо в SQL, в память
+    не читаются. Пока в очереди не меньше window сообщений, ничего не
+    добавляется. Возвращает число добавленных получателей.
+    """
+    # Обычно рассылки нет или очередь полна: проверяем без блокировки записи
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall("SELECT 1 FROM broadcasts WHERE status = 'active' LIMIT 1")
+        if not rows:
+            return 0
+        rows = await db.execute_fetchall("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+        if rows[0][0] >= window:
+            return 0
+
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall(
+            "SELECT id, payload, last_telegram_id FROM broadcasts WHERE status = 'active' ORDER BY id LIMIT 1"
+        )
+        if not rows:
+            return 0
+        broadcast_id, payload, cursor_id = rows[0]
+
+        # Последний получатель порции — batch_size-й после курсора
+        rows = await db.execute_fetchall(
+            "SELECT telegram_id FROM users WHERE telegram_id > ? ORDER BY telegram_id LIMIT 1 OFFSET ?",
+            (cursor_id, batch_size - 1),
+        )
+        if rows:
+            count, last_id = batch_size, rows[0][0]
+        else:
+            rows = await db.execute_fetchall(
+                "SELECT COUNT(*), MAX(telegram_id) FROM users WHERE telegram_id > ?", (cursor_id,),
+            )
+            count, last_id = rows[0]
+        if count:
+            await db.execute(
+                "INSERT OR IGNORE INTO outbox (chat_id, payload, dedup_key, available_at) "
+                "SELECT telegram_id, ?, 'broadcast:' || ? || ':' || telegram_id, ? "
+                "FROM users WHERE telegram_id > ? AND telegram_id <= ?",
+                (payload, broadcast_id, time.time(), cursor_id, last_id),
+            )
+        await db.execute(
+            "UPDATE broadcasts SET last_telegram_id = COALESCE(?, last_telegram_id), queued = queued + ?, "
+            "status = CASE WHEN ? < ? THEN 'done' ELSE status END, "
+            "finished_at = CASE WHEN ? < ? THEN CURRENT_TIMESTAMP END "
+            "WHERE id = ?",
+            (last_id, count, count, batch_size, count, batch_size, broadcast_id),
+        )
+        return count
+
+
+@db_metrics
+async def get_broadcasts(limit: int = 20) -> list[dict]:
+    """Последние рассылки с прогрессом: сколько поставлено, отправлено и отклонено."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT id, queued, status, created_at, finished_at FROM broadcasts ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+        broadcasts = [dict(row) for row in rows]
+        for broadcast in broadcasts:
+            counts = await db.execute_fetchall(
+                "SELECT status, COUNT(*) FROM outbox WHERE dedup_key >= ? AND dedup_key < ? GROUP BY status",
+                (f"broadcast:{broadcast['id']}:", f"broadcast:{broadcast['id']};"),
+            )
+            broadcast["messages"] = {row[0]: row[1] for row in counts}
+    return broadcasts
+
+
+@db_metrics
+async def save_traffic(bucket: int, traffic: dict[str, list[int]]):
+    """Прибавить трафик за минуту bucket к активным подпискам: {email: [upload, download]}.
+
+    email — первые 8 символов UUID, как в конфиге Xray. Подписка находится
+    по диапазону UUID с этим началом; трафик ключей без активной подписки
+    отбрасывается. Все серверы и пользователи — одна транзакция.
+    """
+    async with _get_pool().write() as db:
+        await db.executemany(
+            """
+            INSERT INTO traffic (subscription_id, period, bucket, upload, download)
+            SELECT id, ?, ?, ?, ? FROM subscriptions
+            WHERE id = (SELECT MAX(id) FROM subscriptions WHERE uuid >= ? AND uuid < ? AND is_active = 1)
+            ON CONFLICT (subscription_id, period, bucket) DO UPDATE SET
+                upload = upload + excluded.upload, download = download + excluded.download
+            """,
+            [
+                (TRAFFIC_MINUTE, bucket, upload, download, f"{email}-", f"{email}.")
+                for email, (upload, download) in traffic.items()
+            ],
+        )
+
+
+@db_metrics
+async def get_traffic_usage(subscription_id: int) -> tuple[int, int]:
+    """Трафик подписки за всё время: (upload, download) в байтах."""
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT COALESCE(SUM(upload), 0), COALESCE(SUM(download), 0) FROM traffic WHERE subscription_id = ?",
+            (subscription_id,),
+        )
+    return rows[0][0], rows[0][1]
+
+
+async def _rollup_traffic_bucket(source: int, target: int, before: int) -> int:
+    """Свернуть самый старый интервал target из строк source старше before.
+
+    Возвращает число свёрнутых строк; 0 — сворачивать нечего.
+    """
+    async with _get_pool().write() as db:
+        rows = await db.execute_fetchall(
+            "SELECT bucket FROM traffic WHERE period = ? AND bucket < ? ORDER BY bucket LIMIT 1",
+            (source, before),
+        )
+        if not rows:
+            return 0
+        start = rows[0][0] - rows[0][0] % target
+        await db.execute(
+            """
+            INSERT INTO traffic (subscription_id, period, bucket, upload, download)
+            SELECT subscription_id, ?, ?, SUM(upload), SUM(download) FROM traffic
+            WHERE period = ? AND bucket >= ? AND bucket < ?
+            GROUP BY subscription_id
+            ON CONFLICT (subscription_id, period, bucket) DO UPDATE SET
+                upload = upload + excluded.upload, download = download + excluded.download
+            """,
+            (target, start, source, start, start + target),
+        )
+        cursor = await db.execute(
+            "DELETE FROM traffic WHERE period = ? AND bucket >= ? AND bucket < ?",
+            (source, start, start + target),
+        )
+        return cursor.rowcount
+
+
+@db_metrics
+async def rollup_traffic(now: float | None = None) -> int:
+    """Свернуть старые минутные строки трафика в часовые, часовые — в дневные.
+
+    Каждый целевой интервал — отдельная транзакция. Дневные строки старше
+    TRAFFIC_KEEP_DAYS удаляются. Возвращает число свёрнутых и удалённых строк.
+    """
+    now = time.time() if now is None else now
+    total = 0
+    for source, target, keep in (
+        (TRAFFIC_MINUTE, TRAFFIC_HOUR, TRAFFIC_MINUTE_KEEP),
+        (TRAFFIC_HOUR, TRAFFIC_DAY, TRAFFIC_HOUR_KEEP),
+    ):
+        # Сворачиваем только целиком прошедшие интервалы target
+        before = int(now - keep)
+        before -= before % target
+        while rolled := await _rollup_traffic_bucket(source, target, before):
+            total += rolled
+            # Отдаём писателя другим запросам между интервалами
+            await asyncio.sleep(0)
+
+    async with _get_pool().write() as db:
+        cursor = await db.execute(
+            "DELETE FROM traffic WHERE period = ? AND bucket < ?",
+            (TRAFFIC_DAY, int(now) - TRAFFIC_KEEP_DAYS * TRAFFIC_DAY),
+        )
+        total += cursor.rowcount
+    return total
+
+
+@db_metrics
+async def get_top_traffic(days: int = 30, limit: int = 20) -> list[dict]:
+    """Пользователи с наибольшим трафиком за последние days дней."""
+    since = int(time.time()) - days * TRAFFIC_DAY
+    async with _get_pool().read() as db:
+        rows = await db.execute_fetchall(
+            """
+            SELECT s.telegram_id, u.username, SUM(t.upload) AS upload, SUM(t.download) AS download
+            FROM traffic t
+            JOIN subscriptions s ON s.id = t.subscription_id
+            LEFT JOIN users u ON u.telegram_id = s.telegram_id
+            WHERE t.period IN (?, ?, ?) AND t.bucket >= ?
+            GROUP BY s.telegram_id
+            ORDER BY upload + download DESC
+            LIMIT ?
+            """,
+            (TRAFFIC_MINUTE, TRAFFIC_HOUR, TRAFFIC_DAY, since, limit),
+        )
+    return [dict(row) for row in rows]
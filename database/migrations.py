@@ -0,0 +1,341 @@
+import logging
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Полный пересчёт счётчиков stats и pool_stats с нуля
+STATS_REBUILD = [
+    "DELETE FROM stats",
+    "INSERT INTO stats (key, value) SELECT 'total_users', COUNT(*) FROM users",
+    "INSERT INTO stats (key, value) SELECT 'active_subs', COUNT(*) FROM subscriptions WHERE is_active = 1",
+    "INSERT INTO stats (key, value) SELECT 'revenue', COALESCE(SUM(amount), 0) FROM subscriptions",
+    "DELETE FROM pool_stats",
+    """
+    INSERT INTO pool_stats (server_name, total, used)
+    SELECT server_name, COUNT(*), COALESCE(SUM(is_used), 0) FROM uuid_pool GROUP BY server_name
+    """,
+]
+
+# (версия, описание, SQL). Версия базы хранится в PRAGMA user_version.
+# Новые миграции только дописываются в конец, старые не меняются.
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            full_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            plan_id TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            vless_key TEXT NOT NULL,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP NOT NULL,
+            is_active INTEGER DEFAULT 1,
+            FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS uuid_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT UNIQUE NOT NULL,
+            server_name TEXT NOT NULL,
+            is_used INTEGER DEFAULT 0,
+            telegram_id INTEGER DEFAULT NULL
+        )
+        """,
+    ]),
+    (2, "Индексы горячих запросов", [
+        # get_active_subscription, последняя подписка пользователя в админке
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_telegram_active ON subscriptions (telegram_id, is_active)",
+        # get_subscription_by_uuid: id — это rowid, так что ORDER BY id DESC идёт по индексу
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_uuid ON subscriptions (uuid)",
+        # get_free_uuid / claim_uuid: покрывающий, таблица не читается
+        "CREATE INDEX IF NOT EXISTS idx_uuid_pool_server_free ON uuid_pool (server_name, is_used, uuid)",
+        "ANALYZE",
+    ]),
+    (3, "Индекс истекающих подписок", [
+        # Частичный: в нём только активные, отсортированные по end_date
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_active_end ON subscriptions (end_date) WHERE is_active = 1",
+    ]),
+    (4, "Очередь вебхуков оплаты", [
+        """
+        CREATE TABLE IF NOT EXISTS payment_jobs (
+            payment_id TEXT PRIMARY KEY,
+            telegram_id INTEGER NOT NULL,
+            plan_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_payment_jobs_pending ON payment_jobs (available_at) WHERE status = 'pending'",
+        # Одна оплата — не больше одной подписки
+        "ALTER TABLE subscriptions ADD COLUMN payment_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_payment ON subscriptions (payment_id) WHERE payment_id IS NOT NULL",
+    ]),
+    (5, "Индекс постраничного списка пользователей", [
+        # Ключ keyset-пагинации админки: (created_at, telegram_id)
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, telegram_id)",
+    ]),
+    (6, "Счётчики статистики, поддерживаемые триггерами", [
+        # Фактически оплаченная сумма в копейках; старым подпискам — цена тарифа
+        "ALTER TABLE subscriptions ADD COLUMN amount INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE subscriptions SET amount = 100 * CASE plan_id
+            WHEN 'plan_1' THEN 99
+            WHEN 'plan_3' THEN 199
+            WHEN 'plan_6' THEN 499
+            WHEN 'plan_12' THEN 999
+            WHEN 'plan_test' THEN 1
+            ELSE 0
+        END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pool_stats (
+            server_name TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            used INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users BEGIN
+            UPDATE stats SET value = value + 1 WHERE key = 'total_users';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users BEGIN
+            UPDATE stats SET value = value - 1 WHERE key = 'total_users';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_insert AFTER INSERT ON subscriptions BEGIN
+            UPDATE stats SET value = value + COALESCE(NEW.is_active, 0) WHERE key = 'active_subs';
+            UPDATE stats SET value = value + NEW.amount WHERE key = 'revenue';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_update AFTER UPDATE OF is_active, amount ON subscriptions BEGIN
+            UPDATE stats SET value = value + COALESCE(NEW.is_active, 0) - COALESCE(OLD.is_active, 0)
+                WHERE key = 'active_subs';
+            UPDATE stats SET value = value + NEW.amount - OLD.amount WHERE key = 'revenue';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_delete AFTER DELETE ON subscriptions BEGIN
+            UPDATE stats SET value = value - COALESCE(OLD.is_active, 0) WHERE key = 'active_subs';
+            UPDATE stats SET value = value - OLD.amount WHERE key = 'revenue';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_uuid_pool_insert AFTER INSERT ON uuid_pool BEGIN
+            INSERT INTO pool_stats (server_name, total, used) VALUES (NEW.server_name, 1, COALESCE(NEW.is_used, 0))
+                ON CONFLICT (server_name) DO UPDATE SET total = total + 1, used = used + excluded.used;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_uuid_pool_update AFTER UPDATE OF is_used, server_name ON uuid_pool BEGIN
+            UPDATE pool_stats SET total = total - 1, used = used - COALESCE(OLD.is_used, 0)
+                WHERE server_name = OLD.server_name;
+            INSERT INTO pool_stats (server_name, total, used) VALUES (NEW.server_name, 1, COALESCE(NEW.is_used, 0))
+                ON CONFLICT (server_name) DO UPDATE SET total = total + 1, used = used + excluded.used;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_uuid_pool_delete AFTER DELETE ON uuid_pool BEGIN
+            UPDATE pool_stats SET total = total - 1, used = used - COALESCE(OLD.is_used, 0)
+                WHERE server_name = OLD.server_name;
+        END
+        """,
+        # Начальные значения — полный пересчёт (тот же, что в rebuild_stats)
+        *STATS_REBUILD,
+    ]),
+    (7, "Общее состояние для нескольких процессов", [
+        # Журнал изменённых подписок: по нему воркеры сбрасывают свои кэши /sub
+        """
+        CREATE TABLE IF NOT EXISTS subscription_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_changes_insert AFTER INSERT ON subscriptions BEGIN
+            INSERT INTO subscription_changes (uuid) VALUES (NEW.uuid);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_changes_update
+        AFTER UPDATE OF is_active, end_date, uuid ON subscriptions BEGIN
+            INSERT INTO subscription_changes (uuid) VALUES (NEW.uuid);
+            INSERT INTO subscription_changes (uuid) SELECT OLD.uuid WHERE OLD.uuid IS NOT NEW.uuid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_changes_delete AFTER DELETE ON subscriptions BEGIN
+            INSERT INTO subscription_changes (uuid) VALUES (OLD.uuid);
+        END
+        """,
+        # Последние замеры нагрузки серверов, видимые всем воркерам
+        """
+        CREATE TABLE IF NOT EXISTS server_load (
+            server_name TEXT PRIMARY KEY,
+            online INTEGER NOT NULL,
+            connections TEXT,
+            sampled_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (8, "Очередь исходящих сообщений и рассылки", [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            dedup_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (available_at) WHERE status = 'pending'",
+        # Одно сообщение на событие (оплату, получателя рассылки) даже при повторах
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_dedup ON outbox (dedup_key) WHERE dedup_key IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (updated_at) WHERE status IN ('sent', 'failed')",
+        # Рассылка по всем пользователям: курсор по telegram_id, очередь пополняется порциями
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            last_telegram_id INTEGER NOT NULL DEFAULT 0,
+            queued INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_active ON broadcasts (id) WHERE status = 'active'",
+    ]),
+    (9, "Учёт трафика подписок по интервалам", [
+        # period — длина интервала в секундах (60, 3600, 86400), bucket — его начало, unix-время.
+        # Минутные строки сворачиваются в часовые, часовые — в дневные (rollup_traffic)
+        """
+        CREATE TABLE IF NOT EXISTS traffic (
+            subscription_id INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            upload INTEGER NOT NULL DEFAULT 0,
+            download INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subscription_id, period, bucket)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_traffic_period_bucket ON traffic (period, bucket)",
+    ]),
+    (10, "Возврат в пул UUID, оставшихся занятыми после продления", [
+        # Продление гасило старую подписку, не освобождая её UUID. Такой UUID занят
+        # тем же пользователем, что и последняя (неактивная) подписка на нём;
+        # только что занятый под новую оплату UUID принадлежит другому пользователю
+        """
+        UPDATE uuid_pool SET is_used = 0, telegram_id = NULL
+        WHERE is_used = 1
+          AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.uuid = uuid_pool.uuid AND s.is_active = 1)
+          AND telegram_id = (
+              SELECT s.telegram_id FROM subscriptions s WHERE s.uuid = uuid_pool.uuid ORDER BY s.id DESC LIMIT 1
+          )
+        """,
+    ]),
+    (11, "Защита от повтора пушей агентов, общая для воркеров", [
+        # Время последнего принятого снапшота агента по серверам
+        """
+        CREATE TABLE IF NOT EXISTS agent_pushes (
+            server_name TEXT PRIMARY KEY,
+            sent_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (12, "Метрики воркеров для общего /metrics", [
+        # Последний снапшот метрик каждого воркера (JSON utils.metrics.snapshot())
+        """
+        CREATE TABLE IF NOT EXISTS worker_metrics (
+            worker INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (13, "Недавние выдачи ключей, общие для воркеров", [
+        # Выдачи после последнего замера онлайна (utils.placement)
+        """
+        CREATE TABLE IF NOT EXISTS placements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_name TEXT NOT NULL,
+            placed_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_placements_placed_at ON placements(placed_at)",
+    ]),
+    (14, "Последняя подписка пользователя для админки", [
+        # Ссылка вместо коррелированного MAX(id) на каждую строку списка
+        "ALTER TABLE users ADD COLUMN last_subscription_id INTEGER",
+        """
+        UPDATE users SET last_subscription_id = (
+            SELECT MAX(id) FROM subscriptions WHERE subscriptions.telegram_id = users.telegram_id
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subscriptions_last AFTER INSERT ON subscriptions BEGIN
+            UPDATE users SET last_subscription_id = NEW.id WHERE telegram_id = NEW.telegram_id;
+        END
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(pool) -> int:
+    """Довести схему базы до последней версии. Возвращает итоговую версию."""
+    async with pool.write() as db:
+        current = await get_version(db)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # Каждая миграция — одна транзакция вместе с user_version
+        async with pool.write() as db:
+            if await get_version(db) >= version:
+                # Другой процесс успел раньше
+                current = version
+                continue
+            for sql in statements:
+                await db.execute(sql)
+            await db.execute(f"PRAGMA user_version = {version}")
+        logger.info("Миграция БД %s: %s", version, description)
+        current = version
+
+    return current
@@ -0,0 +1,90 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# Применяются к каждому соединению при открытии
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+
+class ConnectionPool:
+    """Долгоживущие соединения SQLite: один писатель и несколько читателей."""
+
+    def __init__(self, path: str, readers: int = 4, cached_statements: int = 256):
+        self.path = path
+        self.readers = max(1, readers)
+        self.cached_statements = cached_statements
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def open(self):
+        """Открыть писателя (он же включает WAL) и пул читателей."""
+        try:
+            self._writer = await self._connect("PRAGMA journal_mode = WAL")
+            for _ in range(self.readers):
+                conn = await self._connect("PRAGMA query_only = 1")
+                self._all_readers.append(conn)
+                self._idle.put_nowait(conn)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        """Закрыть все соединения."""
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._idle = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    async def set_trace_callback(self, handler):
+        """Передавать каждый выполненный SQL в handler (None — отключить)."""
+        for conn in (self._writer, *self._all_readers):
+            await conn.set_trace_callback(handler)
+
+    async def _connect(self, *extra_pragmas: str) -> aiosqlite.Connection:
+        # cached_statements уходит в sqlite3.connect — кэш подготовленных запросов
+        conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        conn.row_factory = aiosqlite.Row
+        for pragma in (*extra_pragmas, *PRAGMAS):
+            # Незакрытый курсор PRAGMA держит блокировку файла
+            async with conn.execute(pragma) as cursor:
+                await cursor.fetchall()
+        return conn
+
+    @asynccontextmanager
+    async def read(self):
+        """Взять свободное соединение на чтение."""
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Эксклюзивный доступ к писателю: commit при успехе, rollback при ошибке.
+
+        Транзакция открывается BEGIN IMMEDIATE: блокировка записи берётся сразу
+        (с ожиданием busy_timeout), поэтому «прочитал, потом записал» не падает
+        с SQLITE_BUSY, когда в ту же базу пишут другие процессы.
+        """
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
@@ -1,25 +1,51 @@
+import asyncio
+import base64
+import binascii
+import json
 import os
+from contextlib import aclosing
 
 from aiohttp import web
 
 from config.settings import VPN_SERVERS
-from database.db import get_admin_stats, get_admin_users, get_admin_pool, get_admin_connections
-from utils.monitoring import get_connections, get_all_servers_online
+from database.db import (
+    ADMIN_USERS_SORTS,
+    ADMIN_USERS_STATUSES,
+    get_admin_connections,
+    get_admin_pool,
+    get_admin_stats,
+    get_top_traffic,
+    iter_admin_users,
+)
+from utils.live import LiveHub
+from utils.monitoring import get_all_connections, get_servers_online, load_collector
+from utils.static import StaticAssets
 
 ADMIN_HTML = os.path.join(os.path.dirname(os.path.dirname(__file__)), "admin", "panel.html")
 
+ADMIN_USERS_PAGE = 50
+ADMIN_USERS_MAX_PAGE = 500
+# Сколько байт JSON копить перед записью в сокет
+STREAM_CHUNK = 64 * 1024
+# Пинг SSE-потока и задержка переподключения браузера
+LIVE_HEARTBEAT = 15
+LIVE_RETRY_MS = 5000
+
+
+# Загружаются в память при старте (main.py), до этого — при первом запросе
+admin_assets = StaticAssets()
+admin_assets.add("panel", ADMIN_HTML, "text/html")
+
 
 async def admin_panel(request: web.Request) -> web.Response:
-    """Отдаём HTML админки."""
-    with open(ADMIN_HTML, "r", encoding="utf-8") as f:
-        html = f.read()
-    return web.Response(text=html, content_type="text/html")
+    """Отдаём HTML админки из памяти, сжатым и с ETag."""
+    return admin_assets.response(request, "panel")
 
 
-async def admin_stats(request: web.Request) -> web.Response:
-    """API статистики."""
+async def build_stats() -> dict:
+    """Статистика с онлайном серверов."""
     data = await get_admin_stats()
-    online = get_all_servers_online()
+    online = await get_servers_online()
 
     total_online = sum(online.values())
     data["online"] = total_online
@@ -30,28 +56,16 @@ async def admin_stats(request: web.Request) -> web.Response:
             "name": server.get("label", name),
             "online": online.get(name, 0),
             "max": server.get("max_users", 80),
+            "available": name in online,
+            "age": load_collector.age(name),
         })
     data["servers"] = servers
+    return data
 
-    return web.json_response(data)
-
-
-async def admin_users(request: web.Request) -> web.Response:
-    """API пользователей."""
-    data = await get_admin_users()
-    return web.json_response(data)
 
-
-async def admin_pool(request: web.Request) -> web.Response:
-    """API UUID пула."""
-    data = await get_admin_pool()
-    return web.json_response(data)
-
-
-async def admin_connections(request: web.Request) -> web.Response:
-    """API подключений по ключам."""
-    connections = get_connections("germany")
-    users = await get_admin_connections()
+async def build_connections() -> list:
+    """Подключения по ключам с данными пользователей."""
+    connections, users = await asyncio.gather(get_all_connections(), get_admin_connections())
 
     result = []
     for user in users:
@@ -64,5 +78,153 @@ async def admin_connections(request: web.Request) -> web.Response:
             "full_name": user["full_name"],
             "devices": devices,
         })
+    return result
+
+
+# Один снапшот на все открытые вкладки админки
+live_hub = LiveHub({
+    "stats": build_stats,
+    "connections": build_connections,
+    "pool": get_admin_pool,
+})
+
+
+async def admin_stats(request: web.Request) -> web.Response:
+    """API статистики."""
+    return web.json_response(await build_stats())
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# Типы значений курсора по ключам сортировки: другое в SQL не передаём
+CURSOR_TYPES = {"created_at": str, "telegram_id": int}
+
+
+def _decode_cursor(raw: str, keys: list[str]) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(raw.encode()))
+    except (binascii.Error, ValueError):
+        raise web.HTTPBadRequest(text="bad cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise web.HTTPBadRequest(text="bad cursor")
+    for key, value in zip(keys, values):
+        # bool — подкласс int, но ключом не бывает
+        if not isinstance(value, CURSOR_TYPES[key]) or isinstance(value, bool):
+            raise web.HTTPBadRequest(text="bad cursor")
+    return values
+
+
+async def admin_users(request: web.Request) -> web.StreamResponse:
+    """API пользователей: keyset-пагинация, фильтры, потоковый JSON.
+
+    Параметры: limit, cursor (next_cursor прошлой страницы), sort (created_at|telegram_id),
+    order (desc|asc), status (active|expired|none), plan, q (username, имя или telegram_id).
+    Ответ: {"items": [...], "next_cursor": "..." | null}.
+    """
+    query = request.query
+    sort = query.get("sort", "created_at")
+    order = query.get("order", "desc")
+    status = query.get("status") or None
+    if sort not in ADMIN_USERS_SORTS or order not in ("asc", "desc"):
+        raise web.HTTPBadRequest(text="bad sort")
+    if status and status not in ADMIN_USERS_STATUSES:
+        raise web.HTTPBadRequest(text="bad status")
+    try:
+        limit = min(max(int(query.get("limit", ADMIN_USERS_PAGE)), 1), ADMIN_USERS_MAX_PAGE)
+    except ValueError:
+        raise web.HTTPBadRequest(text="bad limit")
+
+    keys = [column.split(".")[-1] for column in ADMIN_USERS_SORTS[sort]]
+    after = _decode_cursor(query["cursor"], keys) if query.get("cursor") else None
+
+    response = web.StreamResponse(headers={"Content-Type": "application/json; charset=utf-8"})
+    # Размер заранее неизвестен, а страница почти всегда больше JSON_COMPRESS_MIN
+    response.enable_compression()
+    await response.prepare(request)
+
+    chunk = ['{"items":[']
+    size = 0
+    count = 0
+    last = None
+    has_more = False
+    # Берём на одну строку больше, чтобы знать, есть ли следующая страница
+    users = iter_admin_users(
+        limit=limit + 1,
+        after=after,
+        sort=sort,
+        descending=order == "desc",
+        status=status,
+        plan_id=query.get("plan") or None,
+        search=query.get("q") or None,
+    )
+    async with aclosing(users):
+        async for user in users:
+            if count == limit:
+                has_more = True
+                break
+            item = json.dumps(user, ensure_ascii=False)
+            chunk.append("," + item if count else item)
+            size += len(item)
+            count += 1
+            last = user
+            if size >= STREAM_CHUNK:
+                await response.write("".join(chunk).encode())
+                chunk = []
+                size = 0
+
+    next_cursor = _encode_cursor([last[key] for key in keys]) if has_more else None
+    chunk.append('],"next_cursor":' + json.dumps(next_cursor) + "}")
+    await response.write("".join(chunk).encode())
+    await response.write_eof()
+    return response
+
 
-    return web.json_response(result)
\ No newline at end of file
+async def admin_pool(request: web.Request) -> web.Response:
+    """API UUID пула."""
+    data = await get_admin_pool()
+    return web.json_response(data)
+
+
+async def admin_connections(request: web.Request) -> web.Response:
+    """API подключений по ключам."""
+    return web.json_response(await build_connections())
+
+
+async def admin_traffic(request: web.Request) -> web.Response:
+    """API пользователей с наибольшим трафиком: ?days=30&limit=20."""
+    try:
+        days = min(max(int(request.query.get("days", 30)), 1), 400)
+        limit = min(max(int(request.query.get("limit", 20)), 1), ADMIN_USERS_MAX_PAGE)
+    except ValueError:
+        raise web.HTTPBadRequest(text="bad days or limit")
+    return web.json_response(await get_top_traffic(days, limit))
+
+
+async def admin_live(request: web.Request) -> web.StreamResponse:
+    """Server-Sent Events: секции stats, connections и pool при каждом изменении."""
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    await response.write(f"retry: {LIVE_RETRY_MS}\n\n".encode())
+
+    queue = await live_hub.subscribe()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=LIVE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Комментарий-пинг: заодно замечаем закрытые вкладки
+                message = b": ping\n\n"
+            if message is None:
+                break
+            await response.write(message)
+    except ConnectionResetError:
+        pass
+    finally:
+        live_hub.unsubscribe(queue)
+    return response
@@ -0,0 +1,66 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+from aiohttp import web
+
+from config import settings
+from config.settings import VPN_SERVERS
+from database.db import accept_agent_push
+from utils.monitoring import record_push
+from utils.traffic import traffic_meter
+
+logger = logging.getLogger(__name__)
+
+# Допустимое расхождение часов агента и бота, сек
+AGENT_MAX_SKEW = getattr(settings, "AGENT_MAX_SKEW", 60)
+
+
+def _signature(secret: str, timestamp: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+
+
+async def agent_push(request: web.Request) -> web.Response:
+    """Приём снапшота от агента ноды: подпись HMAC-SHA256 секретом сервера, защита от повторов."""
+    server_name = request.headers.get("X-Agent-Server", "")
+    secret = VPN_SERVERS.get(server_name, {}).get("agent_secret")
+    if not secret:
+        raise web.HTTPForbidden(text="unknown server")
+
+    body = await request.read()
+    timestamp = request.headers.get("X-Agent-Timestamp", "")
+    signature = request.headers.get("X-Agent-Signature", "")
+    if not hmac.compare_digest(signature, _signature(secret, timestamp, body)):
+        logger.warning("Неверная подпись агента %s", server_name)
+        raise web.HTTPForbidden(text="bad signature")
+
+    try:
+        sent_at = float(timestamp)
+    except ValueError:
+        raise web.HTTPForbidden(text="bad timestamp")
+    # not <= — чтобы "nan" тоже отсекался
+    if not abs(time.time() - sent_at) <= AGENT_MAX_SKEW:
+        raise web.HTTPForbidden(text="stale or replayed")
+
+    try:
+        data = json.loads(body)
+        online = int(data["online"])
+        connections = {str(email): int(devices) for email, devices in data["connections"].items()}
+        # Трафик с прошлого удачного пуша: {email: [upload, download]}; у старых агентов его нет
+        traffic = {
+            str(email): [int(upload), int(download)]
+            for email, (upload, download) in data.get("traffic", {}).items()
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise web.HTTPBadRequest(text="bad snapshot")
+    if any(upload < 0 or download < 0 for upload, download in traffic.values()):
+        raise web.HTTPBadRequest(text="bad snapshot")
+
+    # Время последнего снапшота — в базе: повтор не пройдёт и через другой воркер
+    if not await accept_agent_push(server_name, sent_at):
+        raise web.HTTPForbidden(text="stale or replayed")
+    record_push(server_name, online, connections)
+    traffic_meter.ingest(traffic)
+    return web.Response(status=204)
@@ -1,16 +1,15 @@
+import logging
 import uuid
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from yookassa import Configuration, Payment
 
-from config.settings import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
 from utils.texts import PLAN_DETAILS, get_plan_text
+from utils.yookassa_client import YooKassaError, yookassa_client
 
-router = Router()
+logger = logging.getLogger(__name__)
 
-Configuration.account_id = YOOKASSA_SHOP_ID
-Configuration.secret_key = YOOKASSA_SECRET_KEY
+router = Router()
 
 
 @router.callback_query(F.data.startswith("plan_"))
@@ -23,25 +22,33 @@ async def on_select_plan(callback: CallbackQuery):
         return
 
     plan = PLAN_DETAILS[plan_id]
+    # Ответ на callback ждут недолго, а запрос к ЮКассе с повторами может
+    # занять до ~30 с: отвечаем сразу, результат — в сообщении
+    await callback.answer("Создаём платёж…")
+
+    try:
+        payment = await yookassa_client.create_payment({
+            "amount": {
+                "value": str(plan["price"]) + ".00",
+                "currency": "RUB",
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": "https://t.me/YOUR_BOT_USERNAME",
+            },
+            "capture": True,
+            "description": f"SyntaxVPN — {plan['name']}",
+            "metadata": {
+                "telegram_id": str(callback.from_user.id),
+                "plan_id": plan_id,
+            },
+        }, str(uuid.uuid4()))
+    except YooKassaError:
+        logger.exception("Не удалось создать платёж: user=%s, plan=%s", callback.from_user.id, plan_id)
+        await callback.message.answer("⚠️ Не удалось создать платёж, попробуйте чуть позже")
+        return
 
-    payment = Payment.create({
-        "amount": {
-            "value": str(plan["price"]) + ".00",
-            "currency": "RUB",
-        },
-        "confirmation": {
-            "type": "redirect",
-            "return_url": "https://t.me/YOUR_BOT_USERNAME",
-        },
-        "capture": True,
-        "description": f"SyntaxVPN — {plan['name']}",
-        "metadata": {
-            "telegram_id": str(callback.from_user.id),
-            "plan_id": plan_id,
-        },
-    }, uuid.uuid4())
-
-    payment_url = payment.confirmation.confirmation_url
+    payment_url = payment["confirmation"]["confirmation_url"]
 
     await callback.message.edit_text(
         text=get_plan_text(plan_id),
@@ -50,5 +57,4 @@ async def on_select_plan(callback: CallbackQuery):
             [InlineKeyboardButton(text="⬅️ Назад", callback_data="connect_vpn")],
         ]),
         parse_mode="HTML",
-    )
-    await callback.answer()
\ No newline at end of file
+    )
\ No newline at end of file
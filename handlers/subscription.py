@@ -1,27 +1,41 @@
 import base64
+import hashlib
 import logging
+from datetime import datetime
 
 from aiohttp import web
 
+from config import settings
 from config.settings import VPN_SERVERS
-from database.db import get_subscription_by_uuid
+from database.db import add_subscription_listener, get_subscription_by_uuid
+from utils.cache import LRUCache
+from utils.traffic import traffic_meter
 from utils.vpn import generate_vless_link
 
 logger = logging.getLogger(__name__)
 
+SUB_CACHE_SIZE = getattr(settings, "SUB_CACHE_SIZE", 10_000)
 
-async def subscription_handler(request: web.Request) -> web.Response:
-    """Отдаёт список серверов для VPN-приложения."""
-    user_uuid = request.match_info.get("uuid", "")
+# UUID → (отпечаток VPN_SERVERS, ETag, base64-ответ, id подписки, окончание в unix-времени)
+_payload_cache = LRUCache(SUB_CACHE_SIZE)
+# Растёт при каждой инвалидации: ответ, собранный до неё, в кэш не кладём
+_generation = 0
 
-    if not user_uuid:
-        return web.Response(status=404, text="Not found")
 
-    # Проверяем что UUID активен
-    sub = await get_subscription_by_uuid(user_uuid)
-    if not sub or not sub["is_active"]:
-        return web.Response(status=403, text="Subscription expired")
+def _invalidate(user_uuid: str):
+    global _generation
+    _generation += 1
+    _payload_cache.pop(user_uuid)
+
 
+add_subscription_listener(_invalidate)
+
+
+def _servers_fingerprint() -> str:
+    return repr(VPN_SERVERS)
+
+
+def _build_payload(user_uuid: str) -> str:
     # Генерируем ссылки на все серверы
     links = []
     for name, server in VPN_SERVERS.items():
@@ -31,13 +45,44 @@ async def subscription_handler(request: web.Request) -> web.Response:
 
     # Happ/V2rayTun ожидает base64
     raw = "\n".join(links)
-    encoded = base64.b64encode(raw.encode()).decode()
-
-    return web.Response(
-        text=encoded,
-        content_type="text/plain",
-        headers={
-            "Subscription-Userinfo": f"upload=0; download=0; total=0; expire=0",
-            "Content-Disposition": "inline",
-        },
-    )
\ No newline at end of file
+    return base64.b64encode(raw.encode()).decode()
+
+
+async def subscription_handler(request: web.Request) -> web.Response:
+    """Отдаёт список серверов для VPN-приложения."""
+    user_uuid = request.match_info.get("uuid", "")
+
+    if not user_uuid:
+        return web.Response(status=404, text="Not found")
+
+    fingerprint = _servers_fingerprint()
+    entry = _payload_cache.get(user_uuid)
+    if entry is None or entry[0] != fingerprint:
+        generation = _generation
+
+        # Проверяем что UUID активен
+        sub = await get_subscription_by_uuid(user_uuid)
+        if not sub or not sub["is_active"]:
+            return web.Response(status=403, text="Subscription expired")
+
+        encoded = _build_payload(user_uuid)
+        etag = hashlib.sha1(encoded.encode()).hexdigest()
+        expire = int(datetime.fromisoformat(sub["end_date"]).timestamp())
+        entry = (fingerprint, etag, encoded, sub["id"], expire)
+        if generation == _generation:
+            _payload_cache.set(user_uuid, entry)
+
+    _, etag, encoded, subscription_id, expire = entry
+    upload, download = await traffic_meter.usage(subscription_id, user_uuid)
+    headers = {
+        # total=0 — без лимита трафика
+        "Subscription-Userinfo": f"upload={upload}; download={download}; total=0; expire={expire}",
+        "Content-Disposition": "inline",
+    }
+
+    if request.if_none_match and any(tag.value == etag for tag in request.if_none_match):
+        response = web.Response(status=304, headers=headers)
+    else:
+        response = web.Response(text=encoded, content_type="text/plain", headers=headers)
+    response.etag = etag
+    return response
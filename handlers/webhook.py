@@ -1,20 +1,29 @@
 import json
 import logging
+from decimal import Decimal, InvalidOperation
 
+import aiosqlite
 from aiohttp import web
-from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from database.db import get_free_uuid, assign_uuid, activate_subscription
+from config.settings import VPN_SERVERS
+from database.db import (
+    activate_subscription,
+    claim_uuid,
+    enqueue_payment_job,
+    get_subscription_by_payment,
+    release_uuid,
+)
 from utils.texts import PLAN_DETAILS
 from utils.vpn import generate_vless_link
-from utils.monitoring import get_best_server
+from utils.outbox import outbox
+from utils.placement import placement
 
 logger = logging.getLogger(__name__)
 
 
 async def yookassa_webhook(request: web.Request) -> web.Response:
-    """Обработчик вебхука от ЮКассы."""
+    """Обработчик вебхука от ЮКассы: проверить, сохранить в очередь и сразу ответить."""
     try:
         data = await request.json()
     except json.JSONDecodeError:
@@ -26,60 +35,109 @@ async def yookassa_webhook(request: web.Request) -> web.Response:
     payment = data.get("object", {})
     metadata = payment.get("metadata", {})
 
+    payment_id = payment.get("id")
     telegram_id = metadata.get("telegram_id")
     plan_id = metadata.get("plan_id")
 
-    if not telegram_id or not plan_id:
+    if not payment_id or not telegram_id or not isinstance(plan_id, str):
         logger.warning("Webhook без metadata: %s", data)
         return web.Response(status=200)
 
-    telegram_id = int(telegram_id)
-    plan = PLAN_DETAILS.get(plan_id)
-
-    if not plan:
+    if plan_id not in PLAN_DETAILS:
         logger.warning("Неизвестный тариф: %s", plan_id)
         return web.Response(status=200)
 
-    # Находим лучший сервер
-    server_name = get_best_server()
-    if not server_name:
-        logger.error("Все серверы переполнены!")
-        bot: Bot = request.app["bot"]
-        await bot.send_message(
-            chat_id=telegram_id,
-            text="⚠️ Оплата прошла, но все серверы заняты. Обратитесь в поддержку.",
-        )
-        return web.Response(status=200)
-
-    # Берём свободный UUID из пула этого сервера
-    user_uuid = await get_free_uuid(server_name)
-    if not user_uuid:
-        logger.error("Нет свободных UUID для сервера %s", server_name)
-        bot: Bot = request.app["bot"]
-        await bot.send_message(
-            chat_id=telegram_id,
-            text="⚠️ Оплата прошла, но все места заняты. Обратитесь в поддержку.",
-        )
+    try:
+        telegram_id = int(telegram_id)
+    except (TypeError, ValueError):
+        # Не строка и не число (список, объект) — такой же мусор, как "abc"
+        logger.warning("Некорректный telegram_id: %s", telegram_id)
         return web.Response(status=200)
 
-    # Помечаем UUID как занятый
-    await assign_uuid(user_uuid, telegram_id)
+    # Повторная доставка той же оплаты просто игнорируется
+    if await enqueue_payment_job(payment_id, telegram_id, plan_id, json.dumps(payment)):
+        request.app["payment_queue"].notify()
+    return web.Response(status=200)
 
-    # Генерируем VLESS ссылку
-    from config.settings import VPN_SERVERS
-    label = VPN_SERVERS[server_name].get("label", server_name)
-    vless_key = generate_vless_link(user_uuid, server_name, f"SyntaxVPN {label}")
 
-    # Сохраняем подписку
-    await activate_subscription(telegram_id, plan_id, user_uuid, vless_key)
+def _paid_amount(job: dict) -> int:
+    """Оплаченная сумма в копейках из сохранённого вебхука; без неё — цена тарифа."""
+    try:
+        amount = json.loads(job["payload"])["amount"]
+        if amount.get("currency", "RUB") == "RUB":
+            return int(Decimal(amount["value"]) * 100)
+    except (KeyError, TypeError, ValueError, InvalidOperation):
+        pass
+    return PLAN_DETAILS[job["plan_id"]]["price"] * 100
+
+
+async def process_payment(job: dict):
+    """Выдать подписку по оплате из очереди. Повторный вызов для той же оплаты безопасен.
+
+    Сообщение пользователю уходит через outbox: одно на оплату (dedup_key),
+    медленный или ограничивающий Telegram не задерживает и не роняет обработку.
+    """
+    payment_id = job["payment_id"]
+    telegram_id = job["telegram_id"]
+    plan_id = job["plan_id"]
+    dedup_key = f"payment:{payment_id}"
+
+    sub = await get_subscription_by_payment(payment_id)
+    if sub:
+        # Подписка уже выдана (прошлая попытка упала до постановки сообщения)
+        server_name = None
+        user_uuid = sub["uuid"]
+    else:
+        # Серверы в порядке предпочтения (см. utils/placement.py)
+        servers = await placement.rank()
+        if not servers:
+            logger.error("Все серверы переполнены! Оплата %s", payment_id)
+            await outbox.send(
+                telegram_id,
+                "⚠️ Оплата прошла, но все серверы заняты. Обратитесь в поддержку.",
+                dedup_key=dedup_key,
+            )
+            return
+
+        # Атомарно занимаем свободный UUID; если пул успели разобрать — следующий сервер
+        for server_name in servers:
+            user_uuid = await claim_uuid(server_name, telegram_id)
+            if user_uuid:
+                await placement.record(server_name)
+                break
+        else:
+            logger.error("Нет свободных UUID на серверах %s", servers)
+            await outbox.send(
+                telegram_id,
+                "⚠️ Оплата прошла, но все места заняты. Обратитесь в поддержку.",
+                dedup_key=dedup_key,
+            )
+            return
+
+        try:
+            # Генерируем VLESS ссылку
+            label = VPN_SERVERS[server_name].get("label", server_name)
+            vless_key = generate_vless_link(user_uuid, server_name, f"SyntaxVPN {label}")
+
+            # Сохраняем подписку
+            await activate_subscription(
+                telegram_id, plan_id, user_uuid, vless_key,
+                payment_id=payment_id, amount=_paid_amount(job),
+            )
+        except aiosqlite.IntegrityError:
+            # Эту оплату уже обработал кто-то другой
+            await release_uuid(user_uuid)
+            return
+        except Exception:
+            # Подписка не создана — возвращаем UUID в пул
+            await release_uuid(user_uuid)
+            raise
 
-    # Уведомляем пользователя
     # Уведомляем пользователя
     sub_url = f"https://syntax-vpn.tech/sub/{user_uuid}"
-    bot: Bot = request.app["bot"]
-    await bot.send_message(
-        chat_id=telegram_id,
-        text=(
+    await outbox.send(
+        telegram_id,
+        (
             "Готово! Оплата подтверждена ✅\n\n"
             "Спасибо, что выбрали нас — это много значит для нашей команды. "
             "С любовью, SyntaxVPN 🤍\n\n"
@@ -91,7 +149,7 @@ async def yookassa_webhook(request: web.Request) -> web.Response:
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main")],
         ]),
         parse_mode="HTML",
+        dedup_key=dedup_key,
     )
 
     logger.info("Оплата: user=%s, plan=%s, server=%s, uuid=%s", telegram_id, plan_id, server_name, user_uuid)
-    return web.Response(status=200)
\ No newline at end of file
@@ -1,35 +1,84 @@
 import asyncio
+import hashlib
 import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
 
 from aiohttp import web
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
+from config import settings
 from config.settings import BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_PORT
-from database.db import init_db
+from database.db import init_db, close_db, clear_worker_metrics, requeue_stale_payment_jobs
 from handlers import start
 from handlers import payment
-from handlers.webhook import yookassa_webhook
-from handlers.admin import admin_panel, admin_stats, admin_users, admin_pool, admin_connections
+from handlers.agent import agent_push
+from handlers.webhook import process_payment, yookassa_webhook
+from handlers.admin import (
+    admin_assets,
+    admin_connections,
+    admin_live,
+    admin_panel,
+    admin_pool,
+    admin_stats,
+    admin_traffic,
+    admin_users,
+    live_hub,
+)
 from handlers.subscription import subscription_handler
+from utils.expiry import expiry_scheduler
+from utils.metrics import BotMetricsMiddleware, metrics_handler, metrics_middleware
+from utils.monitoring import load_collector
+from utils.outbox import outbox
+from utils.payment_queue import PaymentQueue
+from utils.pruning import journal_pruner
+from utils.shared_state import shared_state
+from utils.ssh import ssh_sessions
+from utils.static import json_compression_middleware
+from utils.traffic import traffic_meter, traffic_rollup
+from utils.yookassa_client import yookassa_client
 
+# Публичный адрес приложения (https://...). Если задан — апдейты Telegram
+# приходят вебхуком в это же приложение, иначе бот работает через polling
+TELEGRAM_WEBHOOK_URL = getattr(settings, "TELEGRAM_WEBHOOK_URL", None)
+TELEGRAM_WEBHOOK_PATH = getattr(settings, "TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+# Сверяется с X-Telegram-Bot-Api-Secret-Token. По умолчанию выводится из токена,
+# чтобы все инстансы за прокси совпадали без отдельной настройки
+TELEGRAM_WEBHOOK_SECRET = getattr(
+    settings, "TELEGRAM_WEBHOOK_SECRET", hashlib.sha256(BOT_TOKEN.encode()).hexdigest(),
+)
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = getattr(settings, "TELEGRAM_WEBHOOK_MAX_CONNECTIONS", 40)
+
+# Число процессов приложения на одном порту (SO_REUSEPORT, только Linux/BSD).
+# Первый из них — основной: polling/установка вебхука и фоновые задачи
+WORKERS = getattr(settings, "WORKERS", 1)
 
-async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    )
 
-    bot = Bot(token=BOT_TOKEN)
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер бота со всеми роутерами."""
     dp = Dispatcher()
 
+    # Метрики хендлеров; inner middleware наследуется вложенными роутерами
+    dp.message.middleware(BotMetricsMiddleware())
+    dp.callback_query.middleware(BotMetricsMiddleware())
+
     dp.include_router(start.router)
     dp.include_router(payment.router)
+    return dp
 
-    await init_db()
 
-    app = web.Application()
+def create_app(bot: Bot, payment_queue: PaymentQueue) -> web.Application:
+    """aiohttp-приложение: вебхук ЮКассы, подписки, админка, метрики."""
+    app = web.Application(middlewares=[metrics_middleware, json_compression_middleware()])
     app["bot"] = bot
+    app["payment_queue"] = payment_queue
     app.router.add_post(WEBHOOK_PATH, yookassa_webhook)
+    app.router.add_get("/metrics", metrics_handler)
+
+    # Снапшоты от агентов нод
+    app.router.add_post("/agent/push", agent_push)
 
     # Подписка
     app.router.add_get("/sub/{uuid}", subscription_handler)
@@ -40,17 +89,197 @@ async def main():
     app.router.add_get("/admin/api/users", admin_users)
     app.router.add_get("/admin/api/pool", admin_pool)
     app.router.add_get("/admin/api/connections", admin_connections)
+    app.router.add_get("/admin/api/traffic", admin_traffic)
+    app.router.add_get("/admin/api/live", admin_live)
+    return app
+
+
+async def run(
+    bot: Bot,
+    host: str = "0.0.0.0",
+    port: int = WEBHOOK_PORT,
+    dp: Dispatcher | None = None,
+    primary: bool = True,
+    shared: bool = False,
+    worker: int = 0,
+):
+    """Поднять сервер и фоновые задачи и принимать апдейты до сигнала.
+
+    Режим приёма — вебхук Telegram (TELEGRAM_WEBHOOK_URL) или polling,
+    который также останавливается через dp.stop_polling().
+
+    shared=True — один из нескольких процессов на порту: сокет с SO_REUSEPORT,
+    кэши и замеры серверов синхронизируются через базу. Только primary
+    принимает апдейты polling'ом, ставит вебхук, опрашивает ноды и гасит
+    истёкшие подписки; остальные обслуживают HTTP и очередь оплат до сигнала.
+    /metrics отдаёт сумму по всем воркерам (worker — номер процесса).
+    """
+    dp = dp or create_dispatcher()
+
+    await init_db()
+
+    # Оплаты обрабатываются воркерами из очереди, вебхук только сохраняет их
+    payment_queue = PaymentQueue(process_payment)
+
+    admin_assets.load()
+
+    app = create_app(bot, payment_queue)
+    if TELEGRAM_WEBHOOK_URL:
+        # Ответ Telegram сразу, апдейт обрабатывается отдельной задачей
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            handle_in_background=True,
+        ).register(app, path=TELEGRAM_WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT)
+    site = web.TCPSite(runner, host, port, reuse_port=shared)
     await site.start()
 
-    logging.info("Webhook сервер запущен на порту %s", WEBHOOK_PORT)
+    logging.info("Webhook сервер запущен на порту %s", port)
+
+    # Фоновые задачи: нагрузка серверов, истечение подписок, обслуживание базы, очередь оплат
+    if primary:
+        load_collector.start()
+        expiry_scheduler.start()
+        journal_pruner.start()
+        traffic_rollup.start()
+        # Лимиты Telegram общие на бота: отправляет только один процесс
+        await outbox.start(bot)
+    if shared:
+        shared_state.start(worker)
+    # Трафик, пришедший в этот процесс, каждый воркер пишет в базу сам
+    traffic_meter.start()
+    live_hub.start()
+    # Зависшие задачи при нескольких процессах возвращает supervise() до их запуска
+    await payment_queue.start(requeue=not shared)
+
     logging.info("Бот запущен")
 
-    await dp.start_polling(bot)
+    try:
+        if not primary:
+            await _wait_for_signal()
+        elif TELEGRAM_WEBHOOK_URL:
+            await bot.set_webhook(
+                TELEGRAM_WEBHOOK_URL.rstrip("/") + TELEGRAM_WEBHOOK_PATH,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+            )
+            logging.info("Вебхук Telegram: %s%s", TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH)
+            await _wait_for_signal()
+        else:
+            # Вебхук, оставшийся от webhook-режима, не даст читать getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await payment_queue.stop()
+        await outbox.stop()
+        await expiry_scheduler.stop()
+        await journal_pruner.stop()
+        await traffic_rollup.stop()
+        await load_collector.stop()
+        await shared_state.stop()
+        await live_hub.stop()
+        await runner.cleanup()
+        await traffic_meter.stop()
+        ssh_sessions.close_all()
+        await yookassa_client.close()
+        await close_db()
+
+
+async def _wait_for_signal():
+    """Ждать SIGINT/SIGTERM (в polling-режиме это делает aiogram)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+
+
+def _setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(processName)s | %(name)s | %(message)s",
+    )
+
+
+async def main():
+    _setup_logging()
+
+    await run(Bot(token=BOT_TOKEN))
+
+
+def _worker(index: int):
+    """Точка входа процесса-воркера (запускается через spawn)."""
+    _setup_logging()
+    asyncio.run(run(Bot(token=BOT_TOKEN), primary=index == 0, shared=True, worker=index))
+
+
+async def _prepare_shared_db():
+    # Миграции, возврат зависших оплат и сброс метрик прошлого запуска —
+    # один раз, пока воркеры не запущены
+    await init_db()
+    try:
+        await clear_worker_metrics()
+        requeued = await requeue_stale_payment_jobs()
+        if requeued:
+            logging.warning("Возвращено в очередь незавершённых оплат: %s", requeued)
+    finally:
+        await close_db()
+
+
+def supervise(workers: int = WORKERS):
+    """Запустить workers процессов на одном порту и перезапускать упавшие до SIGINT/SIGTERM."""
+    _setup_logging()
+    asyncio.run(_prepare_shared_db())
+
+    # spawn: воркеры не наследуют состояние супервизора (соединения, циклы событий)
+    context = multiprocessing.get_context("spawn")
+    processes: dict[int, multiprocessing.Process] = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        for index in range(workers):
+            process = processes.get(index)
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                logging.error("Воркер %s завершился с кодом %s, перезапуск", index, process.exitcode)
+            process = context.Process(target=_worker, args=(index,), name=f"worker-{index}")
+            process.start()
+            processes[index] = process
+        multiprocessing.connection.wait([p.sentinel for p in processes.values()], timeout=1)
+
+    logging.info("Остановка воркеров")
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WORKERS > 1:
+        supervise()
+    else:
+        asyncio.run(main())
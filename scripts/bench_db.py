@@ -0,0 +1,101 @@
+"""Бенчмарк: отдельное соединение на запрос против общего пула.
+
+Запуск: python scripts/bench_db.py [--rows 2000] [--queries 5000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+sys.path.append(".")
+
+import aiosqlite
+
+from database import db
+
+
+async def legacy_get_subscription_by_uuid(path: str, uuid: str) -> dict | None:
+    """Как было раньше: новое соединение на каждый вызов."""
+    async with aiosqlite.connect(path) as conn:
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.execute(
+            "SELECT * FROM subscriptions WHERE uuid = ? ORDER BY id DESC LIMIT 1",
+            (uuid,),
+        )
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def legacy_add_user(path: str, telegram_id: int) -> bool:
+    async with aiosqlite.connect(path) as conn:
+        try:
+            await conn.execute(
+                "INSERT INTO users (telegram_id, username, full_name) VALUES (?, ?, ?)",
+                (telegram_id, None, "bench"),
+            )
+            await conn.commit()
+            return True
+        except aiosqlite.IntegrityError:
+            return False
+
+
+async def run(label: str, total: int, concurrency: int, make_call) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await make_call(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    qps = total / elapsed
+    print(f"{label:<40} {total:>7} запросов  {elapsed:7.2f} с  {qps:9.0f} q/s")
+    return qps
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await db.init_db(path)
+
+        uuids = [str(uuid_lib.uuid4()) for _ in range(args.rows)]
+        for i, user_uuid in enumerate(uuids):
+            await db.add_user(i, None, "bench")
+            await db.activate_subscription(i, "plan_1", user_uuid, "vless://bench")
+
+        n = len(uuids)
+        print("Чтение /sub (get_subscription_by_uuid):")
+        before = await run(
+            "  до: connect() на каждый запрос", args.queries, args.concurrency,
+            lambda i: legacy_get_subscription_by_uuid(path, uuids[i % n]),
+        )
+        after = await run(
+            "  после: общий пул", args.queries, args.concurrency,
+            lambda i: db.get_subscription_by_uuid(uuids[i % n]),
+        )
+        print(f"  ускорение: x{after / before:.1f}\n")
+
+        print("Повторный /start (add_user существующего пользователя):")
+        before = await run(
+            "  до: connect() на каждый запрос", args.queries, args.concurrency,
+            lambda i: legacy_add_user(path, i % n),
+        )
+        after = await run(
+            "  после: общий пул", args.queries, args.concurrency,
+            lambda i: db.add_user(i % n, None, "bench"),
+        )
+        print(f"  ускорение: x{after / before:.1f}")
+
+        await db.close_db()
+
+
+asyncio.run(main())
@@ -0,0 +1,99 @@
+"""Бенчмарк истечения подписок на большой синтетической таблице.
+
+Замеряет холостой проход (ничего не истекло — обычный случай раз в минуту)
+и полный проход по истёкшим подпискам пачками, с индексом и без.
+
+Запуск: python scripts/bench_expiry.py [--rows 300000] [--due 0.05]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.append(".")
+
+from database import db
+from utils.expiry import ExpiryScheduler
+
+
+def fill(path: str, rows: int, due: float):
+    now = datetime.now()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO uuid_pool (uuid, server_name, is_used, telegram_id) VALUES (?, 'germany', 1, ?)",
+        ((f"uuid-{i}", i) for i in range(rows)),
+    )
+    subs = []
+    for i in range(rows):
+        if random.random() < due:
+            end = now - timedelta(minutes=random.randint(1, 600))
+        else:
+            end = now + timedelta(minutes=random.randint(1, 60 * 24 * 365))
+        subs.append((i, "plan_1", f"uuid-{i}", "vless://bench", end.isoformat()))
+    conn.executemany(
+        "INSERT INTO subscriptions (telegram_id, plan_id, uuid, vless_key, end_date) VALUES (?, ?, ?, ?, ?)",
+        subs,
+    )
+    conn.commit()
+    conn.close()
+
+
+async def measure(path: str, label: str) -> None:
+    await db.init_db(path)
+    scheduler = ExpiryScheduler()
+
+    started = time.perf_counter()
+    expired = await scheduler.run_once()
+    sweep = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await scheduler.run_once()
+    idle = time.perf_counter() - started
+
+    await db.close_db()
+
+    conn = sqlite3.connect(path)
+    free = conn.execute("SELECT COUNT(*) FROM uuid_pool WHERE is_used = 0").fetchone()[0]
+    conn.close()
+    print(f"{label:<22} истекло {expired:>7}  проход {sweep * 1000:9.1f} мс  "
+          f"холостой {idle * 1000:8.2f} мс  освобождено UUID {free}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--due", type=float, default=0.05)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template.db")
+        await db.init_db(template)
+        await db.close_db()
+        fill(template, args.rows, args.due)
+        print(f"подписок: {args.rows}, истёкших: ~{args.due:.0%}")
+
+        with_index = os.path.join(tmp, "with_index.db")
+        without_index = os.path.join(tmp, "without_index.db")
+        for target in (with_index, without_index):
+            src = sqlite3.connect(template)
+            dst = sqlite3.connect(target)
+            src.backup(dst)
+            src.close()
+            dst.close()
+
+        conn = sqlite3.connect(without_index)
+        conn.execute("DROP INDEX idx_subscriptions_active_end")
+        conn.commit()
+        conn.close()
+
+        await measure(with_index, "с индексом end_date")
+        # init_db не пересоздаёт индекс: версия схемы уже последняя
+        await measure(without_index, "без индекса")
+
+
+asyncio.run(main())
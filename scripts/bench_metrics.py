@@ -0,0 +1,71 @@
+"""Накладные расходы метрик: можно ли держать их включёнными в продакшене.
+
+Меряет стоимость Histogram.observe, обёртки db_metrics на реальном запросе
+к базе и HTTP-middleware, затем печатает фрагмент /metrics.
+
+Запуск: python scripts/bench_metrics.py [--calls 20000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+sys.path.append(".")
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from database import db
+from utils import metrics
+
+
+async def timeit(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        await func()
+    return (time.perf_counter() - started) / calls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    histogram = metrics.Histogram("bench_seconds", "bench", ("label",))
+    started = time.perf_counter()
+    for i in range(args.calls):
+        histogram.observe(i * 1e-6, "x")
+    observe = (time.perf_counter() - started) / args.calls
+    print(f"Histogram.observe: {observe * 1e9:.0f} нс")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await db.init_db(os.path.join(tmp, "bench.db"))
+        await db.add_user(1, "bench", "bench")
+        # __wrapped__ — та же функция без декоратора
+        raw = await timeit(lambda: db.get_active_subscription.__wrapped__(1), args.calls)
+        wrapped = await timeit(lambda: db.get_active_subscription(1), args.calls)
+        await db.close_db()
+    print(f"get_active_subscription: {raw * 1e6:.1f} мкс без метрик, {wrapped * 1e6:.1f} мкс с метриками")
+
+    async def ping(request):
+        return web.Response(text="ok")
+
+    results = {}
+    for name, middlewares in (("без метрик", []), ("с метриками", [metrics.metrics_middleware])):
+        app = web.Application(middlewares=middlewares)
+        app.router.add_get("/ping/{id}", ping)
+        app.router.add_get("/metrics", metrics.metrics_handler)
+        async with TestClient(TestServer(app)) as client:
+            calls = args.calls // 10
+            results[name] = await timeit(lambda: client.get("/ping/1"), calls)
+            if middlewares:
+                text = await (await client.get("/metrics")).text()
+    for name, value in results.items():
+        print(f"HTTP-запрос {name}: {value * 1e6:.0f} мкс")
+
+    print()
+    print("\n".join(line for line in text.splitlines() if "ping" in line or "get_active_subscription" in line)[:2000])
+
+
+asyncio.run(main())
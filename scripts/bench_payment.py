@@ -0,0 +1,122 @@
+"""Бенчмарк создания платежей против локальной заглушки API ЮКассы.
+
+Имитирует одновременный выбор тарифа N пользователями. «До» — синхронный
+SDK yookassa прямо в event loop (если пакет установлен), «после» —
+асинхронный клиент utils.yookassa_client. Параллельно меряется, на сколько
+замирает event loop (так же замирали бы ответы остальным пользователям).
+
+Запуск: python scripts/bench_payment.py [--users 20] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+import uuid
+sys.path.append(".")
+
+from aiohttp import web
+
+from utils.yookassa_client import YooKassaClient
+
+PORT = 8765
+
+
+def fake_yookassa(latency: float) -> web.Application:
+    """Заглушка POST /v3/payments с задержкой как у настоящего API."""
+
+    async def create(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(latency)
+        payment_id = str(uuid.uuid4())
+        return web.json_response({
+            "id": payment_id,
+            "status": "pending",
+            "amount": body["amount"],
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://pay.local/{payment_id}"},
+            "metadata": body.get("metadata", {}),
+        })
+
+    app = web.Application()
+    app.router.add_post("/v3/payments", create)
+    return app
+
+
+def payload(i: int) -> dict:
+    return {
+        "amount": {"value": "99.00", "currency": "RUB"},
+        "confirmation": {"type": "redirect", "return_url": "https://t.me/bench"},
+        "capture": True,
+        "description": "bench",
+        "metadata": {"telegram_id": str(i), "plan_id": "plan_1"},
+    }
+
+
+async def run(label: str, users: int, create_one) -> None:
+    stalls = []
+
+    async def watchdog():
+        # Максимальная задержка тика event loop
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - tick - 0.01)
+
+    dog = asyncio.create_task(watchdog())
+    await asyncio.sleep(0.02)
+    started = time.perf_counter()
+    await asyncio.gather(*(create_one(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    # Даём watchdog записать последний тик
+    await asyncio.sleep(0.02)
+    dog.cancel()
+    print(f"{label:<34} {users} платежей за {elapsed:6.2f} с, "
+          f"макс. зависание loop {max(stalls, default=0) * 1000:7.1f} мс")
+
+
+def serve_in_thread(latency: float) -> None:
+    """Заглушка работает в своём потоке и loop, чтобы блокировка бота её не останавливала."""
+    ready = threading.Event()
+
+    def target():
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(fake_yookassa(latency))
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", PORT).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=target, daemon=True).start()
+    ready.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    serve_in_thread(args.latency)
+    api_url = f"http://127.0.0.1:{PORT}/v3"
+    print(f"задержка API: {args.latency * 1000:.0f} мс")
+
+    try:
+        from yookassa import Configuration, Payment
+    except ImportError:
+        print("пакет yookassa не установлен — замер «до» пропущен")
+    else:
+        Configuration.configure("bench", "bench", api_url=api_url)
+
+        async def sync_create(i: int):
+            # Как раньше в on_select_plan: блокирующий HTTPS прямо в event loop
+            return Payment.create(payload(i), uuid.uuid4())
+
+        await run("до: синхронный SDK", args.users, sync_create)
+
+    client = YooKassaClient("bench", "bench", api_url=api_url)
+    await run("после: асинхронный клиент", args.users,
+              lambda i: client.create_payment(payload(i), str(uuid.uuid4())))
+    await client.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,174 @@
+"""Симуляция выбора сервера на всплесках оплат.
+
+Синтетические серверы с разной ёмкостью и пулом UUID, один из них с
+упавшим мониторингом. Между всплесками коллектор «замеряет» онлайн
+(доля выданных ключей плюс шум), внутри всплеска замеры не обновляются —
+как в бою, когда оплаты приходят быстрее периода опроса. Сравнивает
+старый выбор (меньше всего онлайна) с utils.placement: отказы, доля
+всплеска на одном сервере и итоговую загрузку ключами к max_users.
+
+Гистерезис сравнивается по числу смен сервера между соседними выдачами.
+
+Запуск: python scripts/bench_placement.py [--bursts 12] [--burst 40]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+sys.path.append(".")
+
+from config.settings import VPN_SERVERS
+from database import db
+from utils.monitoring import get_servers_online, load_collector
+from utils.placement import PlacementEngine
+
+# Имя → (max_users, размер пула UUID, мониторинг сломан)
+SERVERS = {
+    "small": (80, 120, False),
+    "medium": (80, 300, False),
+    "large": (160, 600, False),
+    "blind": (80, 300, True),
+}
+ONLINE_SHARE = 0.3
+
+
+class Legacy:
+    """Прежний get_best_server: наименьший онлайн, пул не учитывается."""
+
+    async def rank(self) -> list[str]:
+        online = await get_servers_online(fallback="stale")
+        candidates = [
+            (count, name) for name, count in online.items()
+            if count < VPN_SERVERS[name]["max_users"]
+        ]
+        return [min(candidates)[1]] if candidates else []
+
+    async def record(self, name: str):
+        pass
+
+
+def sample(keys: dict[str, int], rng: random.Random):
+    """Замер онлайна: у сломанного сервера замер не обновляется."""
+    now = time.time()
+    for name, (max_users, _, blind) in SERVERS.items():
+        if blind:
+            continue
+        online = int(keys[name] * ONLINE_SHARE + rng.gauss(0, 2))
+        load_collector.record(name, max(0, min(online, max_users)), now)
+
+
+async def simulate(strategy, path: str, bursts: int, burst: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    await db.init_db(path)
+    for name, (_, pool, _) in SERVERS.items():
+        await db.load_uuids_to_pool([str(uuid_lib.uuid4()) for _ in range(pool)], name)
+
+    load_collector.snapshot.clear()
+    # Последний удачный замер «слепого» сервера — давний, дальше только ошибки
+    load_collector.record("blind", 0, time.time() - 1000)
+    load_collector.snapshot["blind"]["error"] = "unavailable"
+
+    keys = {name: 0 for name in SERVERS}
+    failures = 0
+    # Смены сервера между соседними выдачами
+    switches = 0
+    last = None
+    shares = []
+    telegram_id = 0
+    for _ in range(bursts):
+        sample(keys, rng)
+        placed = {name: 0 for name in SERVERS}
+        for _ in range(burst):
+            telegram_id += 1
+            for name in await strategy.rank():
+                if await db.claim_uuid(name, telegram_id):
+                    await strategy.record(name)
+                    keys[name] += 1
+                    placed[name] += 1
+                    switches += last is not None and name != last
+                    last = name
+                    break
+            else:
+                failures += 1
+        shares.append(max(placed.values()) / burst)
+
+    await db.close_db()
+    utilization = {name: keys[name] / SERVERS[name][0] for name in SERVERS}
+    return {
+        "failures": failures, "share": sum(shares) / len(shares), "switches": switches,
+        "keys": keys, "utilization": utilization,
+    }
+
+
+async def check_shared(path: str):
+    """Выдача одного воркера видна движку другого: онлайн растёт, сервер уходит в конец."""
+    await db.init_db(path)
+    for name, (_, pool, _) in SERVERS.items():
+        await db.load_uuids_to_pool([str(uuid_lib.uuid4()) for _ in range(pool)], name)
+    load_collector.snapshot.clear()
+    for name in SERVERS:
+        load_collector.record(name, 0, time.time() - 1)
+    worker, other = PlacementEngine(fallback="stale"), PlacementEngine(fallback="stale")
+    first = (await other.rank())[0]
+    await worker.record(first)
+    scores = {r["name"]: r for r in await other.evaluate()}
+    await db.close_db()
+    assert scores[first]["terms"]["online"] > 0, "выдача другого воркера не учтена в онлайне"
+    assert scores[first]["last_placed"] > 0
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bursts", type=int, default=12)
+    parser.add_argument("--burst", type=int, default=40, help="оплат во всплеске")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Синтетические серверы вместо настроенных
+    VPN_SERVERS.clear()
+    for name, (max_users, _, _) in SERVERS.items():
+        VPN_SERVERS[name] = {"label": name, "max_users": max_users}
+
+    strategies = {
+        "прежний (мин. онлайн)": Legacy(),
+        "placement": PlacementEngine(fallback="stale"),
+        "placement без гистерезиса": PlacementEngine(hysteresis=0, fallback="stale"),
+    }
+    total = args.bursts * args.burst
+    print(f"Оплат: {total} ({args.bursts} всплесков по {args.burst}), пул: "
+          + ", ".join(f"{name} {pool}/{max_users}" for name, (max_users, pool, _) in SERVERS.items())
+          + " (UUID/max_users)")
+    print()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (label, strategy) in enumerate(strategies.items()):
+            result = results[label] = await simulate(
+                strategy, os.path.join(tmp, f"sim{i}.db"), args.bursts, args.burst, args.seed,
+            )
+            spread = max(result["utilization"].values()) - min(result["utilization"].values())
+            print(f"{label}")
+            print(f"  отказов: {result['failures']}, доля всплеска на одном сервере: {result['share']:.0%}, "
+                  f"смен сервера: {result['switches']}")
+            print("  ключей / max_users: " + ", ".join(
+                f"{name} {result['keys'][name]} ({result['utilization'][name]:.2f})" for name in SERVERS
+            ) + f", разброс {spread:.2f}")
+
+        await check_shared(os.path.join(tmp, "shared.db"))
+
+    engine = results["placement"]
+    legacy = results["прежний (мин. онлайн)"]
+    assert engine["failures"] <= legacy["failures"], "placement отказывает чаще прежнего выбора"
+    assert engine["failures"] == 0 or total > sum(pool for _, pool, _ in SERVERS.values())
+    assert engine["share"] < legacy["share"], "всплески по-прежнему уходят на один сервер"
+    flapping = results["placement без гистерезиса"]["switches"]
+    assert engine["switches"] < flapping, f"гистерезис не уменьшил смены сервера: {engine['switches']} >= {flapping}"
+    print()
+    print("OK: placement без отказов при свободных UUID, распределяет всплески и не мечется между серверами")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,114 @@
+"""Повторные /start: сколько записей в базу делает add_user.
+
+Заполняет временную базу пользователями, ограничивает кэш известных
+пользователей меньше их числа (чтобы сработал и bloom-фильтр) и гоняет
+add_user по сценариям: недавние пользователи (кэш), старые (фильтр и
+проверка чтением), новые, смена имени. Считает транзакции записи и
+чтения по трассировке SQL и время на вызов.
+
+Запуск: python scripts/bench_start.py [--users 50000] [--cache 10000] [--calls 5000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(".")
+
+from database import db
+
+
+def seed(path: str, users: int):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (telegram_id, username, full_name, created_at) "
+        "VALUES (?, ?, ?, datetime('now', ?))",
+        # Чем больше id, тем новее пользователь
+        ((i, f"user{i}", f"User {i}", f"-{users - i} seconds") for i in range(1, users + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def scenario(name: str, calls: list[tuple], statements: list[str], expect_new: bool | None = None) -> dict:
+    statements.clear()
+    started = time.perf_counter()
+    results = [await db.add_user(*call) for call in calls]
+    elapsed = time.perf_counter() - started
+    writes = sum(1 for sql in statements if sql.startswith("BEGIN IMMEDIATE"))
+    reads = sum(1 for sql in statements if sql.startswith("SELECT username"))
+    print(
+        f"{name:<28} {len(calls):>6} вызовов  {elapsed / len(calls) * 1e6:8.1f} мкс/вызов  "
+        f"записей {writes:>6}  проверок чтением {reads:>6}"
+    )
+    if expect_new is not None:
+        assert all(result == expect_new for result in results), f"{name}: неверный результат add_user"
+    return {"writes": writes, "reads": reads}
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--cache", type=int, default=10000, help="KNOWN_USERS_CACHE_SIZE")
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+    if args.cache >= args.users:
+        parser.error("--cache должен быть меньше --users, иначе фильтр не понадобится")
+
+    random.seed(1)
+    db._known_users.maxsize = args.cache
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "start.db")
+        # Схема создаётся init_db, пользователи — напрямую, так быстрее
+        await db.init_db(path)
+        await db.close_db()
+        seed(path, args.users)
+
+        started = time.perf_counter()
+        await db.init_db(path)
+        print(f"Прогрев: {time.perf_counter() - started:.2f} с, в кэше {len(db._known_users)} из {args.users}")
+
+        statements: list[str] = []
+        await db._get_pool().set_trace_callback(lambda sql: statements.append(sql.lstrip()))
+
+        recent_ids = random.choices(range(args.users - args.cache + 1, args.users + 1), k=args.calls)
+        old_ids = random.choices(range(1, args.users - args.cache + 1), k=args.calls)
+        recent = [(i, f"user{i}", f"User {i}") for i in recent_ids]
+        old = [(i, f"user{i}", f"User {i}") for i in old_ids]
+        new = [(args.users + i, f"new{i}", f"New {i}") for i in range(1, args.calls + 1)]
+        renamed = [(i, f"renamed{i}", f"Renamed {i}") for i in range(1, 101)]
+
+        cached = await scenario("недавние (кэш)", recent, statements, expect_new=False)
+        checked = await scenario("старые (фильтр + чтение)", old, statements, expect_new=False)
+        print(f"  bloom-фильтр: {len(db._known_filter._bits) / 1024:.0f} КБ на {len(db._known_filter)} пользователей")
+        fresh = await scenario("новые", new, statements, expect_new=True)
+        repeat = await scenario("новые повторно", new, statements, expect_new=False)
+        again = await scenario("старые повторно", old, statements, expect_new=False)
+        renames = await scenario("смена имени", renamed, statements, expect_new=False)
+        await db._get_pool().set_trace_callback(None)
+        await db.close_db()
+
+        conn = sqlite3.connect(path)
+        stored = conn.execute("SELECT username, full_name FROM users WHERE telegram_id = 1").fetchone()
+        total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        conn.close()
+
+    false_positive = fresh["reads"] / len(new)
+    print(f"ложных срабатываний фильтра на новых: {false_positive:.2%}")
+
+    assert cached["writes"] == 0 and cached["reads"] == 0, "повторный /start из кэша ходит в базу"
+    assert checked["writes"] == 0, "повторный /start старого пользователя пишет в базу"
+    assert fresh["writes"] == len(new)
+    assert repeat["writes"] == 0 and repeat["reads"] == 0
+    assert renames["writes"] == len(renamed) and stored == ("renamed1", "Renamed 1"), "имя не обновилось"
+    assert again["writes"] == 0
+    assert total == args.users + len(new)
+    assert false_positive < 0.05, "фильтр слишком часто ошибается"
+    print("OK: повторные /start не пишут в базу, имена обновляются")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
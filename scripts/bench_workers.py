@@ -0,0 +1,200 @@
+"""Масштабирование /sub по числу процессов на одном порту (SO_REUSEPORT).
+
+Готовит временную базу с активными подписками, для каждого числа воркеров
+поднимает столько процессов main.run-подобного HTTP-приложения на одном
+порту (без бота и фоновых задач, с синхронизацией через базу) и нагружает
+/sub/{uuid} из нескольких клиентских процессов. Печатает запросы в секунду
+и задержки. При нескольких воркерах заодно проверяет межпроцессный сброс
+кэша: подписку гасят в базе, и через SHARED_STATE_INTERVAL все воркеры
+отвечают 403.
+
+Рост упирается в число ядер: на одном ядре ускорения не будет.
+
+Запуск: python scripts/bench_workers.py [--workers 1,2,4] [--duration 5] [--clients 4]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+sys.path.append(".")
+
+import aiohttp
+from aiohttp import web
+
+from database import db
+from utils.shared_state import SHARED_STATE_INTERVAL
+
+HOST = "127.0.0.1"
+
+
+async def prepare(path: str, subscriptions: int) -> list[str]:
+    await db.init_db(path)
+    uuids = []
+    for telegram_id in range(subscriptions):
+        user_uuid = str(uuid_lib.uuid4())
+        await db.add_user(telegram_id, None, "bench")
+        await db.activate_subscription(telegram_id, "plan_1", user_uuid, "vless://bench")
+        uuids.append(user_uuid)
+    await db.close_db()
+    return uuids
+
+
+async def serve(path: str, port: int):
+    # Импорт внутри процесса: main тянет aiogram и все хендлеры
+    import main as app_main
+    from utils.shared_state import shared_state
+
+    await db.init_db(path)
+    runner = web.AppRunner(app_main.create_app(None, None), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port, reuse_port=True).start()
+    shared_state.start()
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+    await shared_state.stop()
+    await runner.cleanup()
+    await db.close_db()
+
+
+def worker(path: str, port: int):
+    asyncio.run(serve(path, port))
+
+
+async def hammer(port: int, uuids: list[str], duration: float, concurrency: int) -> tuple[int, int, list[float]]:
+    ok = errors = 0
+    latencies = []
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def loop(offset: int):
+            nonlocal ok, errors
+            i = offset
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                async with session.get(f"http://{HOST}:{port}/sub/{uuids[i % len(uuids)]}") as resp:
+                    await resp.read()
+                latencies.append(time.perf_counter() - started)
+                if resp.status == 200:
+                    ok += 1
+                else:
+                    errors += 1
+                i += concurrency
+
+        await asyncio.gather(*(loop(n) for n in range(concurrency)))
+    return ok, errors, latencies
+
+
+def client(port: int, uuids: list[str], duration: float, concurrency: int, results):
+    results.put(asyncio.run(hammer(port, uuids, duration, concurrency)))
+
+
+async def statuses(port: int, user_uuid: str, requests: int) -> set[int]:
+    """Статусы по новым соединениям: ядро раскидывает их по разным воркерам."""
+    seen = set()
+    for _ in range(requests):
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+            async with session.get(f"http://{HOST}:{port}/sub/{user_uuid}") as resp:
+                seen.add(resp.status)
+    return seen
+
+
+async def check_invalidation(path: str, port: int, user_uuid: str, requests: int) -> bool:
+    # Прогреваем кэш подписки во всех воркерах
+    assert await statuses(port, user_uuid, requests) == {200}
+    # Гасим подписку в обход приложения, как сделал бы любой другой процесс
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE subscriptions SET is_active = 0 WHERE uuid = ?", (user_uuid,))
+    await asyncio.sleep(SHARED_STATE_INTERVAL * 2 + 0.5)
+    return await statuses(port, user_uuid, requests) == {403}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_listening(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("воркеры не поднялись")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="числа воркеров через запятую")
+    parser.add_argument("--duration", type=float, default=5, help="длительность замера, сек")
+    parser.add_argument("--clients", type=int, default=4, help="клиентских процессов")
+    parser.add_argument("--concurrency", type=int, default=16, help="соединений на клиента")
+    parser.add_argument("--subscriptions", type=int, default=1000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"Ядер: {os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        uuids = asyncio.run(prepare(path, args.subscriptions))
+
+        baseline = None
+        for count in (int(n) for n in args.workers.split(",")):
+            port = free_port()
+            workers = [context.Process(target=worker, args=(path, port)) for _ in range(count)]
+            for process in workers:
+                process.start()
+            try:
+                wait_listening(port)
+                # Даём всем воркерам привязаться к порту
+                time.sleep(1)
+
+                results = context.Queue()
+                clients = [
+                    context.Process(target=client, args=(port, uuids, args.duration, args.concurrency, results))
+                    for _ in range(args.clients)
+                ]
+                for process in clients:
+                    process.start()
+                collected = [results.get() for _ in clients]
+                for process in clients:
+                    process.join()
+
+                ok = sum(r[0] for r in collected)
+                errors = sum(r[1] for r in collected)
+                latencies = sorted(latency for r in collected for latency in r[2])
+                rps = ok / args.duration
+                baseline = baseline or rps
+                p50 = latencies[len(latencies) // 2] * 1000
+                p99 = latencies[int(len(latencies) * 0.99)] * 1000
+                print(
+                    f"воркеров {count}: {rps:8.0f} запр/с (x{rps / baseline:.2f}), "
+                    f"p50 {p50:.1f} мс, p99 {p99:.1f} мс, ошибок {errors}"
+                )
+
+                if count > 1:
+                    invalidated = asyncio.run(check_invalidation(path, port, uuids.pop(), count * 4))
+                    print(f"  сброс кэша между процессами: {'OK' if invalidated else 'НЕ СРАБОТАЛ'}")
+                    if not invalidated:
+                        return 1
+            finally:
+                for process in workers:
+                    process.terminate()
+                for process in workers:
+                    process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Рассылка сообщения всем пользователям бота.
+
+Создаёт рассылку в базе; бот (его outbox) сам дописывает получателей
+порциями и отправляет их с учётом лимитов Telegram, в том числе после
+перезапуска. Без текста печатает прогресс последних рассылок.
+
+Примеры:
+    python scripts/broadcast.py --text "Плановые работы в 03:00 МСК"
+    python scripts/broadcast.py --file news.html --html
+    python scripts/broadcast.py
+"""
+import argparse
+import asyncio
+import sys
+sys.path.append(".")
+
+from database.db import close_db, get_broadcasts, init_db
+from utils.outbox import outbox
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Рассылка всем пользователям")
+    parser.add_argument("--text", help="текст сообщения")
+    parser.add_argument("--file", help="прочитать текст из файла")
+    parser.add_argument("--html", action="store_true", help="текст в HTML-разметке Telegram")
+    args = parser.parse_args()
+
+    text = args.text
+    if args.file:
+        with open(args.file) as f:
+            text = f.read()
+
+    await init_db()
+    try:
+        if text:
+            broadcast_id = await outbox.broadcast(text.strip(), parse_mode="HTML" if args.html else None)
+            print(f"Рассылка {broadcast_id} создана, бот начнёт отправку в течение секунды")
+        for broadcast in await get_broadcasts():
+            messages = ", ".join(f"{status} {count}" for status, count in sorted(broadcast["messages"].items()))
+            print(
+                f"#{broadcast['id']} {broadcast['created_at']}: {broadcast['status']}, "
+                f"получателей {broadcast['queued']}" + (f" ({messages})" if messages else "")
+            )
+    finally:
+        await close_db()
+    return 0
+
+
+sys.exit(asyncio.run(main()))
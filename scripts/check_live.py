@@ -0,0 +1,78 @@
+"""Проверка живых обновлений админки: нагрузка не растёт с числом вкладок.
+
+Открывает N SSE-потоков /admin/api/live и считает, сколько раз за время
+теста были посчитаны секции. Раньше каждая вкладка раз в 30 с дёргала все
+эндпоинты (N × секции), теперь — одна секция на интервал хаба.
+
+Запуск: python scripts/check_live.py [--clients 50] [--ticks 5]
+"""
+import argparse
+import asyncio
+import sys
+sys.path.append(".")
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from handlers import admin
+from utils.live import LiveHub
+
+INTERVAL = 0.2
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=5)
+    args = parser.parse_args()
+
+    calls = {"stats": 0, "pool": 0}
+
+    async def stats():
+        calls["stats"] += 1
+        await asyncio.sleep(0.01)
+        # Меняется на каждом тике
+        return {"tick": calls["stats"]}
+
+    async def pool():
+        calls["pool"] += 1
+        await asyncio.sleep(0.01)
+        # Не меняется: рассылается один раз
+        return [{"uuid": "static"}]
+
+    admin.live_hub = hub = LiveHub({"stats": stats, "pool": pool}, interval=INTERVAL)
+    app = web.Application()
+    app.router.add_get("/admin/api/live", admin.admin_live)
+
+    received = [{"stats": 0, "pool": 0} for _ in range(args.clients)]
+
+    async with TestClient(TestServer(app)) as client:
+        async def listen(i: int):
+            resp = await client.get("/admin/api/live")
+            async for line in resp.content:
+                if line.startswith(b"event: "):
+                    received[i][line[7:].strip().decode()] += 1
+
+        listeners = [asyncio.create_task(listen(i)) for i in range(args.clients)]
+        while hub.clients < args.clients:
+            await asyncio.sleep(0.01)
+        hub.start()
+        await asyncio.sleep(INTERVAL * args.ticks + INTERVAL / 2)
+        await hub.stop()
+        await asyncio.wait_for(asyncio.gather(*listeners), timeout=5)
+
+    stats_events = sum(r["stats"] for r in received)
+    pool_events = sum(r["pool"] for r in received)
+    print(f"клиентов: {args.clients}, тиков: {args.ticks}")
+    print(f"расчётов stats: {calls['stats']}, pool: {calls['pool']}")
+    print(f"событий stats: {stats_events}, pool: {pool_events}")
+
+    # Первый расчёт — при подключении первого клиента, дальше по одному на тик
+    assert calls["stats"] <= args.ticks + 2, "секции считаются для каждого клиента"
+    assert pool_events == args.clients, "неизменившаяся секция разослана повторно"
+    assert all(r["stats"] >= args.ticks for r in received), "клиент пропустил обновления"
+    print("OK: снапшот считается один раз на всех клиентов")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,92 @@
+"""Проверка /metrics при нескольких воркерах: значения складываются по процессам.
+
+Запрос Prometheus через SO_REUSEPORT попадает в любой воркер, поэтому
+/metrics должен отдавать сумму. Другой воркер — отдельный процесс на той же
+базе: он считает свои сообщения outbox и публикует снапшот, этот процесс
+добавляет свои и отвечает на /metrics. Проверяются счётчик, гистограмма
+и то, что снапшоты прошлого запуска стираются перед стартом воркеров.
+
+Запуск: python scripts/check_metrics.py [--sent 3]
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+sys.path.append(".")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from database import db
+from utils import metrics
+from utils.shared_state import shared_state
+
+OTHER_WORKER = """
+import asyncio, sys
+sys.path.append(".")
+from database import db
+from utils import metrics
+
+async def main():
+    await db.init_db(sys.argv[1])
+    for _ in range(int(sys.argv[2])):
+        metrics.OUTBOX_MESSAGES.inc("sent")
+    metrics.HTTP_REQUEST_SECONDS.observe(0.003, "/sub/{uuid}", "GET", "200")
+    await db.save_worker_metrics(1, metrics.snapshot())
+    await db.close_db()
+
+asyncio.run(main())
+"""
+
+
+def sample(text: str, name: str) -> float:
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sent", type=int, default=3, help="сообщений у другого воркера")
+    args = parser.parse_args()
+
+    import main as app_main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metrics.db")
+        await db.init_db(path)
+        # Снапшот прошлого запуска стирается супервизором (_prepare_shared_db)
+        await db.save_worker_metrics(7, {"outbox_messages_total": [[["sent"], 1000]]})
+        await db.clear_worker_metrics()
+        assert await db.get_worker_metrics() == {}, "метрики прошлого запуска не стёрты"
+
+        process = await asyncio.create_subprocess_exec(sys.executable, "-c", OTHER_WORKER, path, str(args.sent))
+        assert await process.wait() == 0
+
+        shared_state.start(0)
+        # Первый проход синхронизации публикует и свой снапшот
+        await asyncio.sleep(0.2)
+        metrics.OUTBOX_MESSAGES.inc("sent", amount=2)
+        metrics.HTTP_REQUEST_SECONDS.observe(0.02, "/sub/{uuid}", "GET", "200")
+        sub = 'http_request_duration_seconds_bucket{route="/sub/{uuid}",method="GET",status="200",le="%s"}'
+        async with TestClient(TestServer(app_main.create_app(None, None))) as client:
+            text = await (await client.get("/metrics")).text()
+        await shared_state.stop()
+        local = metrics.render()
+
+        sent = sample(text, 'outbox_messages_total{result="sent"}')
+        print(f"outbox sent: другой воркер {args.sent} + свой 2 = {sent:g}")
+        assert sent == args.sent + 2, "счётчики воркеров не сложены"
+        # /sub за 3 мс у другого воркера и за 20 мс у этого
+        buckets = [sample(text, sub % le) for le in ("0.005", "0.025", "+Inf")]
+        print(f"/sub по бакетам 5 мс, 25 мс, +Inf: {buckets}")
+        assert buckets == [1, 2, 2], "гистограммы воркеров не сложены"
+        assert sample(local, sub % "0.005") == 0
+        assert sample(local, 'outbox_messages_total{result="sent"}') == 2
+        await db.close_db()
+
+    print("OK: /metrics отдаёт сумму по воркерам")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,143 @@
+"""Проверка outbox: лимиты Telegram, retry_after и потоковая рассылка.
+
+Поднимает временную базу с пользователями, запускает utils.outbox против
+фейкового бота и отправляет рассылку всем плюс серию сообщений в один чат.
+Фейк один раз отвечает retry_after, часть чатов «заблокировала бота»,
+часть отвечает сетевой ошибкой с первой попытки. Проверяет, что темп
+не превышает общий и початовый лимиты, во время паузы ничего не уходит,
+каждый получатель получает сообщение ровно один раз, а очередь рассылки
+не разрастается дальше окна.
+
+Запуск: python scripts/check_outbox.py [--users 300] [--rate 100]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(".")
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from database import db
+from utils import outbox as outbox_module
+
+RETRY_AFTER = 2
+CHAT = 10**9
+
+
+class FakeBot:
+    """Заглушка Bot: запоминает время отправки, иногда отвечает ошибками Telegram."""
+
+    def __init__(self):
+        self.sent: list[tuple[float, int]] = []
+        self.paused_until = 0.0
+        self.early = 0
+        self._failed_once: set[int] = set()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        now = time.monotonic()
+        method = SendMessage(chat_id=chat_id, text=text)
+        if now < self.paused_until:
+            self.early += 1
+        if len(self.sent) == 30 and not self.paused_until:
+            self.paused_until = now + RETRY_AFTER
+            raise TelegramRetryAfter(method, "Flood control exceeded", RETRY_AFTER)
+        if chat_id % 50 == 7:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        if chat_id % 97 == 3 and chat_id not in self._failed_once:
+            self._failed_once.add(chat_id)
+            raise TelegramNetworkError(method, "timeout")
+        await asyncio.sleep(0.005)
+        self.sent.append((time.monotonic(), chat_id))
+
+
+def max_per_window(times: list[float], window: float) -> int:
+    best = start = 0
+    for end in range(len(times)):
+        while times[end] - times[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=100, help="общий лимит, сообщений/с (в бою 25)")
+    parser.add_argument("--window", type=int, default=60, help="окно очереди рассылки")
+    args = parser.parse_args()
+
+    # Ускоренные лимиты, чтобы проверка шла секунды; запас — в той же доле от темпа, что в бою
+    bot_burst = max(1.0, args.rate * outbox_module.OUTBOX_BURST / outbox_module.OUTBOX_RATE)
+    outbox_module.OUTBOX_RATE = args.rate
+    outbox_module.OUTBOX_BURST = bot_burst
+    outbox_module.OUTBOX_BROADCAST_WINDOW = args.window
+    outbox_module.OUTBOX_BROADCAST_BATCH = args.window // 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "outbox.db")
+        await db.init_db(path)
+        for telegram_id in range(1, args.users + 1):
+            await db.add_user(telegram_id, None, "outbox")
+
+        outbox = outbox_module.Outbox()
+        bot = FakeBot()
+        broadcast_id = await outbox.broadcast("Новости")
+        for i in range(6):
+            await outbox.send(CHAT, f"Сообщение {i}", dedup_key=f"check:{i}")
+        # Повтор с тем же ключом не ставится
+        assert not await outbox.send(CHAT, "Дубль", dedup_key="check:0")
+
+        started = time.monotonic()
+        await outbox.start(bot)
+        conn = sqlite3.connect(path)
+        max_pending = 0
+        while True:
+            pending = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+            max_pending = max(max_pending, pending)
+            active = conn.execute("SELECT COUNT(*) FROM broadcasts WHERE status = 'active'").fetchone()[0]
+            sending = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'sending'").fetchone()[0]
+            if not pending and not active and not sending:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+        await outbox.stop()
+        statuses = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        conn.close()
+        broadcast = (await db.get_broadcasts())[0]
+        await db.close_db()
+
+    blocked = sum(1 for telegram_id in range(1, args.users + 1) if telegram_id % 50 == 7)
+    recipients = [chat_id for _, chat_id in bot.sent if chat_id != CHAT]
+    times = [sent_at for sent_at, _ in bot.sent]
+    chat_times = [sent_at for sent_at, chat_id in bot.sent if chat_id == CHAT]
+    chat_gaps = [b - a for a, b in zip(chat_times, chat_times[1:])]
+    per_second = max_per_window(times, 1.0)
+    # Token bucket: за любые w секунд не больше запаса + темп * w
+    burst, rate = outbox_module.OUTBOX_CHAT_BURST, outbox_module.OUTBOX_CHAT_RATE
+    chat_ok = all(max_per_window(chat_times, w) <= burst + rate * w * 1.05 for w in (1, 2, 3, 5))
+
+    print(f"отправлено {len(bot.sent)} за {elapsed:.1f} с, статусы {statuses}")
+    print(f"рассылка #{broadcast_id}: {broadcast['status']}, получателей {broadcast['queued']}")
+    print(f"макс. за секунду: {per_second} (лимит {args.rate:.0f} + запас {bot_burst:.0f})")
+    print(f"в один чат: {len(chat_times)} сообщений, интервалы {', '.join(f'{gap:.2f}' for gap in chat_gaps)} с")
+    print(f"очередь рассылки: макс. {max_pending} в ожидании (окно {args.window})")
+    print(f"отправок во время паузы retry_after: {bot.early}")
+
+    assert broadcast["status"] == "done" and broadcast["queued"] == args.users
+    assert sorted(recipients) == [i for i in range(1, args.users + 1) if i % 50 != 7], "получатели не совпали"
+    assert statuses.get("failed") == blocked and statuses.get("sent") == len(bot.sent)
+    # Как и для чата: за секунду не больше запаса + темпа
+    assert per_second <= bot_burst + args.rate * 1.05, "превышен общий лимит"
+    assert chat_ok, "превышен лимит чата"
+    assert bot.early == 0, "отправка во время паузы retry_after"
+    assert max_pending <= args.window + args.window // 2, "рассылка поставлена в очередь целиком"
+    print("OK: лимиты соблюдены, все получили по одному сообщению")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
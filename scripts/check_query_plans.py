@@ -0,0 +1,163 @@
+"""Регрессионная проверка планов горячих запросов.
+
+Создаёт базу со старой схемой (до миграций), обновляет её через init_db,
+выполняет горячие функции database/db.py, перехватывает их SQL и прогоняет
+каждый запрос через EXPLAIN QUERY PLAN. Падает с кодом 1, если какой-то
+запрос снова читает таблицу целиком, сортирует во временном B-дереве
+или (в списках из PER_ROW_FREE) выполняет подзапрос на каждую строку.
+
+Запуск: python scripts/check_query_plans.py
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid as uuid_lib
+from contextlib import aclosing
+from datetime import datetime, timedelta
+sys.path.append(".")
+
+from database import db
+from database.migrations import LATEST_VERSION
+
+SERVER = "germany"
+
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    full_name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER NOT NULL,
+    plan_id TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    vless_key TEXT NOT NULL,
+    start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    end_date TIMESTAMP NOT NULL,
+    is_active INTEGER DEFAULT 1,
+    FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
+);
+CREATE TABLE uuid_pool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT UNIQUE NOT NULL,
+    server_name TEXT NOT NULL,
+    is_used INTEGER DEFAULT 0,
+    telegram_id INTEGER DEFAULT NULL
+);
+"""
+
+
+async def _drain(rows):
+    return [row async for row in rows]
+
+
+def hot_calls(sample_uuid: str):
+    """Горячие пути: (название, фабрика корутины)."""
+    return [
+        ("add_user", lambda: db.add_user(1, "renamed", "plan")),
+        ("get_active_subscription", lambda: db.get_active_subscription(1)),
+        ("get_subscription_by_uuid", lambda: db.get_subscription_by_uuid(sample_uuid)),
+        ("get_free_uuid", lambda: db.get_free_uuid(SERVER)),
+        ("claim_uuid", lambda: db.claim_uuid(SERVER, 1)),
+        ("get_subscription_by_payment", lambda: db.get_subscription_by_payment("pay-1")),
+        ("claim_payment_job", lambda: db.claim_payment_job()),
+        ("iter_admin_users", lambda: _drain(db.iter_admin_users(limit=50, after=["9999-12-31", 0]))),
+        ("expire_due_subscriptions", lambda: db.expire_due_subscriptions(datetime.now() + timedelta(days=31), 10)),
+        ("claim_messages", lambda: db.claim_messages(10)),
+        ("queue_broadcast_batch", lambda: db.queue_broadcast_batch(500, 20)),
+        ("prune_outbox", lambda: db.prune_outbox()),
+        ("save_traffic", lambda: db.save_traffic(0, {sample_uuid[:8]: [1, 2], "00000000": [3, 4]})),
+        ("get_traffic_usage", lambda: db.get_traffic_usage(1)),
+        ("record_placement", lambda: db.record_placement(SERVER, 1.0, 0.0)),
+        ("get_recent_placements", lambda: db.get_recent_placements(0.0)),
+    ]
+
+
+# Списки, где коррелированный подзапрос выполнялся бы на каждую строку страницы
+PER_ROW_FREE = {"iter_admin_users"}
+
+
+def bad_plan_steps(conn: sqlite3.Connection, sql: str, per_row_free: bool = False) -> list[str]:
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    bad = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN") and "USING" not in detail:
+            bad.append(detail)
+        elif "TEMP B-TREE" in detail:
+            bad.append(detail)
+        elif per_row_free and "CORRELATED" in detail:
+            bad.append(detail)
+    return bad
+
+
+async def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "plans.db")
+
+        # База «как в проде до миграций»
+        conn = sqlite3.connect(path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.close()
+
+        await db.init_db(path)
+
+        uuids = [str(uuid_lib.uuid4()) for _ in range(200)]
+        await db.load_uuids_to_pool(uuids, SERVER)
+        for telegram_id in range(1, 51):
+            await db.add_user(telegram_id, None, "plan")
+            await db.activate_subscription(telegram_id, "plan_1", uuids[telegram_id], "vless://plan")
+            await db.enqueue_payment_job(f"pay-{telegram_id}", telegram_id, "plan_1", "{}")
+            await db.enqueue_message(telegram_id, "{}", f"check:{telegram_id}")
+        await db.start_broadcast("{}")
+        # После продления в админке — новая подписка (users.last_subscription_id)
+        await db.activate_subscription(1, "plan_3", uuids[1], "vless://plan")
+        latest = [user async for user in db.iter_admin_users(limit=1, search="1")]
+        assert latest[0]["plan_id"] == "plan_3", f"в админке не последняя подписка: {latest}"
+        # Пока страница отдаётся клиенту, читатель уже вернулся в пул
+        pool = db._get_pool()
+        async with aclosing(db.iter_admin_users(limit=10)) as users:
+            await anext(users)
+            assert pool._idle.qsize() == pool.readers, "список пользователей держит соединение"
+
+        traced: list[tuple[str, str]] = []
+        current = [""]
+        await db._get_pool().set_trace_callback(lambda sql: traced.append((current[0], sql)))
+        for name, call in hot_calls(uuids[1]):
+            current[0] = name
+            await call()
+        await db._get_pool().set_trace_callback(None)
+        await db.close_db()
+
+        conn = sqlite3.connect(path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        failures = []
+        checked = 0
+        for name, sql in traced:
+            verb = sql.lstrip().split(None, 1)[0].upper()
+            if verb not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+                continue
+            checked += 1
+            for detail in bad_plan_steps(conn, sql, name in PER_ROW_FREE):
+                failures.append(f"{name}: {detail}\n    {' '.join(sql.split())}")
+        conn.close()
+
+    print(f"версия схемы: {version} (ожидается {LATEST_VERSION}), проверено запросов: {checked}")
+    if version != LATEST_VERSION:
+        print("FAIL: миграции не применились")
+        return 1
+    if failures:
+        print("FAIL: полный проход, сортировка или подзапрос на строку в горячих запросах:")
+        for failure in failures:
+            print("  " + failure)
+        return 1
+    print("OK: все горячие запросы идут по индексам")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
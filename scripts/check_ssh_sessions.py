@@ -0,0 +1,149 @@
+"""Проверка постоянных SSH-сессий мониторинга (utils/ssh.py) на локальном SSH-сервере.
+
+Поднимает SSH-сервер paramiko на 127.0.0.1, прописывает его как сервер
+в VPN_SERVERS и гоняет команды через utils.monitoring._run — как опрос нод.
+Проверяет:
+- на все команды, в том числе параллельные, — одно подключение и одна авторизация;
+- одновременно открыто не больше SSH_MAX_CHANNELS каналов;
+- после обрыва соединения сервером сессия переподключается сама.
+
+Запуск: python scripts/check_ssh_sessions.py [--commands 40]
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+sys.path.append(".")
+
+import paramiko
+
+from config.settings import VPN_SERVERS
+from utils import monitoring, ssh
+
+SERVER = "check-ssh"
+USER = "check"
+PASSWORD = "check-ssh-password"
+
+
+class Interface(paramiko.ServerInterface):
+    def __init__(self, server: "LocalSSHServer"):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) != (USER, PASSWORD):
+            return paramiko.AUTH_FAILED
+        with self.server.lock:
+            self.server.auths += 1
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.server.execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class LocalSSHServer:
+    """SSH-сервер в потоке: на команду отвечает `out:<команда>` через 50 мс."""
+
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.auths = 0
+        self.channels = 0
+        self.max_channels = 0
+        self.transports: list[paramiko.Transport] = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=Interface(self))
+            with self.lock:
+                self.connections += 1
+                self.transports.append(transport)
+
+    def execute(self, channel: paramiko.Channel, command: str):
+        with self.lock:
+            self.channels += 1
+            self.max_channels = max(self.max_channels, self.channels)
+        try:
+            time.sleep(0.05)
+            channel.sendall(f"out:{command}\n".encode())
+            channel.send_exit_status(0)
+        finally:
+            with self.lock:
+                self.channels -= 1
+            channel.close()
+
+    def drop_connections(self):
+        with self.lock:
+            transports, self.transports = self.transports, []
+        for transport in transports:
+            transport.close()
+
+    def close(self):
+        self.sock.close()
+        self.drop_connections()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", type=int, default=40)
+    args = parser.parse_args()
+
+    server = LocalSSHServer()
+    VPN_SERVERS[SERVER] = {
+        "label": SERVER, "host": "127.0.0.1", "ssh_port": server.port,
+        "ssh_user": USER, "ssh_password": PASSWORD, "max_users": 80,
+    }
+    try:
+        started = time.perf_counter()
+        for i in range(5):
+            assert await monitoring._run(SERVER, f"seq {i}") == f"out:seq {i}"
+        outputs = await asyncio.gather(*(monitoring._run(SERVER, f"par {i}") for i in range(args.commands)))
+        elapsed = time.perf_counter() - started
+        assert outputs == [f"out:par {i}" for i in range(args.commands)], "ответы перепутаны"
+        print(f"команд: {5 + args.commands} за {elapsed * 1000:.0f} мс, подключений {server.connections}, "
+              f"авторизаций {server.auths}, каналов одновременно до {server.max_channels}")
+        assert server.connections == 1 and server.auths == 1, "не одно рукопожатие на сервер"
+        assert server.max_channels <= ssh.SSH_MAX_CHANNELS, "превышен SSH_MAX_CHANNELS"
+
+        # Сервер оборвал соединение: следующая команда переподключается
+        server.drop_connections()
+        for _ in range(50):
+            if not ssh.ssh_sessions.session(SERVER)._client.get_transport().is_active():
+                break
+            await asyncio.sleep(0.01)
+        assert await monitoring._run(SERVER, "after drop") == "out:after drop"
+        print(f"после обрыва: подключений {server.connections}, авторизаций {server.auths}")
+        assert server.connections == 2 and server.auths == 2
+    finally:
+        ssh.ssh_sessions.close_all()
+        server.close()
+        del VPN_SERVERS[SERVER]
+
+    print("OK: одно SSH-подключение на сервер, переподключение после обрыва")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,116 @@
+"""Проверка счётчиков статистики админки против полного пересчёта.
+
+Без аргументов прогоняет на временной базе случайную нагрузку (пользователи,
+загрузка пула, оплаты, продления, истечения, возвраты UUID) и проверяет, что
+триггерные счётчики совпадают с пересчётом с нуля, загрузка пула с
+дубликатами сообщает точное число новых UUID, а продление возвращает
+прежний UUID в пул. С --db сверяет рабочую
+базу; --fix записывает пересчитанные значения.
+
+Запуск: python scripts/check_stats.py [--ops 5000] [--db vpn.db [--fix]]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+from datetime import datetime, timedelta
+sys.path.append(".")
+
+from config.settings import VPN_SERVERS
+from database import db
+
+SERVERS = list(VPN_SERVERS)
+PLANS = list(db.PLAN_DURATION)
+
+
+async def workload(ops: int, seed: int):
+    rng = random.Random(seed)
+    loaded = {}
+    for server in SERVERS:
+        loaded[server] = [str(uuid_lib.uuid4()) for _ in range(ops // 4)]
+        await db.load_uuids_to_pool(loaded[server], server)
+
+    # Повторная загрузка: половина уже в пуле, счётчик добавленных — только новые
+    # (триггеры pool_stats не должны попадать в число добавленных)
+    reload = loaded[SERVERS[0]][:10] + [str(uuid_lib.uuid4()) for _ in range(10)]
+    seen, added = await db.bulk_load_uuids(reload, SERVERS[0], batch_size=7)
+    assert (seen, added) == (20, 10), f"загрузка с дубликатами: прочитано {seen}, добавлено {added}, ожидалось 20 и 10"
+
+    users = 0
+    for _ in range(ops):
+        action = rng.random()
+        if action < 0.3 or not users:
+            await db.add_user(users, f"user{users}", "check")
+            users += 1
+        elif action < 0.8:
+            telegram_id = rng.randrange(users)
+            user_uuid = await db.claim_uuid(rng.choice(SERVERS), telegram_id)
+            if user_uuid:
+                plan_id = rng.choice(PLANS)
+                amount = rng.randint(1, 99999)
+                await db.activate_subscription(telegram_id, plan_id, user_uuid, "vless://check", amount=amount)
+        elif action < 0.95:
+            await db.expire_due_subscriptions(datetime.now() + timedelta(days=rng.choice([0, 2, 40, 400])), 50)
+        else:
+            sub = await db.get_active_subscription(rng.randrange(users))
+            if sub:
+                await db.release_uuid(sub["uuid"])
+
+
+async def check_renewal():
+    """Продление выдаёт новый UUID, старый сразу свободен для следующей оплаты."""
+    server = SERVERS[0]
+    telegram_id = -1
+    await db.add_user(telegram_id, "renewal", "check")
+    first = await db.claim_uuid(server, telegram_id)
+    await db.activate_subscription(telegram_id, "plan_1", first, "vless://check")
+    second = await db.claim_uuid(server, telegram_id)
+    await db.activate_subscription(telegram_id, "plan_1", second, "vless://check")
+    async with db._get_pool().read() as conn:
+        rows = await conn.execute_fetchall("SELECT uuid, is_used FROM uuid_pool WHERE uuid IN (?, ?)", (first, second))
+    used = dict(rows)
+    assert used == {first: 0, second: 1}, f"после продления UUID не освобождён: {used}"
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="сверить существующую базу вместо случайной нагрузки")
+    parser.add_argument("--fix", action="store_true", help="записать пересчитанные счётчики (с --db)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await db.init_db(args.db or os.path.join(tmp, "stats.db"))
+        try:
+            if not args.db:
+                await workload(args.ops, args.seed)
+                await check_renewal()
+
+            started = time.perf_counter()
+            for _ in range(100):
+                stats = await db.get_admin_stats()
+            elapsed = (time.perf_counter() - started) / 100
+            print(f"get_admin_stats: {elapsed * 1000:.2f} мс, {stats}")
+
+            drift = await db.rebuild_stats(apply=not args.db or args.fix)
+        finally:
+            await db.close_db()
+
+    if not drift:
+        print("OK: счётчики совпадают с пересчётом")
+        return 0
+    for key, (before, after) in drift.items():
+        print(f"  {key}: счётчик {before}, пересчёт {after}")
+    if args.db and args.fix:
+        print("Счётчики пересчитаны")
+        return 0
+    print("Ошибка: счётчики разошлись с данными")
+    return 1
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,130 @@
+"""Проверка кэша ответов /sub (handlers/subscription.py).
+
+Поднимает временную базу с подпиской и приложение из main.create_app,
+считает обращения /sub к базе и проверяет:
+- повторный запрос отдаётся из кэша, If-None-Match с тем же ETag — 304 без тела;
+- продление и истечение подписки сбрасывают кэш (новый expire, затем 403);
+- изменение VPN_SERVERS меняет ответ и ETag без сброса кэша вручную;
+- ответ, собранный до изменения подписки, пришедшего во время запроса
+  к базе, в кэш не попадает (счётчик _generation).
+
+Запуск: python scripts/check_sub_cache.py
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid as uuid_lib
+from datetime import datetime, timedelta
+sys.path.append(".")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from config.settings import VPN_SERVERS
+from database import db
+from handlers import subscription
+
+SERVER = next(iter(VPN_SERVERS))
+
+
+def expire_of(response) -> int:
+    info = dict(part.strip().split("=") for part in response.headers["Subscription-Userinfo"].split(";"))
+    return int(info["expire"])
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.parse_args()
+
+    import main as app_main
+
+    lookups = []
+    get_subscription_by_uuid = subscription.get_subscription_by_uuid
+
+    async def counted(user_uuid: str):
+        lookups.append(user_uuid)
+        return await get_subscription_by_uuid(user_uuid)
+
+    subscription.get_subscription_by_uuid = counted
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sub.db")
+        await db.init_db(path)
+        await db.load_uuids_to_pool([str(uuid_lib.uuid4()) for _ in range(3)], SERVER)
+        await db.add_user(1, None, "cache")
+        user_uuid = await db.claim_uuid(SERVER, 1)
+        await db.activate_subscription(1, "plan_1", user_uuid, "vless://check")
+        url = f"/sub/{user_uuid}"
+
+        async with TestClient(TestServer(app_main.create_app(None, None))) as client:
+            # Кэш и 304
+            first = await client.get(url)
+            assert first.status == 200 and first.headers.get("ETag"), first.status
+            body = await first.text()
+            etag = first.headers["ETag"]
+            again = await client.get(url)
+            assert await again.text() == body
+            cached = await client.get(url, headers={"If-None-Match": etag})
+            print(f"ETag {etag}: повтор {again.status}, If-None-Match {cached.status}, обращений к базе {len(lookups)}")
+            assert cached.status == 304 and not await cached.read(), "нет 304 на совпавший ETag"
+            assert "Subscription-Userinfo" in cached.headers
+            assert len(lookups) == 1, "повторные запросы идут в базу"
+
+            # Продление: кэш сброшен, expire новый
+            await db.activate_subscription(1, "plan_3", user_uuid, "vless://check")
+            renewed = await client.get(url)
+            print(f"после продления: обращений {len(lookups)}, expire {expire_of(first)} → {expire_of(renewed)}")
+            assert len(lookups) == 2, "продление не сбросило кэш"
+            assert expire_of(renewed) > expire_of(first)
+
+            # VPN_SERVERS изменился: новый ответ и ETag
+            VPN_SERVERS["check-sub-cache"] = {**VPN_SERVERS[SERVER], "label": "Проверка"}
+            try:
+                changed = await client.get(url, headers={"If-None-Match": etag})
+                links = base64.b64decode(await changed.text()).decode().splitlines()
+                print(f"новый сервер: статус {changed.status}, ссылок {len(links)}, ETag {changed.headers['ETag']}")
+                assert changed.status == 200 and changed.headers["ETag"] != etag, "ответ не обновился"
+                assert len(links) == len(VPN_SERVERS)
+            finally:
+                del VPN_SERVERS["check-sub-cache"]
+            assert (await client.get(url)).headers["ETag"] == etag
+
+            # Изменение во время запроса к базе: собранный ответ устарел и не кэшируется
+            async def racing(uuid: str):
+                sub = await counted(uuid)
+                await db.activate_subscription(1, "plan_1", uuid, "vless://check")
+                return sub
+
+            subscription._payload_cache.clear()
+            subscription.get_subscription_by_uuid = racing
+            try:
+                stale = await client.get(url)
+            finally:
+                subscription.get_subscription_by_uuid = counted
+            before = len(lookups)
+            fresh = await client.get(url)
+            print(f"гонка: ответ с expire {expire_of(stale)}, следующий из базы ({len(lookups) - before}) "
+                  f"с expire {expire_of(fresh)}")
+            assert len(lookups) == before + 1, "ответ, собранный до изменения, попал в кэш"
+            assert expire_of(fresh) < expire_of(stale)
+
+            # Истечение: кэш сброшен, подписка больше не отдаётся
+            conn = sqlite3.connect(path)
+            conn.execute("UPDATE subscriptions SET end_date = ? WHERE telegram_id = 1",
+                         ((datetime.now() - timedelta(days=1)).isoformat(),))
+            conn.commit()
+            conn.close()
+            assert user_uuid in await db.expire_due_subscriptions()
+            expired = await client.get(url)
+            print(f"после истечения: {expired.status}")
+            assert expired.status == 403, "истёкшая подписка отдаётся из кэша"
+        await db.close_db()
+
+    print("OK: кэш /sub отдаёт 304 и сбрасывается при изменениях подписки и серверов")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
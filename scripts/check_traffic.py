@@ -0,0 +1,194 @@
+"""Проверка учёта трафика: агент → пачка в базу → свёртка → Subscription-Userinfo.
+
+Поднимает временную базу с активными подписками, дважды запускает
+scripts/node_agent.py (--once) с файлом вывода Stats API Xray против
+/agent/push и проверяет:
+- трафик всех ключей уходит в базу одной транзакцией записи;
+- трафик ключей без подписки отбрасывается;
+- /sub отдаёт реальные upload/download/expire, включая ещё не сброшенный трафик;
+- во время сброса трафик не пропадает и не задваивается, даже если итог перечитан из базы;
+- свёртка минут в часы и часов в дни не меняет итогов;
+- после повторной выдачи UUID новый владелец не видит трафик прежнего.
+
+Запуск: python scripts/check_traffic.py [--users 1000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+from datetime import datetime, timedelta
+sys.path.append(".")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from config.settings import VPN_SERVERS
+from database import db
+from utils import traffic
+from utils.traffic import traffic_meter
+
+SERVER = next(iter(VPN_SERVERS))
+SECRET = "check-traffic-secret"
+
+
+def write_stats(path: str, users: dict[int, str]):
+    """Вывод `xray api statsquery`: у пользователя i — i КБ вверх и 3i КБ вниз, плюс чужой ключ."""
+    stat = []
+    for i, user_uuid in users.items():
+        email = user_uuid[:8]
+        stat.append({"name": f"user>>>{email}>>>traffic>>>uplink", "value": i * 1024})
+        stat.append({"name": f"user>>>{email}>>>traffic>>>downlink", "value": i * 3072})
+    stat.append({"name": "user>>>zzzzzzzz>>>traffic>>>downlink", "value": 10**9})
+    stat.append({"name": "inbound>>>vless-in>>>traffic>>>downlink", "value": 10**9})
+    with open(path, "w") as f:
+        json.dump({"stat": stat}, f)
+
+
+async def run_agent(url: str, *args: str) -> tuple[int, str]:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "scripts/node_agent.py", "--server", SERVER, "--once", "--url", url, *args,
+        env={**os.environ, "AGENT_SECRET": SECRET},
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    output, _ = await process.communicate()
+    return process.returncode, output.decode()
+
+
+def parse_userinfo(value: str) -> dict[str, int]:
+    return {key.strip(): int(number) for key, number in (part.split("=") for part in value.split(";"))}
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    VPN_SERVERS[SERVER]["agent_secret"] = SECRET
+    import main as app_main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.db")
+        await db.init_db(path)
+        await db.load_uuids_to_pool([str(uuid_lib.uuid4()) for _ in range(args.users)], SERVER)
+        users = {}
+        for i in range(1, args.users + 1):
+            await db.add_user(i, None, "traffic")
+            users[i] = await db.claim_uuid(SERVER, i)
+            await db.activate_subscription(i, "plan_1", users[i], "vless://check")
+
+        stats_path = os.path.join(tmp, "stats.json")
+        write_stats(stats_path, users)
+        sample = ["--stats-output", stats_path, "--ss-output", os.devnull, "--log", os.devnull]
+
+        statements: list[str] = []
+        async with TestClient(TestServer(app_main.create_app(None, None))) as client:
+            url = str(client.make_url("/agent/push"))
+            for _ in range(2):
+                code, output = await run_agent(url, *sample)
+                assert code == 0, output
+
+            await db._get_pool().set_trace_callback(lambda sql: statements.append(sql.lstrip()))
+            started = time.perf_counter()
+            flushed = await traffic_meter.run_once()
+            elapsed = time.perf_counter() - started
+            await db._get_pool().set_trace_callback(None)
+            writes = sum(1 for sql in statements if sql.startswith("BEGIN IMMEDIATE"))
+            print(f"сброс: {flushed} ключей за {elapsed * 1000:.1f} мс, транзакций записи {writes}")
+            assert writes == 1, "трафик пишется не одной пачкой"
+
+            # Ещё не сброшенный трафик виден в заголовке сразу
+            traffic_meter.ingest({users[1][:8]: [100, 200]})
+            checked = 0
+            for i in (1, 2, args.users // 2, args.users):
+                response = await client.get(f"/sub/{users[i]}")
+                info = parse_userinfo(response.headers["Subscription-Userinfo"])
+                extra = (100, 200) if i == 1 else (0, 0)
+                assert info["upload"] == 2 * i * 1024 + extra[0], f"upload {i}: {info}"
+                assert info["download"] == 2 * i * 3072 + extra[1], f"download {i}: {info}"
+                sub = await db.get_subscription_by_uuid(users[i])
+                assert info["expire"] == int(datetime.fromisoformat(sub["end_date"]).timestamp())
+                checked += 1
+            print(f"Subscription-Userinfo сходится у {checked} подписок: {response.headers['Subscription-Userinfo']}")
+            await traffic_meter.run_once()
+
+            # Запросы /sub во время сброса: до записи и после неё, в том числе с перечитыванием базы
+            sub_id = (await db.get_subscription_by_uuid(users[3]))["id"]
+            base = await traffic_meter.usage(sub_id, users[3])
+            expected = (base[0] + 10, base[1] + 20)
+            traffic_meter.ingest({users[3][:8]: [10, 20]})
+            save_traffic = traffic.save_traffic
+
+            async def slow_save(bucket, pending):
+                await asyncio.sleep(0.05)
+                await save_traffic(bucket, pending)
+                await asyncio.sleep(0.05)
+
+            traffic.save_traffic = slow_save
+            try:
+                flush = asyncio.create_task(traffic_meter.run_once())
+                await asyncio.sleep(0.02)
+                during = await traffic_meter.usage(sub_id, users[3])
+                await asyncio.sleep(0.06)
+                traffic_meter._usage.pop(users[3][:8])
+                reloaded = await traffic_meter.usage(sub_id, users[3])
+                await flush
+            finally:
+                traffic.save_traffic = save_traffic
+            after = await traffic_meter.usage(sub_id, users[3])
+            print(f"во время сброса: {during}, перечитано после записи: {reloaded}, после: {after}")
+            assert during == reloaded == after == expected, f"трафик во время сброса потерян или задвоен: {expected}"
+
+            # Старая история: строка в минуту за трое суток у одной подписки
+            now = time.time()
+            first = int(now - 3 * 86400)
+            first -= first % 60
+            for bucket in range(first, int(now), 60):
+                await db.save_traffic(bucket, {users[2][:8]: [1, 2]})
+            before = [await db.get_traffic_usage(sub_id) for sub_id in (1, 2, 3)]
+            conn = sqlite3.connect(path)
+            rows_before = conn.execute("SELECT COUNT(*) FROM traffic").fetchone()[0]
+            rolled = await db.rollup_traffic(now)
+            after = [await db.get_traffic_usage(sub_id) for sub_id in (1, 2, 3)]
+            periods = dict(conn.execute("SELECT period, COUNT(*) FROM traffic GROUP BY period").fetchall())
+            oldest_minute = conn.execute("SELECT MIN(bucket) FROM traffic WHERE period = 60").fetchone()[0]
+            oldest_hour = conn.execute("SELECT MIN(bucket) FROM traffic WHERE period = 3600").fetchone()[0]
+            rows_after = conn.execute("SELECT COUNT(*) FROM traffic").fetchone()[0]
+            print(f"свёртка: {rows_before} → {rows_after} строк (свёрнуто {rolled}), по интервалам {periods}")
+            assert before == after, f"свёртка изменила итоги: {before} != {after}"
+            assert oldest_minute >= now - db.TRAFFIC_MINUTE_KEEP - 3600
+            assert oldest_hour >= now - db.TRAFFIC_HOUR_KEEP - 86400
+            assert await db.rollup_traffic(now) == 0, "повторная свёртка что-то нашла"
+
+            # UUID пользователя 1 истёк и выдан новому пользователю через claim_uuid
+            conn.execute("UPDATE subscriptions SET end_date = ? WHERE telegram_id = 1",
+                         ((datetime.now() - timedelta(days=1)).isoformat(),))
+            conn.commit()
+            conn.close()
+            assert users[1] in await db.expire_due_subscriptions()
+            newcomer = args.users + 1
+            await db.add_user(newcomer, None, "traffic")
+            # Пул разобран целиком: свободен только что освобождённый UUID
+            assert await db.claim_uuid(SERVER, newcomer) == users[1], "освобождённый UUID не выдан повторно"
+            await db.activate_subscription(newcomer, "plan_1", users[1], "vless://check")
+            traffic_meter.ingest({users[1][:8]: [5, 7]})
+            await traffic_meter.run_once()
+            response = await client.get(f"/sub/{users[1]}")
+            info = parse_userinfo(response.headers["Subscription-Userinfo"])
+            print(f"новый владелец UUID: {response.headers['Subscription-Userinfo']}")
+            assert (info["upload"], info["download"]) == (5, 7), "новому владельцу достался чужой трафик"
+
+            top = await db.get_top_traffic(days=1, limit=3)
+            print(f"больше всех: {[(user['telegram_id'], user['upload'] + user['download']) for user in top]}")
+            assert top[0]["telegram_id"] == args.users
+
+        await db.close_db()
+
+    print("OK: трафик пишется пачкой, сворачивается без потерь и отдаётся в /sub")
+    return 0
+
+
+sys.exit(asyncio.run(main()))
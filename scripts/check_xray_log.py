@@ -0,0 +1,121 @@
+"""Проверка инкрементального чтения access.log Xray (utils.xray_log.AccessLogIndexer).
+
+Пишет образцы лога во временный файл и дочитывает его несколькими
+проходами, как агент ноды и мониторинг. Проверяет:
+- первый проход читает только хвост большого лога и пропускает обрезанную строку;
+- каждый проход разбирает только новые байты, счёт ключей растёт от прохода к проходу;
+- незаконченная последняя строка не теряется и не разбирается дважды;
+- ротация (новый файл) и copytruncate (тот же файл, обрезанный) читаются с начала;
+- адреса ::ffff:1.2.3.4 (в том числе в скобках) сводятся к 1.2.3.4, как в выводе ss.
+
+Запуск: python scripts/check_xray_log.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+sys.path.append(".")
+
+from utils import xray_log
+from utils.xray_log import AccessLogIndexer
+
+
+def line(ip: str, email: str, port: int = 40000) -> bytes:
+    return (
+        f"2024/05/01 12:00:00.000000 from tcp:{ip}:{port} accepted tcp:example.com:443 "
+        f"[vless-in >> direct] email: {email}\n"
+    ).encode()
+
+
+class Recorder(AccessLogIndexer):
+    """Индексатор, запоминающий размер каждого прочитанного куска."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads: list[int] = []
+
+    def feed(self, data: bytes):
+        self.reads.append(len(data))
+        super().feed(data)
+
+
+def append(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tail", type=int, default=4096, help="INITIAL_TAIL на время проверки, байт")
+    args = parser.parse_args()
+    xray_log.INITIAL_TAIL = args.tail
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+
+        # Большой исторический лог: читается только хвост, первая строка хвоста обрезана
+        history = b"".join(line(f"10.0.{i // 250}.{i % 250}", "old00000") for i in range(200))
+        content = history + line("192.0.2.1", "aaaa0000")
+        with open(path, "wb") as f:
+            f.write(content)
+        # Целиком попавшие в хвост строки; перед первой — обрезанная
+        whole = content[-args.tail:].split(b"\n")[1:-1]
+        indexer = Recorder()
+        indexer.update_from_file(path)
+        print(f"первый проход: прочитано {indexer.reads[-1]} из {os.path.getsize(path)} байт, IP {len(indexer.last_seen)}")
+        assert indexer.reads[-1] == args.tail, "первый проход прочитал не только хвост"
+        assert indexer.email_for("192.0.2.1") == "aaaa0000"
+        assert len(indexer.last_seen) == len(whole), "обрезанная строка разобрана или строки потеряны"
+
+        # Дальше — только новые байты; незаконченная строка ждёт своего конца
+        new = line("192.0.2.2", "bbbb0000") + line("[::ffff:192.0.2.3]", "bbbb0000")
+        tail = line("::ffff:192.0.2.4", "cccc0000")
+        append(path, new + tail[:30])
+        indexer.update_from_file(path)
+        assert indexer.reads[-1] == len(new) + 30, "перечитаны старые байты"
+        assert indexer.email_for("192.0.2.4") is None, "незаконченная строка разобрана"
+        counts = indexer.device_counts(["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"])
+        assert counts == {"aaaa0000": 1, "bbbb0000": 2}, counts
+
+        append(path, tail[30:])
+        indexer.update_from_file(path)
+        assert indexer.reads[-1] == len(tail) - 30
+        counts = indexer.device_counts(["192.0.2.1", "192.0.2.2", "::ffff:192.0.2.3", "[::ffff:192.0.2.4]"])
+        print(f"дочитано: {indexer.reads[1:]} байт, устройств на ключ {counts}")
+        assert counts == {"aaaa0000": 1, "bbbb0000": 2, "cccc0000": 1}, counts
+        assert indexer.offset == os.path.getsize(path)
+
+        # Без новых строк проход ничего не читает
+        indexer.update_from_file(path)
+        assert indexer.reads[-1] == 0
+
+        # Ротация: старый файл переименован, пишется новый
+        os.rename(path, path + ".1")
+        with open(path, "wb") as f:
+            f.write(line("192.0.2.5", "dddd0000"))
+        indexer.update_from_file(path)
+        print(f"ротация: прочитано {indexer.reads[-1]} байт нового файла")
+        assert indexer.reads[-1] == os.path.getsize(path), "новый файл прочитан не с начала"
+        assert indexer.email_for("192.0.2.5") == "dddd0000"
+        assert indexer.email_for("192.0.2.1") == "aaaa0000", "индекс потерян при ротации"
+
+        # copytruncate: тот же inode, файл обрезан и пишется заново. Заметно по
+        # размеру меньше прочитанного — до следующего прохода лог не успевает
+        # дорасти до прежнего размера
+        append(path, b"".join(line(f"192.0.3.{i}", "dddd0000") for i in range(10)))
+        indexer.update_from_file(path)
+        inode = os.stat(path).st_ino
+        with open(path, "r+b") as f:
+            f.truncate(0)
+        append(path, line("192.0.2.6", "eeee0000"))
+        assert os.stat(path).st_ino == inode
+        indexer.update_from_file(path)
+        print(f"copytruncate: прочитано {indexer.reads[-1]} байт с начала")
+        assert indexer.reads[-1] == os.path.getsize(path), "обрезанный файл прочитан не с начала"
+        assert indexer.email_for("192.0.2.6") == "eeee0000"
+
+    print("OK: access.log дочитывается инкрементально, ротация и ::ffff: обрабатываются")
+    return 0
+
+
+sys.exit(main())
@@ -1,18 +1,100 @@
+"""Загрузка UUID в пул сервера.
+
+Примеры:
+    python scripts/load_uuids.py                              # uuids.txt → germany, как раньше
+    python scripts/load_uuids.py keys1.txt keys2.txt --server finland
+    python scripts/load_uuids.py --server finland --generate 100000 --output finland.txt
+    python scripts/load_uuids.py keys.txt --server finland --dry-run
+"""
+import argparse
 import asyncio
 import sys
+import time
+import uuid as uuid_lib
+from datetime import datetime
 sys.path.append(".")
 
-from database.db import init_db, load_uuids_to_pool
+from config.settings import VPN_SERVERS
+from database.db import bulk_load_uuids, close_db, diff_uuids, init_db
 
 
-async def main():
-    await init_db()
+def read_uuids(paths: list[str], stats: dict):
+    """Потоково читать UUID из файлов, пропуская пустые и некорректные строки."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield str(uuid_lib.UUID(line))
+                except ValueError:
+                    stats["invalid"] += 1
+
+
+def generate_uuids(count: int, output: str):
+    """Сгенерировать UUID, сразу записывая их в файл для конфига Xray."""
+    with open(output, "w") as f:
+        for _ in range(count):
+            value = str(uuid_lib.uuid4())
+            f.write(value + "\n")
+            yield value
+
 
-    with open("uuids.txt") as f:
-        uuids = [line.strip() for line in f if line.strip()]
+def make_progress(started: float):
+    def progress(seen: int, added: int):
+        rate = seen / max(time.perf_counter() - started, 1e-9)
+        print(f"\rпрочитано {seen}, добавлено {added}, {rate:,.0f} UUID/с", end="", file=sys.stderr, flush=True)
+    return progress
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Загрузка UUID в пул сервера")
+    parser.add_argument("files", nargs="*", help="файлы с UUID, по одному в строке (по умолчанию uuids.txt)")
+    parser.add_argument("--server", default="germany", choices=sorted(VPN_SERVERS), help="сервер из VPN_SERVERS")
+    parser.add_argument("--generate", type=int, default=0, metavar="N", help="сгенерировать N новых UUID")
+    parser.add_argument("--output", help="куда записать сгенерированные UUID (для конфига Xray)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="только сравнить с пулом, ничего не записывая")
+    args = parser.parse_args()
+
+    stats = {"invalid": 0}
+    if args.generate:
+        if args.files:
+            parser.error("--generate нельзя совмещать с файлами")
+        if args.dry_run:
+            # dry-run ничего не пишет, а сгенерированные UUID пришлось бы сохранить в файл
+            parser.error("--generate нельзя совмещать с --dry-run")
+        output = args.output or f"uuids-{args.server}-{datetime.now():%Y%m%d-%H%M%S}.txt"
+        source = generate_uuids(args.generate, output)
+        print(f"Новые UUID записываются в {output} — добавьте их в конфиг Xray на сервере")
+    else:
+        source = read_uuids(args.files or ["uuids.txt"], stats)
+
+    await init_db()
+    started = time.perf_counter()
+    try:
+        if args.dry_run:
+            diff = await diff_uuids(source, args.server)
+            print(f"Пул {args.server}, dry-run:")
+            print(f"  всего в файлах:             {diff['total']}")
+            print(f"  новых:                      {diff['new']}")
+            print(f"  уже в пуле этого сервера:   {diff['same_server']}")
+            print(f"  уже в пуле другого сервера: {diff['other_server']}")
+            print(f"  повторов внутри файлов:     {diff['duplicates']}")
+        else:
+            seen, added = await bulk_load_uuids(source, args.server, args.batch_size, make_progress(started))
+            elapsed = time.perf_counter() - started
+            print(file=sys.stderr)
+            print(f"Загружено {added} из {seen} UUID в пул {args.server} "
+                  f"за {elapsed:.1f} с ({seen / max(elapsed, 1e-9):,.0f} UUID/с), "
+                  f"пропущено дубликатов: {seen - added}")
+    finally:
+        await close_db()
 
-    await load_uuids_to_pool(uuids, "germany")
-    print(f"Загружено {len(uuids)} UUID в пул germany")
+    if stats["invalid"]:
+        print(f"Пропущено некорректных строк: {stats['invalid']}")
+    return 0
 
 
-asyncio.run(main())
\ No newline at end of file
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,457 @@
+"""Нагрузочный тест: приложение из main.py против локальных заглушек.
+
+Запускает main.run() на временной базе. Telegram Bot API и API ЮКассы
+подменяются фейковыми aiohttp-серверами на localhost, SSH до VPN-нод —
+фейковыми нодами с заготовленными ответами ss и access.log. Сценарии:
+
+  payments — всплеск вебхуков payment.succeeded (каждый доставляется дважды),
+             задержка ответа вебхука и до сообщения пользователю
+  sub      — тысячи опросов /sub/{uuid}, часть с If-None-Match
+  start    — поток /start и выбор тарифа через getUpdates
+             (или вебхуком Telegram с --telegram-webhook)
+  admin    — обновления админки всеми эндпоинтами
+
+Печатает пропускную способность, p50/p99 и рост базы. С --save-baseline
+результат сохраняется, без него — сравнивается с сохранённым; при
+ухудшении больше --tolerance код выхода 1.
+
+Запуск: python scripts/loadtest.py [--users 500] [--polls 5000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import time
+import uuid as uuid_lib
+from collections import Counter, defaultdict
+sys.path.append(".")
+
+from aiohttp import ClientSession, web
+
+BASELINE = os.path.join(os.path.dirname(__file__), "loadtest_baseline.json")
+SUB_URL_RE = re.compile(r"/sub/([0-9a-f-]{36})")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class FakeTelegram:
+    """Фейковый Bot API: апдейты отдаются через getUpdates или вебхуком, ответы бота копятся."""
+
+    def __init__(self):
+        self.pending: list[dict] = []
+        self.next_update_id = 1
+        self.new_updates = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.webhook: dict | None = None
+        self._http: ClientSession | None = None
+        self.calls = Counter()
+        self.texts: dict[int, list[str]] = defaultdict(list)
+        self._waiters: dict[int, list[asyncio.Future]] = defaultdict(list)
+        self._message_id = 0
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        """Future, который завершится следующим сообщением бота в этот чат."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    async def push(self, update: dict):
+        update["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        if self.webhook is None:
+            self.pending.append(update)
+            self.new_updates.set()
+            return
+        if self._http is None:
+            self._http = ClientSession()
+        async with self._http.post(self.webhook["url"], json=update, headers={
+            "X-Telegram-Bot-Api-Secret-Token": self.webhook["secret_token"],
+        }) as resp:
+            assert resp.status == 200, resp.status
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+
+    def _message(self, chat_id: int, text: str = "") -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    def _reply(self, chat_id: int, text: str):
+        self.texts[chat_id].append(text)
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            future = waiters.pop(0)
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_bot"}
+        elif method == "getUpdates":
+            self.ready.set()
+            offset = int(data.get("offset") or 0)
+            self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            if not self.pending:
+                self.new_updates.clear()
+                try:
+                    await asyncio.wait_for(self.new_updates.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+            result = self.pending[:100]
+        elif method == "setWebhook":
+            self.webhook = {"url": data["url"], "secret_token": data.get("secret_token", "")}
+            self.ready.set()
+            result = True
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(data["chat_id"])
+            self._reply(chat_id, data.get("text", ""))
+            result = self._message(chat_id, data.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeYooKassa:
+    """Фейковый API ЮКассы: создаёт платёж с задержкой сети."""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.created = 0
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await asyncio.sleep(self.delay)
+        self.created += 1
+        payment_id = str(uuid_lib.uuid4())
+        return web.json_response({
+            "id": payment_id,
+            "status": "pending",
+            "amount": payload["amount"],
+            "metadata": payload.get("metadata", {}),
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://pay.local/{payment_id}"},
+        })
+
+
+class FakeNodes:
+    """Вместо SSH до нод: ответы ss, stat и tail как у ноды с online клиентами."""
+
+    def __init__(self, emails: list[str], online: int = 40, delay: float = 0.01):
+        self.delay = delay
+        self.ips = [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(online)]
+        lines = [
+            f"2024/05/01 12:00:{i % 60:02d}.000000 from tcp:{ip}:5{i:04d} accepted tcp:example.com:443 "
+            f"[vless-in >> direct] email: {emails[i % len(emails)]}"
+            for i, ip in enumerate(self.ips)
+        ]
+        self.log = ("\n".join(lines) + "\n").encode()
+        self.commands = Counter()
+
+    def run_bytes(self, server_name: str, cmd: str) -> bytes:
+        time.sleep(self.delay)
+        self.commands[cmd.split()[0]] += 1
+        if cmd.startswith("ss "):
+            return "\n".join(self.ips).encode()
+        if cmd.startswith("stat "):
+            return f"1 {len(self.log)}".encode()
+        if cmd.startswith("tail "):
+            offset = int(re.search(r"-c \+(\d+)", cmd).group(1)) - 1
+            return self.log[offset:]
+        return b""
+
+    def close_all(self):
+        pass
+
+
+async def measure(name: str, factories: list, concurrency: int) -> dict:
+    """Выполнить корутины с ограничением параллельности, собрать задержки."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(factory):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await factory()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(factory) for factory in factories))
+    elapsed = time.perf_counter() - started
+    result = {
+        "count": len(factories),
+        "errors": errors,
+        "rps": len(factories) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+    print(f"  {name:<18} {result['count']:>6} запр. {result['rps']:>8.0f}/с  "
+          f"p50 {result['p50_ms']:>7.1f} мс  p99 {result['p99_ms']:>7.1f} мс  ошибок {errors}")
+    return result
+
+
+def db_size(path: str) -> int:
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load{chat_id}"}
+
+
+async def run_scenarios(args, app_url: str, telegram: FakeTelegram, webhook_path: str) -> dict:
+    results = {}
+    async with ClientSession() as http:
+        # Оплаты: каждая доставляется дважды, ждём сообщение пользователю
+        print("payments")
+        payers = [100_000 + i for i in range(args.users)]
+        delivered = {chat_id: telegram.expect(chat_id) for chat_id in payers}
+        posted = {}
+
+        async def pay(chat_id: int):
+            posted.setdefault(chat_id, time.perf_counter())
+            async with http.post(app_url + webhook_path, json={
+                "event": "payment.succeeded",
+                "object": {
+                    "id": f"load-{chat_id}",
+                    "amount": {"value": "99.00", "currency": "RUB"},
+                    "metadata": {"telegram_id": str(chat_id), "plan_id": "plan_1"},
+                },
+            }) as resp:
+                assert resp.status == 200
+
+        deliveries = [lambda c=chat_id: pay(c) for chat_id in payers * 2]
+        random.shuffle(deliveries)
+        results["payments.webhook"] = await measure("вебхук", deliveries, args.concurrency)
+
+        async def wait_delivered(chat_id: int):
+            done_at = await asyncio.wait_for(delivered[chat_id], timeout=60)
+            e2e.append(done_at - posted[chat_id])
+
+        e2e = []
+        started = time.perf_counter()
+        await asyncio.gather(*(wait_delivered(chat_id) for chat_id in payers))
+        results["payments.e2e"] = {
+            "count": len(e2e),
+            "errors": 0,
+            "rps": len(e2e) / max(time.perf_counter() - started, 1e-9),
+            "p50_ms": percentile(e2e, 0.5) * 1000,
+            "p99_ms": percentile(e2e, 0.99) * 1000,
+        }
+        print(f"  {'до сообщения':<18} {len(e2e):>6} оплат  "
+              f"p50 {results['payments.e2e']['p50_ms']:>7.1f} мс  p99 {results['payments.e2e']['p99_ms']:>7.1f} мс")
+
+        # Подписки: UUID берём из сообщений об оплате
+        print("sub")
+        uuids = [m.group(1) for chat_id in payers for text in telegram.texts[chat_id]
+                 if (m := SUB_URL_RE.search(text))]
+        etags = {}
+
+        async def poll(user_uuid: str):
+            headers = {}
+            if user_uuid in etags and random.random() < 0.3:
+                headers["If-None-Match"] = etags[user_uuid]
+            async with http.get(f"{app_url}/sub/{user_uuid}", headers=headers) as resp:
+                assert resp.status in (200, 304)
+                await resp.read()
+                if resp.headers.get("ETag"):
+                    etags[user_uuid] = resp.headers["ETag"]
+
+        polls = [lambda u=random.choice(uuids): poll(u) for _ in range(args.polls)]
+        results["sub"] = await measure("/sub/{uuid}", polls, args.concurrency)
+
+        # /start и выбор тарифа: от апдейта до ответа бота
+        print("start")
+        newcomers = [500_000 + i for i in range(args.starts)]
+
+        async def start(chat_id: int):
+            reply = telegram.expect(chat_id)
+            await telegram.push({"message": {
+                "message_id": 1, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": user(chat_id),
+                "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            }})
+            await asyncio.wait_for(reply, timeout=30)
+
+        async def choose_plan(chat_id: int):
+            reply = telegram.expect(chat_id)
+            await telegram.push({"callback_query": {
+                "id": str(chat_id), "from": user(chat_id), "chat_instance": "load", "data": "plan_1",
+                "message": {"message_id": 1, "date": int(time.time()),
+                            "chat": {"id": chat_id, "type": "private"}, "text": "plans"},
+            }})
+            await asyncio.wait_for(reply, timeout=30)
+
+        results["start"] = await measure("/start", [lambda c=c: start(c) for c in newcomers], args.concurrency)
+        results["plan"] = await measure(
+            "выбор тарифа", [lambda c=c: choose_plan(c) for c in newcomers[: args.starts // 2]], args.concurrency,
+        )
+
+        # Админка: полное обновление всеми эндпоинтами
+        print("admin")
+        endpoints = ["/admin", "/admin/api/stats", "/admin/api/users?limit=100",
+                     "/admin/api/pool", "/admin/api/connections"]
+
+        async def refresh():
+            for path in endpoints:
+                async with http.get(app_url + path, headers={"Accept-Encoding": "gzip"}) as resp:
+                    assert resp.status == 200
+                    await resp.read()
+
+        results["admin"] = await measure("обновление", [refresh] * args.admin, min(args.concurrency, 10))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Сравнить с сохранённым результатом, вернуть список регрессий."""
+    regressions = []
+    print(f"\nСравнение с базовой линией ({baseline.get('saved_at', '?')}):")
+    for name, current in results.items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        for key, worse_if_higher in (("rps", False), ("p50_ms", True), ("p99_ms", True), ("growth_bytes", True)):
+            if not base.get(key) or key not in current:
+                continue
+            delta = (current[key] - base[key]) / base[key]
+            regressed = delta > tolerance if worse_if_higher else delta < -tolerance
+            mark = "  РЕГРЕССИЯ" if regressed else ""
+            print(f"  {name:<18} {key:<7} {base[key]:>9.1f} → {current[key]:>9.1f} ({delta:+.0%}){mark}")
+            if regressed:
+                regressions.append(f"{name}.{key}")
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500, help="оплат в всплеске")
+    parser.add_argument("--polls", type=int, default=5000, help="запросов /sub")
+    parser.add_argument("--starts", type=int, default=1000, help="апдейтов /start")
+    parser.add_argument("--admin", type=int, default=50, help="обновлений админки")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-webhook", action="store_true", help="апдейты вебхуком, а не polling")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    db_path = os.path.join(tmp, "loadtest.db")
+    app_port, fakes_port = free_port(), free_port()
+
+    # Настройки подменяем до импорта приложения: модули читают их при импорте
+    from config import settings
+    settings.DB_PATH = db_path
+    settings.YOOKASSA_API_URL = f"http://127.0.0.1:{fakes_port}/v3"
+    settings.PAYMENT_POLL_INTERVAL = 0.5
+    if args.telegram_webhook:
+        settings.TELEGRAM_WEBHOOK_URL = f"http://127.0.0.1:{app_port}"
+
+    app_main = importlib.import_module("main")
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from database import db
+    from utils import monitoring
+
+    # Пул UUID: по оплате на сервер с запасом
+    await db.init_db(db_path)
+    pool = {name: [str(uuid_lib.uuid4()) for _ in range(args.users)] for name in settings.VPN_SERVERS}
+    for name, uuids in pool.items():
+        await db.load_uuids_to_pool(uuids, name)
+    await db.close_db()
+    size_before = db_size(db_path)
+
+    telegram = FakeTelegram()
+    yookassa = FakeYooKassa()
+    nodes = FakeNodes([u[:8] for uuids in pool.values() for u in uuids[: args.users // 2]])
+    monitoring.ssh_sessions = nodes
+    app_main.ssh_sessions = nodes
+
+    fakes = web.Application()
+    fakes.router.add_post("/bot{token}/{method}", telegram.handle)
+    fakes.router.add_post("/v3/payments", yookassa.create_payment)
+    fakes_runner = web.AppRunner(fakes)
+    await fakes_runner.setup()
+    await web.TCPSite(fakes_runner, "127.0.0.1", fakes_port).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{fakes_port}"))
+    bot = Bot(token=settings.BOT_TOKEN, session=session)
+    dp = app_main.create_dispatcher()
+    app_task = asyncio.create_task(app_main.run(bot, host="127.0.0.1", port=app_port, dp=dp))
+    try:
+        await asyncio.wait_for(telegram.ready.wait(), timeout=30)
+        print(f"Приложение на :{app_port}, база {db_path}")
+        started = time.perf_counter()
+        results = await run_scenarios(args, f"http://127.0.0.1:{app_port}", telegram, settings.WEBHOOK_PATH)
+        elapsed = time.perf_counter() - started
+    finally:
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            # Polling ещё не запустился
+            app_task.cancel()
+        await asyncio.gather(app_task, return_exceptions=True)
+        await telegram.close()
+        await fakes_runner.cleanup()
+
+    size_after = db_size(db_path)
+    growth = size_after - size_before
+    print(f"\nБаза: {size_before / 1024:.0f} КБ → {size_after / 1024:.0f} КБ "
+          f"(+{growth / 1024:.0f} КБ, {growth / max(args.users, 1):.0f} Б на оплату)")
+    print(f"Всего {elapsed:.1f} с; Bot API: {dict(telegram.calls)}; ЮКасса: {yookassa.created} платежей; "
+          f"SSH: {dict(nodes.commands)}")
+
+    results["db"] = {"count": args.users, "errors": 0, "rps": 0, "p50_ms": 0, "p99_ms": 0,
+                     "growth_bytes": growth}
+    failed = sum(r["errors"] for r in results.values())
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"saved_at": time.strftime("%Y-%m-%d %H:%M:%S"), "args": vars(args), "results": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"Базовая линия сохранена в {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Регрессии: " + ", ".join(regressions))
+            return 1
+
+    if failed:
+        print(f"Ошибок запросов: {failed}")
+        return 1
+    return 0
+
+
+sys.exit(asyncio.run(main()))
@@ -0,0 +1,150 @@
+"""Агент VPN-ноды: считает онлайн, устройства и трафик на ключ на месте и пушит боту.
+
+Замена SSH-опроса: на ноде не нужен вход по паролю, бот не ходит на ноды.
+Зависимости — только stdlib и utils/xray_log.py (при установке на ноду
+положите xray_log.py рядом с агентом). В VPN_SERVERS у сервера задаётся
+agent_secret — тот же секрет передаётся агенту через AGENT_SECRET.
+
+Снапшот {"online": N, "connections": {email: устройств},
+"traffic": {email: [upload, download]}} подписывается HMAC-SHA256 от
+"<timestamp>.<тело>" и отправляется POST на /agent/push. Трафик снимается
+через Stats API Xray с обнулением счётчиков; пока пуш не прошёл, он
+копится у агента и уходит со следующим снапшотом.
+
+Запуск на ноде:
+    AGENT_SECRET=... python3 node_agent.py --url https://bot.example/agent/push --server germany
+Локальная проверка без ss и сети:
+    python scripts/node_agent.py --server germany --log sample.log --ss-output ss.txt \
+        --stats-output stats.json --dry-run --once
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+sys.path.append(".")
+
+try:
+    from utils.xray_log import AccessLogIndexer, merge_traffic, normalize_ip, parse_stats, stats_command
+except ImportError:
+    # На ноде xray_log.py лежит рядом с агентом
+    from xray_log import AccessLogIndexer, merge_traffic, normalize_ip, parse_stats, stats_command
+
+logger = logging.getLogger("node_agent")
+
+
+def parse_ss(output: str, port: int) -> list[str]:
+    """IP клиентов Xray из вывода `ss -tnp`: установленные соединения на порт port."""
+    ips = set()
+    for line in output.splitlines():
+        if not line.startswith("ESTAB") or "xray" not in line:
+            continue
+        columns = line.split()
+        if len(columns) < 5 or not columns[3].endswith(f":{port}"):
+            continue
+        ips.add(normalize_ip(columns[4].rsplit(":", 1)[0]))
+    return sorted(ips)
+
+
+def read_ss(args) -> str:
+    if args.ss_output:
+        with open(args.ss_output) as f:
+            return f.read()
+    return subprocess.run(["ss", "-tnp"], capture_output=True, text=True, check=True, timeout=10).stdout
+
+
+def read_stats(args) -> str:
+    """JSON счётчиков пользователей из Stats API Xray (счётчики обнуляются)."""
+    if args.stats_output:
+        # Файл — приращения за один проход, как после -reset
+        with open(args.stats_output) as f:
+            return f.read()
+    return subprocess.run(
+        stats_command(args.api), shell=True, capture_output=True, text=True, check=True, timeout=10,
+    ).stdout
+
+
+def collect(indexer: AccessLogIndexer, args) -> dict:
+    """Снять снапшот ноды."""
+    ips = parse_ss(read_ss(args), args.port)
+    try:
+        indexer.update_from_file(args.log)
+    except OSError as e:
+        # Без лога онлайн всё равно полезен
+        logger.warning("Лог %s недоступен: %s", args.log, e)
+    traffic = {}
+    if args.api or args.stats_output:
+        try:
+            traffic = parse_stats(read_stats(args))
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            logger.warning("Stats API Xray недоступен: %s", e)
+    return {"online": len(ips), "connections": indexer.device_counts(ips), "traffic": traffic}
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+
+
+def push(url: str, server: str, secret: str, snapshot: dict, timeout: float = 10) -> int:
+    """Отправить подписанный снапшот, вернуть HTTP-статус."""
+    body = json.dumps(snapshot, separators=(",", ":")).encode()
+    timestamp = f"{time.time():.6f}"
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-Agent-Server": server,
+        "X-Agent-Timestamp": timestamp,
+        "X-Agent-Signature": sign(secret, timestamp, body),
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Агент VPN-ноды")
+    parser.add_argument("--url", help="адрес /agent/push бота")
+    parser.add_argument("--server", required=True, help="имя сервера из VPN_SERVERS")
+    parser.add_argument("--interval", type=float, default=15, help="период отправки, сек")
+    parser.add_argument("--log", default="/var/log/xray/access.log", help="access.log Xray")
+    parser.add_argument("--port", type=int, default=443, help="порт Xray")
+    parser.add_argument("--api", default="127.0.0.1:10085", help="адрес Stats API Xray, пусто — без трафика")
+    parser.add_argument("--ss-output", help="файл с выводом ss -tnp вместо запуска ss (проверка)")
+    parser.add_argument("--stats-output", help="файл с JSON xray api statsquery вместо Stats API (проверка)")
+    parser.add_argument("--once", action="store_true", help="один снапшот и выход")
+    parser.add_argument("--dry-run", action="store_true", help="печатать снапшот, не отправляя")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    secret = os.environ.get("AGENT_SECRET", "")
+    if not args.dry_run and (not args.url or not secret):
+        parser.error("нужны --url и переменная окружения AGENT_SECRET")
+
+    indexer = AccessLogIndexer()
+    # Трафик, ещё не принятый ботом: счётчики Xray уже обнулены, терять его нельзя
+    unsent: dict[str, list[int]] = {}
+    while True:
+        started = time.monotonic()
+        try:
+            snapshot = collect(indexer, args)
+            merge_traffic(unsent, snapshot["traffic"])
+            snapshot["traffic"] = unsent
+            if args.dry_run:
+                print(json.dumps(snapshot, ensure_ascii=False))
+            else:
+                push(args.url, args.server, secret, snapshot)
+            unsent = {}
+        except Exception as e:
+            logger.warning("Снапшот не отправлен: %r", e)
+            if args.once:
+                return 1
+        if args.once:
+            return 0
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Стресс-тест выдачи UUID: сотни одновременных вебхуков payment.succeeded.
+
+Каждая оплата доставляется дважды, как при ретраях ЮКассы. Проверяет, что
+ни один UUID не выдан дважды, одна оплата даёт не больше одной подписки,
+а лишние оплаты получают отказ, а не чужой ключ.
+
+Запуск: python scripts/stress_claim.py [--webhooks 500] [--pool 300]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid as uuid_lib
+sys.path.append(".")
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from config.settings import VPN_SERVERS, WEBHOOK_PATH
+from database import db
+from handlers import webhook
+from utils.payment_queue import PaymentQueue
+
+SERVER = next(iter(VPN_SERVERS))
+
+
+async def fake_rank() -> list[str]:
+    # Всегда один сервер, даже с пустым пулом: проверяем гонку за UUID
+    await asyncio.sleep(0)
+    return [SERVER]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webhooks", type=int, default=500)
+    parser.add_argument("--pool", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        await db.init_db(path)
+        await db.load_uuids_to_pool([str(uuid_lib.uuid4()) for _ in range(args.pool)], SERVER)
+        for telegram_id in range(args.webhooks):
+            await db.add_user(telegram_id, None, "stress")
+
+        webhook.placement.rank = fake_rank
+        # Сообщения остаются в outbox: отправка в этой проверке не запускается
+        queue = PaymentQueue(webhook.process_payment)
+        app = web.Application()
+        app["payment_queue"] = queue
+        app.router.add_post(WEBHOOK_PATH, webhook.yookassa_webhook)
+        await queue.start()
+
+        async with TestClient(TestServer(app)) as client:
+            async def pay(telegram_id: int) -> int:
+                resp = await client.post(WEBHOOK_PATH, json={
+                    "event": "payment.succeeded",
+                    "object": {
+                        "id": f"pay-{telegram_id}",
+                        "metadata": {"telegram_id": str(telegram_id), "plan_id": "plan_1"},
+                    },
+                })
+                return resp.status
+
+            deliveries = [i % args.webhooks for i in range(args.webhooks * 2)]
+            statuses = await asyncio.gather(*(pay(i) for i in deliveries))
+
+        # Ждём, пока воркеры разберут очередь
+        conn = sqlite3.connect(path)
+        while conn.execute("SELECT COUNT(*) FROM payment_jobs WHERE status != 'done'").fetchone()[0]:
+            await asyncio.sleep(0.05)
+        await queue.stop()
+        await db.close_db()
+
+        used = conn.execute("SELECT COUNT(*) FROM uuid_pool WHERE is_used = 1").fetchone()[0]
+        subs = conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+        distinct = conn.execute("SELECT COUNT(DISTINCT uuid) FROM subscriptions").fetchone()[0]
+        owners = conn.execute("""
+            SELECT COUNT(*) FROM subscriptions s
+            JOIN uuid_pool p ON p.uuid = s.uuid
+            WHERE p.telegram_id != s.telegram_id
+        """).fetchone()[0]
+        messages = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        conn.close()
+
+    expected = min(args.webhooks, args.pool)
+    print(f"вебхуков: {args.webhooks}, UUID в пуле: {args.pool}")
+    print(f"доставок: {len(statuses)}, ответы: {sorted(set(statuses))}, сообщений: {messages}")
+    print(f"подписок: {subs}, занято UUID: {used}, уникальных: {distinct}")
+
+    assert all(status == 200 for status in statuses), "не все вебхуки вернули 200"
+    assert subs == expected, f"ожидалось {expected} подписок, получено {subs}"
+    assert distinct == subs, "один UUID выдан нескольким подпискам"
+    assert used == subs, "занятых UUID больше, чем подписок"
+    assert owners == 0, "владелец UUID в пуле не совпадает с подпиской"
+    assert messages == args.webhooks, "не по одному сообщению на оплату"
+    print("OK: двойных выдач нет")
+
+
+asyncio.run(main())
@@ -0,0 +1,81 @@
+import math
+from collections import OrderedDict
+
+_MASK64 = (1 << 64) - 1
+
+
+class LRUCache:
+    """Ограниченный по размеру словарь: при переполнении вытесняется давно не читанное."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class BloomFilter:
+    """Компактное множество целых: ответ «точно нет» или «вероятно да».
+
+    Доля ложных «да» около error_rate, пока добавлено не больше capacity
+    ключей; дальше растёт. Удалять ключи нельзя.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _start(self, key: int) -> tuple[int, int]:
+        # splitmix64 перемешивает ключ; k позиций — двойным хешированием
+        z = (key * 0x9E3779B97F4A7C15) & _MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        z ^= z >> 31
+        return z % self.size, (z >> 32) % self.size or 1
+
+    def add(self, key: int):
+        position, step = self._start(key)
+        bits, size = self._bits, self.size
+        for _ in range(self.hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+            position = (position + step) % size
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        position, step = self._start(key)
+        bits, size = self._bits, self.size
+        for _ in range(self.hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position = (position + step) % size
+        return True
+
+    def __len__(self) -> int:
+        return self.count
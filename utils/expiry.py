@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from config import settings
+from database.db import EXPIRY_BATCH, expire_due_subscriptions
+from utils.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_INTERVAL = getattr(settings, "EXPIRY_INTERVAL", 60)
+
+
+class ExpiryScheduler(PeriodicTask):
+    """Периодически гасит истёкшие подписки и освобождает их UUID."""
+
+    name = "subscription-expiry"
+
+    def __init__(self, interval: float = EXPIRY_INTERVAL, batch_size: int = EXPIRY_BATCH):
+        super().__init__(interval)
+        self.batch_size = batch_size
+
+    async def run_once(self) -> int:
+        """Пройти все истёкшие подписки пачками; вернуть их количество."""
+        total = 0
+        while True:
+            uuids = await expire_due_subscriptions(batch_size=self.batch_size)
+            total += len(uuids)
+            if len(uuids) < self.batch_size:
+                break
+            # Отдаём писателя другим запросам между пачками
+            await asyncio.sleep(0)
+        if total:
+            logger.info("Истекло подписок: %s", total)
+        return total
+
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import time
+
+from config import settings
+from utils.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто пересчитывать снапшот, пока подключён хотя бы один клиент, сек
+ADMIN_LIVE_INTERVAL = getattr(settings, "ADMIN_LIVE_INTERVAL", 15)
+# Сколько неотправленных событий держать на клиента, прежде чем отключить его
+ADMIN_LIVE_QUEUE = getattr(settings, "ADMIN_LIVE_QUEUE", 32)
+
+
+def _event(name: str, payload: str) -> bytes:
+    return f"event: {name}\ndata: {payload}\n\n".encode()
+
+
+class LiveHub(PeriodicTask):
+    """Общий снапшот админки для всех SSE-клиентов.
+
+    sections — {имя: async-функция без аргументов}. Каждая секция считается
+    один раз за интервал независимо от числа клиентов, и только изменившиеся
+    секции рассылаются. Без клиентов хаб ничего не считает.
+    """
+
+    name = "admin-live"
+
+    def __init__(self, sections: dict, interval: float = ADMIN_LIVE_INTERVAL, queue_size: int = ADMIN_LIVE_QUEUE):
+        super().__init__(interval)
+        self.sections = sections
+        self.queue_size = max(queue_size, len(sections))
+        self._payloads: dict[str, str] = {}
+        self._refreshed_at: float | None = None
+        self._clients: set[asyncio.Queue] = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    async def run_once(self):
+        if self._clients:
+            await self.refresh()
+
+    async def refresh(self, max_age: float = 0):
+        """Пересчитать секции и разослать изменившиеся. Свежий снапшот (моложе max_age) не трогаем."""
+        async with self._lock:
+            if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < max_age:
+                return
+            results = await asyncio.gather(
+                *(builder() for builder in self.sections.values()), return_exceptions=True,
+            )
+            self._refreshed_at = time.monotonic()
+
+            for name, result in zip(self.sections, results):
+                if isinstance(result, Exception):
+                    # Остаётся прошлое значение секции
+                    logger.warning("Секция %s не обновлена: %r", name, result)
+                    continue
+                payload = json.dumps(result, ensure_ascii=False)
+                if payload != self._payloads.get(name):
+                    self._payloads[name] = payload
+                    self._publish(_event(name, payload))
+
+    def _publish(self, message: bytes):
+        for queue in list(self._clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: отключаем, браузер переподключится сам
+                logger.warning("Медленный клиент админки отключён")
+                self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def subscribe(self) -> asyncio.Queue:
+        """Подключить клиента: очередь событий, первым делом — весь текущий снапшот.
+
+        None в очереди означает, что поток надо закрыть.
+        """
+        # После простоя без клиентов снапшот устарел
+        await self.refresh(max_age=self.interval)
+        queue = asyncio.Queue(self.queue_size)
+        for name, payload in self._payloads.items():
+            queue.put_nowait(_event(name, payload))
+        self._clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+
+    async def stop(self):
+        await super().stop()
+        # Открытые потоки иначе задержат остановку веб-сервера
+        for queue in list(self._clients):
+            self._disconnect(queue)
@@ -0,0 +1,259 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import aclosing
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+# Границы бакетов гистограмм задержек, сек
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Счётчик с метками. Обновляется и из потоков (SSH)."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def items(self) -> list:
+        """Значения в JSON-совместимом виде: [[метки, значение], ...]."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(snapshots) -> dict[tuple, float]:
+        """Сложить items() нескольких процессов."""
+        merged: dict[tuple, float] = {}
+        for items in snapshots:
+            for key, value in items:
+                key = tuple(key)
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values: dict[tuple, float] | None = None) -> list[str]:
+        if values is None:
+            values = self.merge([self.items()])
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: бакеты, сумма, количество."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # метки → [счётчики по бакетам (последний — +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        # Бакеты храним некумулятивно: одно увеличение на замер
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def items(self) -> list:
+        """Значения в JSON-совместимом виде: [[метки, счётчики бакетов, сумма], ...]."""
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    def merge(self, snapshots) -> dict[tuple, list]:
+        """Сложить items() нескольких процессов; снапшоты с другими бакетами пропускаются."""
+        merged: dict[tuple, list] = {}
+        for items in snapshots:
+            for key, counts, total in items:
+                if len(counts) != len(self.buckets) + 1:
+                    continue
+                entry = merged.setdefault(tuple(key), [[0] * len(counts), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+        return merged
+
+    def render(self, values: dict[tuple, list] | None = None) -> list[str]:
+        if values is None:
+            values = self.merge([self.items()])
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+def snapshot() -> dict:
+    """Значения всех метрик процесса (JSON) — для сложения между воркерами."""
+    return {metric.name: metric.items() for metric in _registry}
+
+
+def render(snapshots: list[dict] | None = None) -> str:
+    """Все метрики в текстовом формате Prometheus.
+
+    snapshots — снапшоты нескольких процессов (snapshot()): значения складываются.
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if snapshots is None:
+            lines.extend(metric.render())
+        else:
+            lines.extend(metric.render(metric.merge(s.get(metric.name, []) for s in snapshots)))
+    return "\n".join(lines) + "\n"
+
+
+# При нескольких воркерах — корутина, возвращающая снапшоты всех процессов
+# (utils.shared_state). Иначе /metrics отдаёт только свой процесс
+_workers_source = None
+
+
+def set_workers_source(source):
+    """Отдавать в /metrics сумму по воркерам: source() → список снапшотов."""
+    global _workers_source
+    _workers_source = source
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("route", "method", "status"),
+)
+BOT_HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером бота", ("handler",),
+)
+BOT_HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах бота", ("handler",),
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Время запроса к базе", ("query",),
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total", "Исключения в запросах к базе", ("query",),
+)
+SSH_COMMAND_SECONDS = Histogram(
+    "ssh_command_duration_seconds", "Время SSH-команды мониторинга", ("server",),
+)
+SSH_COMMAND_ERRORS = Counter(
+    "ssh_command_errors_total", "Упавшие SSH-команды мониторинга", ("server",),
+)
+OUTBOX_MESSAGES = Counter(
+    "outbox_messages_total", "Исходы отправки сообщений из outbox", ("result",),
+)
+
+
+def db_metrics(func):
+    """Декоратор запроса к базе: время и ошибки под именем функции."""
+    query = func.__name__
+
+    if inspect.isasyncgenfunction(func):
+        # Для генератора меряем время до исчерпания или закрытия
+        @functools.wraps(func)
+        async def gen_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                # aclosing: прерванный обход сразу возвращает соединение в пул
+                async with aclosing(func(*args, **kwargs)) as items:
+                    async for item in items:
+                        yield item
+            except Exception:
+                DB_QUERY_ERRORS.inc(query)
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - started, query)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.inc(query)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, query)
+    return wrapper
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Время HTTP-запросов по шаблону маршрута (не по пути: /sub/{uuid} — одна метка)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, name, request.method, str(status))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Метрики для Prometheus (при нескольких воркерах — сумма по всем)."""
+    text = render() if _workers_source is None else render(await _workers_source())
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+class BotMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки хендлеров aiogram. Регистрируется как inner middleware."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            BOT_HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            BOT_HANDLER_SECONDS.observe(time.perf_counter() - started, name)
@@ -1,24 +1,124 @@
-import paramiko
+import asyncio
+import logging
+import time
+
+from config import settings
 from config.settings import VPN_SERVERS
+from utils.metrics import SSH_COMMAND_ERRORS, SSH_COMMAND_SECONDS
+from utils.ssh import ssh_sessions
+from utils.tasks import PeriodicTask
+from utils.traffic import traffic_meter
+from utils.xray_log import MAX_READ, AccessLogIndexer, parse_stats, stats_command
+
+logger = logging.getLogger(__name__)
+
+MONITORING_TIMEOUT = getattr(settings, "MONITORING_TIMEOUT", 10)
+# Период опроса серверов фоновым коллектором, сек
+MONITORING_INTERVAL = getattr(settings, "MONITORING_INTERVAL", 30)
+# Старше этого возраста данные коллектора считаются устаревшими, сек
+MONITORING_MAX_AGE = getattr(settings, "MONITORING_MAX_AGE", 120)
+# Что делать с устаревшими данными: "live" — опросить сервер сразу,
+# "stale" — использовать как есть, "skip" — считать сервер недоступным
+MONITORING_STALE_FALLBACK = getattr(settings, "MONITORING_STALE_FALLBACK", "live")
+
+XRAY_ACCESS_LOG = getattr(settings, "XRAY_ACCESS_LOG", "/var/log/xray/access.log")
+# Адрес Stats API Xray на нодах без агента (например "127.0.0.1:10085"); None — трафик по SSH не снимается
+XRAY_STATS_API = getattr(settings, "XRAY_STATS_API", None)
+
+# Инкрементальные индексы access.log по серверам
+_log_indexers: dict[str, AccessLogIndexer] = {}
+_log_locks: dict[str, asyncio.Lock] = {}
+
+# Снапшоты от агентов нод (scripts/node_agent.py): имя → {online, connections, received_at}
+_pushed: dict[str, dict] = {}
+
+
+def uses_agent(server_name: str) -> bool:
+    """Сервер сам пушит данные агентом (задан agent_secret), SSH для него не нужен."""
+    return bool(VPN_SERVERS.get(server_name, {}).get("agent_secret"))
+
+
+def record_push(server_name: str, online: int, connections: dict):
+    """Сохранить снапшот, присланный агентом ноды."""
+    now = time.time()
+    _pushed[server_name] = {"online": online, "connections": connections, "received_at": now}
+    load_collector.record(server_name, online, now)
+
+
+def take_local_loads() -> list[dict]:
+    """Замеры, снятые этим процессом с прошлого вызова, — для публикации другим воркерам."""
+    loads = []
+    for name in load_collector.take_local():
+        sample = load_collector.snapshot[name]
+        pushed = _pushed.get(name)
+        loads.append({
+            "name": name,
+            "online": sample["online"],
+            "connections": pushed["connections"] if pushed else None,
+            "sampled_at": sample["sampled_at"],
+        })
+    return loads
+
+
+def apply_shared_load(name: str, online: int, connections: dict | None, sampled_at: float):
+    """Принять замер, снятый другим воркером, если он новее своего."""
+    if name not in VPN_SERVERS:
+        return
+    sample = load_collector.snapshot.get(name)
+    if sample and sample["sampled_at"] is not None and sample["sampled_at"] >= sampled_at:
+        return
+    load_collector.record(name, online, sampled_at, local=False)
+    if connections is not None:
+        _pushed[name] = {"online": online, "connections": connections, "received_at": sampled_at}
+
+
+def _pushed_snapshot(server_name: str) -> dict:
+    snapshot = _pushed.get(server_name)
+    if snapshot is None or time.time() - snapshot["received_at"] > MONITORING_MAX_AGE:
+        raise LookupError(f"нет свежих данных от агента {server_name}")
+    return snapshot
+
+
+def _ssh_command_bytes(server_name: str, cmd: str) -> bytes:
+    """Выполнить SSH команду через постоянную сессию сервера."""
+    started = time.perf_counter()
+    try:
+        return ssh_sessions.run_bytes(server_name, cmd)
+    except Exception:
+        SSH_COMMAND_ERRORS.inc(server_name)
+        raise
+    finally:
+        SSH_COMMAND_SECONDS.observe(time.perf_counter() - started, server_name)
 
 
 def _ssh_command(server_name: str, cmd: str) -> str:
-    """Выполнить SSH команду."""
-    server = VPN_SERVERS[server_name]
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(
-        hostname=server["host"],
-        username=server["ssh_user"],
-        password=server["ssh_password"],
+    """Выполнить SSH команду и вернуть stdout строкой."""
+    return _ssh_command_bytes(server_name, cmd).decode().strip()
+
+
+async def _run(server_name: str, cmd: str, raw: bool = False) -> str | bytes:
+    """Выполнить SSH команду в отдельном потоке, не блокируя event loop."""
+    func = _ssh_command_bytes if raw else _ssh_command
+    return await asyncio.wait_for(
+        asyncio.to_thread(func, server_name, cmd),
+        timeout=MONITORING_TIMEOUT,
     )
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    result = stdout.read().decode().strip()
-    ssh.close()
-    return result
 
 
-def get_active_ips(server_name: str) -> list:
+async def _gather_servers(coro_factory, names=None) -> dict:
+    """Опросить серверы параллельно; упавшие и зависшие пропускаются."""
+    names = list(VPN_SERVERS if names is None else names)
+    results = await asyncio.gather(*(coro_factory(name) for name in names), return_exceptions=True)
+    data = {}
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.warning("Мониторинг %s недоступен: %r", name, result)
+            continue
+        data[name] = result
+    return data
+
+
+async def get_active_ips(server_name: str) -> list:
     """Получить список активных IP подключённых к VPN."""
     cmd = (
         "ss -tnp | grep xray | grep ESTAB | "
@@ -26,57 +126,154 @@ def get_active_ips(server_name: str) -> list:
         "rev | cut -d: -f2- | rev | "
         "sed 's/\\[::ffff://;s/\\]//' | sort -u"
     )
-    result = _ssh_command(server_name, cmd)
+    result = await _run(server_name, cmd)
     if not result:
         return []
     return [ip.strip() for ip in result.split("\n") if ip.strip()]
 
 
-def get_connections(server_name: str) -> dict:
+async def update_log_index(server_name: str) -> AccessLogIndexer:
+    """Дочитать новые строки access.log сервера в его индекс."""
+    indexer = _log_indexers.setdefault(server_name, AccessLogIndexer())
+    lock = _log_locks.setdefault(server_name, asyncio.Lock())
+    async with lock:
+        stat = await _run(server_name, f"stat -c '%i %s' {XRAY_ACCESS_LOG}")
+        if not stat:
+            return indexer
+        inode, size = (int(x) for x in stat.split())
+        offset = indexer.start_offset(inode, size)
+        if offset < size:
+            data = await _run(
+                server_name,
+                f"tail -c +{offset + 1} {XRAY_ACCESS_LOG} | head -c {MAX_READ}",
+                raw=True,
+            )
+            indexer.feed(data)
+    return indexer
+
+
+async def get_connections(server_name: str) -> dict:
     """Получить количество устройств на каждый ключ (только активные)."""
-    active_ips = get_active_ips(server_name)
-    if not active_ips:
-        return {}
+    if uses_agent(server_name):
+        return dict(_pushed_snapshot(server_name)["connections"])
+    active_ips, indexer = await asyncio.gather(
+        get_active_ips(server_name),
+        update_log_index(server_name),
+    )
+    return indexer.device_counts(active_ips)
 
-    # Для каждого активного IP находим email в логе
-    email_ips = {}
-    for ip in active_ips:
-        cmd = f"grep '{ip}' /var/log/xray/access.log | tail -1 | grep -oP 'email: \\K\\S+'"
-        result = _ssh_command(server_name, cmd)
-        if result:
-            email = result.strip()
-            if email not in email_ips:
-                email_ips[email] = set()
-            email_ips[email].add(ip)
 
-    return {email: len(ips) for email, ips in email_ips.items()}
+async def get_all_connections() -> dict:
+    """Устройства на ключ, суммарно по всем серверам."""
+    per_server = await _gather_servers(get_connections)
+    total = {}
+    for connections in per_server.values():
+        for email, devices in connections.items():
+            total[email] = total.get(email, 0) + devices
+    return total
 
 
-def get_online_count(server_name: str) -> int:
+async def get_online_count(server_name: str) -> int:
     """Получить количество онлайн пользователей."""
-    return len(get_active_ips(server_name))
+    if uses_agent(server_name):
+        return _pushed_snapshot(server_name)["online"]
+    return len(await get_active_ips(server_name))
 
 
-def get_all_servers_online() -> dict:
-    """Получить онлайн по всем серверам."""
-    result = {}
-    for name in VPN_SERVERS:
-        result[name] = get_online_count(name)
-    return result
+async def get_traffic(server_name: str) -> dict[str, list[int]]:
+    """Трафик по ключам с прошлого вызова: {email: [upload, download]}; счётчики Xray обнуляются."""
+    return parse_stats(await _run(server_name, stats_command(XRAY_STATS_API)))
+
+
+class ServerLoadCollector(PeriodicTask):
+    """Фоновый опрос онлайна серверов в снапшот в памяти."""
+
+    name = "server-load-collector"
+
+    def __init__(self, interval: float = MONITORING_INTERVAL):
+        super().__init__(interval)
+        self.snapshot: dict[str, dict] = {}
+        # Серверы, замеренные этим процессом и ещё не опубликованные (см. take_local_loads)
+        self._local: set[str] = set()
+
+    async def run_once(self):
+        await self.collect_once()
 
+    async def collect_once(self):
+        """Снять онлайн (и трафик, если задан XRAY_STATS_API) с серверов без агента.
 
-def get_best_server() -> str | None:
-    """Найти сервер с наименьшей нагрузкой."""
-    online = get_all_servers_online()
-    best = None
-    min_load = float("inf")
+        Серверы с агентом попадают в снапшот сами, через record_push.
+        """
+        polled = [name for name in VPN_SERVERS if not uses_agent(name)]
+        if XRAY_STATS_API:
+            online, traffic = await asyncio.gather(
+                _gather_servers(get_online_count, polled),
+                _gather_servers(get_traffic, polled),
+            )
+            for counters in traffic.values():
+                traffic_meter.ingest(counters)
+        else:
+            online = await _gather_servers(get_online_count, polled)
+        now = time.time()
+        for name in polled:
+            if name in online:
+                self.record(name, online[name], now)
+            else:
+                # Последнее удачное значение остаётся, но стареет
+                self._sample(name)["error"] = "unavailable"
 
-    for name, server in VPN_SERVERS.items():
-        count = online.get(name, 0)
-        max_users = server.get("max_users", 80)
+    def _sample(self, name: str) -> dict:
+        sample = self.snapshot.setdefault(name, {"online": None, "sampled_at": None, "error": None})
+        sample["max"] = VPN_SERVERS[name].get("max_users", 80)
+        return sample
+
+    def record(self, name: str, online: int, sampled_at: float, local: bool = True):
+        """Записать удачный замер сервера; local=False — замер другого воркера."""
+        sample = self._sample(name)
+        sample["online"] = online
+        sample["sampled_at"] = sampled_at
+        sample["error"] = None
+        if local:
+            self._local.add(name)
+
+    def take_local(self) -> set[str]:
+        names, self._local = self._local, set()
+        return names
+
+    def age(self, name: str) -> float | None:
+        """Возраст последнего удачного замера сервера, сек."""
+        sample = self.snapshot.get(name)
+        if not sample or sample["sampled_at"] is None:
+            return None
+        return time.time() - sample["sampled_at"]
+
+    def is_fresh(self, name: str, max_age: float = MONITORING_MAX_AGE) -> bool:
+        age = self.age(name)
+        return age is not None and age <= max_age
+
+
+load_collector = ServerLoadCollector()
+
+
+async def get_servers_online(fallback: str = MONITORING_STALE_FALLBACK) -> dict:
+    """Онлайн по серверам из снапшота коллектора.
+
+    Для устаревших серверов поведение задаёт fallback (см. MONITORING_STALE_FALLBACK).
+    """
+    online = {}
+    stale = []
+    for name in VPN_SERVERS:
+        if load_collector.is_fresh(name):
+            online[name] = load_collector.snapshot[name]["online"]
+        else:
+            stale.append(name)
 
-        if count < max_users and count < min_load:
-            min_load = count
-            best = name
+    if stale and fallback == "live":
+        online.update(await _gather_servers(get_online_count, stale))
+    elif stale and fallback == "stale":
+        for name in stale:
+            sample = load_collector.snapshot.get(name)
+            if sample and sample["online"] is not None:
+                online[name] = sample["online"]
+    return online
 
-    return best
\ No newline at end of file
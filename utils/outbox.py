@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from config import settings
+from database.db import (
+    claim_messages,
+    enqueue_message,
+    finish_message,
+    queue_broadcast_batch,
+    requeue_stale_messages,
+    start_broadcast,
+)
+from utils.metrics import OUTBOX_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в один чат. Берём с запасом:
+# за любую секунду уходит не больше OUTBOX_BURST + OUTBOX_RATE, держите сумму ≤ 30
+OUTBOX_RATE = getattr(settings, "OUTBOX_RATE", 25)
+OUTBOX_BURST = getattr(settings, "OUTBOX_BURST", 5)
+OUTBOX_CHAT_RATE = getattr(settings, "OUTBOX_CHAT_RATE", 1)
+OUTBOX_CHAT_BURST = getattr(settings, "OUTBOX_CHAT_BURST", 3)
+# Сколько сообщений одновременно держать в работе
+OUTBOX_BATCH = getattr(settings, "OUTBOX_BATCH", 50)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, "OUTBOX_MAX_ATTEMPTS", 8)
+OUTBOX_POLL_INTERVAL = getattr(settings, "OUTBOX_POLL_INTERVAL", 1)
+# Рассылка добавляет получателей порциями, пока очередь короче окна
+OUTBOX_BROADCAST_WINDOW = getattr(settings, "OUTBOX_BROADCAST_WINDOW", 500)
+OUTBOX_BROADCAST_BATCH = getattr(settings, "OUTBOX_BROADCAST_BATCH", 200)
+
+
+def message_payload(text: str, parse_mode: str | None = None, reply_markup: InlineKeyboardMarkup | None = None) -> str:
+    """Параметры send_message в JSON для хранения в очереди."""
+    payload = {"text": text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    if reply_markup:
+        payload["reply_markup"] = reply_markup.model_dump(exclude_none=True)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+class TokenBucket:
+    """Token bucket: rate жетонов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд будет доступен жетон (0 — уже есть)."""
+        now = time.monotonic()
+        self._refill(now)
+        # updated может быть в будущем, если bucket на паузе
+        return max(0.0, self.updated - now, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Не выдавать жетоны seconds секунд (retry_after от Telegram)."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, now + seconds)
+
+    def is_idle(self) -> bool:
+        """Bucket полон — его можно выбросить и создать заново без потери точности."""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class Outbox:
+    """Отправка сообщений Telegram из таблицы outbox с учётом лимитов.
+
+    Общий bucket держит темп бота, bucket на чат — темп в один чат; жетоны
+    берутся из обоих сразу перед отправкой, так что фактические отправки
+    укладываются в оба лимита.
+    retry_after от Telegram ставит на паузу всю отправку; сетевые ошибки
+    повторяются с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS
+    и при блокировке бота пользователем сообщение помечается failed.
+    При нескольких процессах запускается только в основном.
+    """
+
+    def __init__(self, batch: int = OUTBOX_BATCH):
+        self.batch = batch
+        self.bot: Bot | None = None
+        self._bucket = TokenBucket(OUTBOX_RATE, OUTBOX_BURST)
+        self._chats: dict[int, TokenBucket] = {}
+        self._wakeup = asyncio.Event()
+        self._inflight: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    def notify(self):
+        """Разбудить отправку: в очереди появилось сообщение."""
+        self._wakeup.set()
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: str | None = None,
+        reply_markup: InlineKeyboardMarkup | None = None,
+        dedup_key: str | None = None,
+    ) -> bool:
+        """Поставить сообщение в очередь. False — сообщение с таким dedup_key уже было."""
+        queued = await enqueue_message(chat_id, message_payload(text, parse_mode, reply_markup), dedup_key)
+        if queued:
+            self.notify()
+        return queued
+
+    async def broadcast(
+        self, text: str, parse_mode: str | None = None, reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> int:
+        """Разослать сообщение всем пользователям; вернуть id рассылки."""
+        broadcast_id = await start_broadcast(message_payload(text, parse_mode, reply_markup))
+        self.notify()
+        return broadcast_id
+
+    async def start(self, bot: Bot):
+        self.bot = bot
+        requeued = await requeue_stale_messages()
+        if requeued:
+            logger.warning("Возвращено в очередь неотправленных сообщений: %s", requeued)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self):
+        tasks = list(self._inflight)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        # Прерванные сообщения остаются в статусе sending и вернутся при старте
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._inflight.clear()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            free = self.batch - len(self._inflight)
+            # Дозабираем порцией, а не по одному после каждой отправки
+            if free >= max(1, self.batch // 2) or not self._inflight:
+                try:
+                    await queue_broadcast_batch(OUTBOX_BROADCAST_WINDOW, OUTBOX_BROADCAST_BATCH)
+                    messages = await claim_messages(free)
+                except Exception:
+                    logger.exception("Ошибка чтения очереди сообщений")
+                    messages = []
+                for message in messages:
+                    task = asyncio.create_task(self._deliver(message))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._done)
+                self._forget_idle_chats()
+                if len(messages) == free:
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        if not task.cancelled() and task.exception():
+            # Статус не записан: сообщение вернётся в очередь при следующем старте
+            logger.error("Ошибка отправки сообщения", exc_info=task.exception())
+        self.notify()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+        return bucket
+
+    def _forget_idle_chats(self):
+        # Иначе при рассылке словарь вырастет до числа пользователей
+        if len(self._chats) > self.batch * 4:
+            self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_idle()}
+
+    async def _acquire(self, chat_id: int):
+        """Дождаться жетонов общего bucket и bucket чата и взять оба."""
+        while True:
+            chat = self._chat_bucket(chat_id)
+            delay = max(self._bucket.delay(), chat.delay())
+            if delay <= 0:
+                self._bucket.take()
+                chat.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, message: dict):
+        payload = json.loads(message["payload"])
+        if "reply_markup" in payload:
+            payload["reply_markup"] = InlineKeyboardMarkup.model_validate(payload["reply_markup"])
+        while True:
+            await self._acquire(message["chat_id"])
+            try:
+                await self.bot.send_message(chat_id=message["chat_id"], **payload)
+            except TelegramRetryAfter as e:
+                # Флуд-контроль: ждём сколько сказали, не тратя попытку
+                logger.warning("Telegram просит подождать %s с", e.retry_after)
+                OUTBOX_MESSAGES.inc("retry_after")
+                self._bucket.pause(e.retry_after)
+                continue
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован или чат недоступен — повтор не поможет
+                logger.info("Сообщение %s в чат %s отклонено: %s", message["id"], message["chat_id"], e)
+                OUTBOX_MESSAGES.inc("rejected")
+                await finish_message(message["id"], error=repr(e))
+            except Exception as e:
+                if message["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    logger.exception("Сообщение %s не отправлено за %s попыток", message["id"], message["attempts"])
+                    OUTBOX_MESSAGES.inc("failed")
+                    await finish_message(message["id"], error=repr(e))
+                else:
+                    delay = min(300, 2 ** message["attempts"])
+                    logger.warning("Сообщение %s: ошибка %r, повтор через %s с", message["id"], e, delay)
+                    OUTBOX_MESSAGES.inc("error")
+                    await finish_message(message["id"], error=repr(e), retry_at=time.time() + delay)
+            else:
+                OUTBOX_MESSAGES.inc("sent")
+                await finish_message(message["id"])
+            return
+
+
+outbox = Outbox()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+from config import settings
+from database.db import (
+    claim_payment_job,
+    finish_payment_job,
+    requeue_stale_payment_jobs,
+)
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_WORKERS = getattr(settings, "PAYMENT_WORKERS", 4)
+PAYMENT_MAX_ATTEMPTS = getattr(settings, "PAYMENT_MAX_ATTEMPTS", 8)
+# Как часто воркер сам заглядывает в очередь без сигнала (отложенные повторы), сек
+PAYMENT_POLL_INTERVAL = getattr(settings, "PAYMENT_POLL_INTERVAL", 5)
+
+
+class PaymentQueue:
+    """Воркеры, разбирающие сохранённые вебхуки оплаты из таблицы payment_jobs.
+
+    handler(job) вызывается для каждой задачи; исключение означает повтор
+    с экспоненциальной задержкой, после PAYMENT_MAX_ATTEMPTS — статус failed.
+    """
+
+    def __init__(self, handler, workers: int = PAYMENT_WORKERS):
+        self.handler = handler
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def notify(self):
+        """Разбудить воркеры: в очереди появилась задача."""
+        self._wakeup.set()
+
+    async def start(self, requeue: bool = True):
+        """Запустить воркеры; requeue=False — не трогать чужие задачи в работе (не первый процесс)."""
+        if requeue:
+            requeued = await requeue_stale_payment_jobs()
+            if requeued:
+                logger.warning("Возвращено в очередь незавершённых оплат: %s", requeued)
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"payment-worker-{i}"))
+        self.notify()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await claim_payment_job()
+            except Exception:
+                logger.exception("Ошибка чтения очереди оплат")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=PAYMENT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Другие воркеры тоже могут что-то взять
+            self.notify()
+            await self._process(job)
+
+    async def _process(self, job: dict):
+        payment_id = job["payment_id"]
+        try:
+            await self.handler(job)
+        except Exception as e:
+            error = repr(e)
+            if job["attempts"] >= PAYMENT_MAX_ATTEMPTS:
+                logger.exception("Оплата %s не обработана за %s попыток", payment_id, job["attempts"])
+                await finish_payment_job(payment_id, error=error)
+            else:
+                delay = min(300, 2 ** job["attempts"])
+                logger.warning("Оплата %s: ошибка %s, повтор через %s с", payment_id, error, delay)
+                await finish_payment_job(payment_id, error=error, retry_at=time.time() + delay)
+        else:
+            await finish_payment_job(payment_id)
@@ -0,0 +1,124 @@
+import logging
+import time
+from bisect import bisect_right
+
+from config import settings
+from config.settings import VPN_SERVERS
+from database.db import get_pool_counts, get_recent_placements, record_placement
+from utils.monitoring import MONITORING_MAX_AGE, MONITORING_STALE_FALLBACK, get_servers_online, load_collector
+
+logger = logging.getLogger(__name__)
+
+# Веса составляющих балла сервера (меньше балл — лучше сервер):
+# keys — выданные ключи к max_users, online — онлайн к max_users,
+# pool — нехватка свободных UUID, stale — давность последнего замера
+PLACEMENT_WEIGHTS = {
+    "keys": 1.0,
+    "online": 1.0,
+    "pool": 0.5,
+    "stale": 0.5,
+    **getattr(settings, "PLACEMENT_WEIGHTS", {}),
+}
+# Меньше стольких свободных UUID — штраф pool растёт до 1 к пустому пулу
+PLACEMENT_POOL_LOW = getattr(settings, "PLACEMENT_POOL_LOW", 100)
+# Гистерезис: ключи выдаются на тот же сервер, что и последний, пока его балл
+# хуже лучшего не больше чем на эту величину — без метания между почти равными
+PLACEMENT_HYSTERESIS = getattr(settings, "PLACEMENT_HYSTERESIS", 0.05)
+
+
+class PlacementEngine:
+    """Выбор сервера для нового ключа по взвешенному баллу.
+
+    Сервер без свободных UUID или с онлайном не меньше max_users не
+    рассматривается. Выдачи, сделанные после последнего замера онлайна,
+    прибавляются к нему, чтобы всплеск оплат между замерами не ушёл
+    целиком на один сервер. Выдачи хранятся в базе: оплаты обрабатывают
+    все воркеры, и каждый должен видеть выдачи остальных.
+    """
+
+    def __init__(
+        self,
+        weights: dict | None = None,
+        hysteresis: float = PLACEMENT_HYSTERESIS,
+        pool_low: int = PLACEMENT_POOL_LOW,
+        fallback: str = MONITORING_STALE_FALLBACK,
+    ):
+        self.weights = weights or dict(PLACEMENT_WEIGHTS)
+        self.hysteresis = hysteresis
+        self.pool_low = pool_low
+        self.fallback = fallback
+
+    async def record(self, name: str):
+        """Учесть выданный на сервер ключ."""
+        now = time.time()
+        # Выдачи старше MONITORING_MAX_AGE уже есть в любом годном замере
+        await record_placement(name, now, now - MONITORING_MAX_AGE)
+
+    async def evaluate(self) -> list[dict]:
+        """Баллы всех серверов с составляющими, лучшие первыми; неподходящие — с причиной."""
+        online = await get_servers_online(fallback=self.fallback)
+        pool = await get_pool_counts()
+        placed = await get_recent_placements(time.time() - MONITORING_MAX_AGE)
+
+        results = []
+        for name, server in VPN_SERVERS.items():
+            max_users = server.get("max_users", 80)
+            counts = pool.get(name, {"total": 0, "used": 0})
+            free = counts["total"] - counts["used"]
+            sample = load_collector.snapshot.get(name) or {}
+            times = placed.get(name, [])
+            result = {
+                "name": name, "score": None, "terms": {}, "reason": None,
+                "last_placed": times[-1] if times else 0.0,
+            }
+            results.append(result)
+
+            if free <= 0:
+                result["reason"] = "нет свободных UUID"
+                continue
+            if name in online and online[name] >= max_users:
+                result["reason"] = "онлайн достиг max_users"
+                continue
+
+            age = load_collector.age(name)
+            if name in online:
+                # Выдачи, которых ещё нет в замере онлайна
+                sampled_at = sample.get("sampled_at")
+                pending = len(times) - bisect_right(times, sampled_at) if sampled_at is not None else len(times)
+                estimate = online[name] + pending
+                load = estimate / max_users
+            else:
+                # Онлайн неизвестен: считаем сервер полным, но не исключаем
+                load = 1.0
+            if age is None or sample.get("error"):
+                stale = 1.0
+            else:
+                stale = min(1.0, age / MONITORING_MAX_AGE)
+
+            terms = {
+                "keys": counts["used"] / max_users,
+                "online": load,
+                "pool": max(0.0, 1 - free / self.pool_low) if self.pool_low else 0.0,
+                "stale": stale,
+            }
+            result["terms"] = terms
+            result["score"] = sum(self.weights.get(key, 0) * value for key, value in terms.items())
+
+        results.sort(key=lambda r: (r["score"] is None, r["score"] or 0))
+        return results
+
+    async def rank(self) -> list[str]:
+        """Подходящие серверы в порядке предпочтения."""
+        eligible = [r for r in await self.evaluate() if r["score"] is not None]
+        if not eligible:
+            return []
+        names = [r["name"] for r in eligible]
+        # Текущая цель — сервер последней выдачи (любым воркером)
+        current = max(eligible, key=lambda r: r["last_placed"])
+        if current["last_placed"] and current["score"] <= eligible[0]["score"] + self.hysteresis:
+            names.remove(current["name"])
+            names.insert(0, current["name"])
+        return names
+
+
+placement = PlacementEngine()
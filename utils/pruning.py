@@ -0,0 +1,30 @@
+import logging
+
+from config import settings
+from database.db import prune_outbox, prune_subscription_changes
+from utils.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто чистить журналы, сек
+PRUNE_INTERVAL = getattr(settings, "PRUNE_INTERVAL", 600)
+
+
+class JournalPruner(PeriodicTask):
+    """Не даёт копиться журналу изменений подписок и отправленным сообщениям outbox."""
+
+    name = "journal-pruner"
+
+    def __init__(self, interval: float = PRUNE_INTERVAL):
+        super().__init__(interval)
+
+    async def run_once(self) -> int:
+        """Удалить старые записи; вернуть их количество."""
+        changes = await prune_subscription_changes()
+        messages = await prune_outbox()
+        if changes or messages:
+            logger.info("Удалено записей журнала подписок: %s, сообщений outbox: %s", changes, messages)
+        return changes + messages
+
+
+journal_pruner = JournalPruner()
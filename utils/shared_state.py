@@ -0,0 +1,75 @@
+import logging
+import time
+
+from config import settings
+from database.db import (
+    get_server_loads,
+    get_worker_metrics,
+    save_server_loads,
+    save_worker_metrics,
+    sync_subscription_changes,
+)
+from utils import metrics
+from utils.monitoring import apply_shared_load, take_local_loads
+from utils.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер сверяется с общим состоянием в базе, сек
+SHARED_STATE_INTERVAL = getattr(settings, "SHARED_STATE_INTERVAL", 1)
+# Как часто воркер публикует свои метрики для /metrics других воркеров, сек
+METRICS_SHARE_INTERVAL = getattr(settings, "METRICS_SHARE_INTERVAL", 5)
+
+
+class SharedStateSync(PeriodicTask):
+    """Синхронизация процессов через базу: сброс кэшей /sub и замеры нагрузки серверов.
+
+    Нужна только при нескольких воркерах: каждый видит изменения подписок,
+    сделанные другими, и замеры, снятые ими (опрос нод или пуш агента).
+
+    Метрики тоже общие: запрос /metrics (SO_REUSEPORT) попадает в случайный
+    воркер, поэтому каждый раз в METRICS_SHARE_INTERVAL кладёт свой снапшот в
+    базу, а отвечающий складывает их со своими текущими значениями. Значения
+    других воркеров отстают не больше чем на интервал; перезапущенный воркер
+    начинает счётчики с нуля, и для Prometheus это выглядит как сброс счётчика.
+    """
+
+    name = "shared-state"
+
+    def __init__(self, interval: float = SHARED_STATE_INTERVAL):
+        super().__init__(interval)
+        # Номер воркера — ключ его строки в worker_metrics
+        self.worker = 0
+        self._metrics_published = 0.0
+
+    def start(self, worker: int = 0):
+        self.worker = worker
+        metrics.set_workers_source(self.collect_metrics)
+        super().start()
+
+    async def stop(self):
+        await super().stop()
+        metrics.set_workers_source(None)
+
+    async def run_once(self):
+        await sync_subscription_changes()
+        loads = take_local_loads()
+        if loads:
+            await save_server_loads(loads)
+        for load in await get_server_loads():
+            apply_shared_load(**load)
+        if time.monotonic() - self._metrics_published >= METRICS_SHARE_INTERVAL:
+            await self.publish_metrics()
+
+    async def publish_metrics(self):
+        await save_worker_metrics(self.worker, metrics.snapshot())
+        self._metrics_published = time.monotonic()
+
+    async def collect_metrics(self) -> list[dict]:
+        """Снапшоты всех воркеров; свой — текущий, а не из базы."""
+        snapshots = await get_worker_metrics()
+        snapshots[self.worker] = metrics.snapshot()
+        return list(snapshots.values())
+
+
+shared_state = SharedStateSync()
@@ -0,0 +1,119 @@
+import logging
+import threading
+
+import paramiko
+from config import settings
+from config.settings import VPN_SERVERS
+
+logger = logging.getLogger(__name__)
+
+SSH_CONNECT_TIMEOUT = getattr(settings, "SSH_CONNECT_TIMEOUT", 10)
+SSH_COMMAND_TIMEOUT = getattr(settings, "SSH_COMMAND_TIMEOUT", 15)
+SSH_KEEPALIVE = getattr(settings, "SSH_KEEPALIVE", 30)
+SSH_MAX_CHANNELS = getattr(settings, "SSH_MAX_CHANNELS", 8)
+
+
+class SSHSession:
+    """Постоянное авторизованное соединение к одному серверу.
+
+    Команды идут отдельными каналами поверх одного транспорта,
+    одновременно открыто не больше max_channels каналов.
+    """
+
+    def __init__(self, server: dict, max_channels: int = SSH_MAX_CHANNELS):
+        self.server = server
+        self._client: paramiko.SSHClient | None = None
+        self._lock = threading.Lock()
+        self._channels = threading.BoundedSemaphore(max_channels)
+
+    def _connect(self) -> paramiko.Transport:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=self.server["host"],
+            port=self.server.get("ssh_port", 22),
+            username=self.server["ssh_user"],
+            password=self.server["ssh_password"],
+            timeout=SSH_CONNECT_TIMEOUT,
+            banner_timeout=SSH_CONNECT_TIMEOUT,
+            auth_timeout=SSH_CONNECT_TIMEOUT,
+        )
+        transport = client.get_transport()
+        transport.set_keepalive(SSH_KEEPALIVE)
+        self._client = client
+        logger.info("SSH: подключение к %s", self.server["host"])
+        return transport
+
+    def _transport(self, reconnect: bool = False) -> paramiko.Transport:
+        with self._lock:
+            transport = self._client.get_transport() if self._client else None
+            if reconnect or transport is None or not transport.is_active():
+                self._close_client()
+                transport = self._connect()
+            return transport
+
+    def _open_channel(self) -> paramiko.Channel:
+        transport = self._transport()
+        try:
+            return transport.open_session(timeout=SSH_CONNECT_TIMEOUT)
+        except (paramiko.SSHException, EOFError, OSError):
+            # Транспорт мог умереть между проверкой и открытием канала
+            logger.warning("SSH: переподключение к %s", self.server["host"])
+            return self._transport(reconnect=True).open_session(timeout=SSH_CONNECT_TIMEOUT)
+
+    def run_bytes(self, cmd: str) -> bytes:
+        """Выполнить команду в новом канале и вернуть сырой stdout."""
+        with self._channels:
+            channel = self._open_channel()
+            try:
+                channel.settimeout(SSH_COMMAND_TIMEOUT)
+                channel.exec_command(cmd)
+                with channel.makefile("rb") as stdout:
+                    return stdout.read()
+            finally:
+                channel.close()
+
+    def run(self, cmd: str) -> str:
+        """Выполнить команду и вернуть stdout строкой."""
+        return self.run_bytes(cmd).decode().strip()
+
+    def _close_client(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def close(self):
+        with self._lock:
+            self._close_client()
+
+
+class SSHSessionManager:
+    """По одной постоянной сессии на каждый сервер из VPN_SERVERS."""
+
+    def __init__(self):
+        self._sessions: dict[str, SSHSession] = {}
+        self._lock = threading.Lock()
+
+    def session(self, server_name: str) -> SSHSession:
+        with self._lock:
+            session = self._sessions.get(server_name)
+            if session is None:
+                session = SSHSession(VPN_SERVERS[server_name])
+                self._sessions[server_name] = session
+            return session
+
+    def run(self, server_name: str, cmd: str) -> str:
+        return self.session(server_name).run(cmd)
+
+    def run_bytes(self, server_name: str, cmd: str) -> bytes:
+        return self.session(server_name).run_bytes(cmd)
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+ssh_sessions = SSHSessionManager()
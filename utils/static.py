@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from aiohttp import web
+
+from config import settings
+
+try:
+    import brotli
+except ImportError:
+    # brotli есть в requirements.txt; без него отдаётся только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Перечитывать файлы при изменении (разработка)
+STATIC_DEV_RELOAD = getattr(settings, "STATIC_DEV_RELOAD", False)
+STATIC_CACHE_CONTROL = getattr(settings, "STATIC_CACHE_CONTROL", "no-cache")
+# JSON-ответы от этого размера сжимаются, байт
+JSON_COMPRESS_MIN = getattr(settings, "JSON_COMPRESS_MIN", 1024)
+
+# Кодировки в порядке предпочтения сервера
+ENCODINGS = ("br", "gzip")
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    """Кодировки из Accept-Encoding с ненулевым q."""
+    accepted = set()
+    for part in header.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+class StaticAsset:
+    """Файл в памяти: исходник и заранее сжатые варианты."""
+
+    def __init__(self, path: str, content_type: str | None = None):
+        self.path = path
+        self.content_type = content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.mtime: float | None = None
+        self.etag = ""
+        self.variants: dict[str, bytes] = {}
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self.mtime = os.stat(self.path).st_mtime
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        # Сжатие, которое не экономит байты, не отдаём
+        for encoding in list(self.variants):
+            if encoding != "identity" and len(self.variants[encoding]) >= len(body):
+                del self.variants[encoding]
+
+    def changed(self) -> bool:
+        try:
+            return os.stat(self.path).st_mtime != self.mtime
+        except OSError:
+            return False
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+
+class StaticAssets:
+    """Набор статических файлов, загруженных в память при старте."""
+
+    def __init__(self, reload: bool = STATIC_DEV_RELOAD, cache_control: str = STATIC_CACHE_CONTROL):
+        self.reload = reload
+        self.cache_control = cache_control
+        self._assets: dict[str, StaticAsset] = {}
+
+    def add(self, name: str, path: str, content_type: str | None = None):
+        self._assets[name] = StaticAsset(path, content_type)
+
+    def load(self):
+        """Прочитать и сжать все файлы."""
+        if brotli is None:
+            logger.warning("Пакет brotli не установлен: статика отдаётся без br, только gzip")
+        for name, asset in self._assets.items():
+            asset.load()
+            sizes = ", ".join(f"{encoding} {len(body)}" for encoding, body in asset.variants.items())
+            logger.info("Статика %s: %s", name, sizes)
+
+    def response(self, request: web.Request, name: str) -> web.Response:
+        """Ответ с файлом в подходящей клиенту кодировке, 304 при совпадении ETag."""
+        asset = self._assets[name]
+        if asset.mtime is None or (self.reload and asset.changed()):
+            asset.load()
+
+        encoding = asset.negotiate(request.headers.get("Accept-Encoding", ""))
+        # У каждой кодировки свой ETag: это разные представления
+        etag = asset.etag if encoding == "identity" else f"{asset.etag}-{encoding}"
+        headers = {"Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+
+        if request.if_none_match and any(tag.value == etag for tag in request.if_none_match):
+            response = web.Response(status=304, headers=headers)
+        else:
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            response = web.Response(body=asset.variants[encoding], headers=headers)
+            response.content_type = asset.content_type
+            if asset.content_type.startswith("text/"):
+                response.charset = "utf-8"
+        response.etag = etag
+        return response
+
+
+def json_compression_middleware(min_size: int = JSON_COMPRESS_MIN):
+    """Сжимать готовые JSON-ответы от min_size байт. Потоковые ответы (SSE) не трогаем."""
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        response = await handler(request)
+        if (
+            isinstance(response, web.Response)
+            and response.content_type == "application/json"
+            and "Content-Encoding" not in response.headers
+            and isinstance(response.body, bytes)
+            and len(response.body) >= min_size
+        ):
+            # gzip/deflate по Accept-Encoding выбирает сам aiohttp
+            response.enable_compression()
+        return response
+
+    return middleware
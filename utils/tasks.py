@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Фоновая задача: run_once() каждые interval секунд до вызова stop()."""
+
+    name = "periodic"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка фоновой задачи %s", self.name)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+
+from config import settings
+from database.db import TRAFFIC_MINUTE, get_traffic_usage, rollup_traffic, save_traffic
+from utils.cache import LRUCache
+from utils.tasks import PeriodicTask
+from utils.xray_log import merge_traffic
+
+logger = logging.getLogger(__name__)
+
+# Как часто сбрасывать накопленный трафик в базу, сек
+TRAFFIC_FLUSH_INTERVAL = getattr(settings, "TRAFFIC_FLUSH_INTERVAL", 60)
+# Сколько подписок держать в памяти для Subscription-Userinfo
+TRAFFIC_CACHE_SIZE = getattr(settings, "TRAFFIC_CACHE_SIZE", 10_000)
+# Через сколько секунд перечитывать трафик подписки из базы (его пишут и другие воркеры)
+TRAFFIC_CACHE_TTL = getattr(settings, "TRAFFIC_CACHE_TTL", 300)
+# Как часто сворачивать старый трафик (минуты в часы, часы в дни), сек
+TRAFFIC_ROLLUP_INTERVAL = getattr(settings, "TRAFFIC_ROLLUP_INTERVAL", 600)
+
+
+class TrafficMeter(PeriodicTask):
+    """Счётчики трафика по ключам: приём от нод, сброс в базу пачкой, итоги для /sub.
+
+    Приращения от агентов и опроса нод копятся в памяти по email и раз в
+    interval уходят в базу одной транзакцией, сколько бы их ни пришло.
+    Итог подписки читается из базы один раз и дальше растёт в памяти.
+    """
+
+    name = "traffic-meter"
+
+    def __init__(self, interval: float = TRAFFIC_FLUSH_INTERVAL, cache_size: int = TRAFFIC_CACHE_SIZE):
+        super().__init__(interval)
+        # email → [upload, download], ещё не записанные в базу
+        self._pending: dict[str, list[int]] = {}
+        # Пачка, которая пишется в базу прямо сейчас, и число начатых сбросов
+        self._flushing: dict[str, list[int]] = {}
+        self._flushes = 0
+        self._flush_idle = asyncio.Event()
+        self._flush_idle.set()
+        # email → [subscription_id, upload, download, loaded_at] — итог из базы плюс сброшенное после
+        self._usage = LRUCache(cache_size)
+
+    def ingest(self, traffic: dict[str, list[int]]):
+        """Принять приращения трафика с ноды: {email: [upload, download]} в байтах."""
+        merge_traffic(self._pending, traffic)
+
+    async def run_once(self) -> int:
+        """Записать накопленный трафик в базу; вернуть число ключей."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        # Пока пачка пишется, usage() прибавляет её сам и не перечитывает базу
+        self._flushing = pending
+        self._flushes += 1
+        self._flush_idle.clear()
+        now = time.time()
+        try:
+            await save_traffic(int(now - now % TRAFFIC_MINUTE), pending)
+        except Exception:
+            # Не теряем трафик: вернётся в следующий сброс
+            merge_traffic(self._pending, pending)
+            raise
+        finally:
+            self._flushing = {}
+            self._flush_idle.set()
+        # Без await после записи: итоги в памяти сдвигаются вместе с базой
+        for email, (upload, download) in pending.items():
+            entry = self._usage.get(email)
+            if entry is not None:
+                entry[1] += upload
+                entry[2] += download
+        return len(pending)
+
+    async def usage(self, subscription_id: int, user_uuid: str) -> tuple[int, int]:
+        """Трафик подписки: (upload, download), включая ещё не записанный."""
+        email = user_uuid[:8]
+        entry = self._usage.get(email)
+        if entry is None or entry[0] != subscription_id or time.time() - entry[3] > TRAFFIC_CACHE_TTL:
+            while True:
+                # Чтение, пересёкшееся со сбросом, могло увидеть пачку, а могло и нет
+                await self._flush_idle.wait()
+                flushes = self._flushes
+                upload, download = await get_traffic_usage(subscription_id)
+                if flushes == self._flushes:
+                    break
+            entry = [subscription_id, upload, download, time.time()]
+            self._usage.set(email, entry)
+        pending = self._pending.get(email, (0, 0))
+        flushing = self._flushing.get(email, (0, 0))
+        return entry[1] + pending[0] + flushing[0], entry[2] + pending[1] + flushing[1]
+
+    async def stop(self):
+        await super().stop()
+        # Остаток — в базу до её закрытия
+        try:
+            await self.run_once()
+        except Exception:
+            logger.exception("Не удалось сохранить трафик при остановке")
+
+
+class TrafficRollup(PeriodicTask):
+    """Периодически сворачивает старый минутный трафик в часы, часовой — в дни."""
+
+    name = "traffic-rollup"
+
+    def __init__(self, interval: float = TRAFFIC_ROLLUP_INTERVAL):
+        super().__init__(interval)
+
+    async def run_once(self) -> int:
+        rows = await rollup_traffic()
+        if rows:
+            logger.info("Свёрнуто строк трафика: %s", rows)
+        return rows
+
+
+traffic_meter = TrafficMeter()
+traffic_rollup = TrafficRollup()
@@ -0,0 +1,130 @@
+import json
+import os
+import re
+from collections import OrderedDict
+
+# 2024/05/01 12:34:56.123456 from tcp:1.2.3.4:51234 accepted tcp:example.com:443 [vless-in >> direct] email: abcd1234
+LINE_RE = re.compile(
+    r"^(?P<time>\S+ \S+) from (?:tcp:|udp:)?(?P<ip>\S+):\d+ accepted .*?email: (?P<email>\S+)"
+)
+
+# Счётчики трафика пользователей в Stats API Xray: user>>>email>>>traffic>>>uplink
+STATS_PATTERN = "user>>>"
+
+# Сколько байт читать за один проход
+MAX_READ = 8 * 1024 * 1024
+# При первом знакомстве с логом читаем только его хвост
+INITIAL_TAIL = 4 * 1024 * 1024
+
+
+def stats_command(api: str, reset: bool = True) -> str:
+    """Команда `xray api statsquery` для счётчиков пользователей; reset — обнулить после чтения."""
+    return f"xray api statsquery --server={api} -pattern '{STATS_PATTERN}'" + (" -reset" if reset else "")
+
+
+def parse_stats(output: str) -> dict[str, list[int]]:
+    """Трафик по email из JSON-вывода statsquery: {email: [uplink, downlink]} в байтах."""
+    if not output.strip():
+        return {}
+    traffic = {}
+    for stat in json.loads(output).get("stat") or []:
+        parts = stat.get("name", "").split(">>>")
+        if len(parts) != 4 or parts[0] != "user" or parts[2] != "traffic":
+            continue
+        # Нулевые значения Xray в JSON не пишет
+        value = int(stat.get("value") or 0)
+        if value <= 0 or parts[3] not in ("uplink", "downlink"):
+            continue
+        traffic.setdefault(parts[1], [0, 0])[parts[3] == "downlink"] += value
+    return traffic
+
+
+def merge_traffic(total: dict[str, list[int]], traffic: dict[str, list[int]]):
+    """Прибавить трафик traffic к total на месте."""
+    for email, (upload, download) in traffic.items():
+        counters = total.setdefault(email, [0, 0])
+        counters[0] += upload
+        counters[1] += download
+
+
+def normalize_ip(ip: str) -> str:
+    """Привести IP к виду, в котором его печатает ss (без [::ffff:...])."""
+    ip = ip.strip("[]")
+    if ip.startswith("::ffff:"):
+        ip = ip[len("::ffff:"):]
+    return ip
+
+
+class AccessLogIndexer:
+    """Индекс IP → (email, время последнего подключения) по access.log Xray.
+
+    Лог читается инкрементально с запомненного смещения: каждый проход
+    разбирает только новые байты. Ротация определяется по смене inode
+    или уменьшению размера файла.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.inode: int | None = None
+        self.offset = 0
+        self._partial = b""
+        self._skip_first_line = False
+        self.last_seen: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
+    def start_offset(self, inode: int, size: int) -> int:
+        """Сверить состояние с файлом и вернуть смещение, с которого читать."""
+        if self.inode is None:
+            # Первый проход: весь исторический лог не нужен
+            self.inode = inode
+            self.offset = max(0, size - INITIAL_TAIL)
+            self._partial = b""
+            self._skip_first_line = self.offset > 0
+        elif inode != self.inode or size < self.offset:
+            # Ротация: новый файл читаем с начала, индекс сохраняем
+            self.inode = inode
+            self.offset = 0
+            self._partial = b""
+            self._skip_first_line = False
+        return self.offset
+
+    def feed(self, data: bytes):
+        """Разобрать очередной кусок лога, начиная с текущего смещения."""
+        self.offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if self._skip_first_line and lines:
+            # Начали читать с середины строки
+            lines = lines[1:]
+            self._skip_first_line = False
+
+        for raw in lines:
+            match = LINE_RE.match(raw.decode("utf-8", errors="replace"))
+            if not match:
+                continue
+            ip = normalize_ip(match["ip"])
+            self.last_seen[ip] = (match["email"], match["time"])
+            self.last_seen.move_to_end(ip)
+
+        while len(self.last_seen) > self.max_entries:
+            self.last_seen.popitem(last=False)
+
+    def update_from_file(self, path: str):
+        """Дочитать локальный файл лога."""
+        stat = os.stat(path)
+        offset = self.start_offset(stat.st_ino, stat.st_size)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            self.feed(f.read(MAX_READ))
+
+    def email_for(self, ip: str) -> str | None:
+        entry = self.last_seen.get(normalize_ip(ip))
+        return entry[0] if entry else None
+
+    def device_counts(self, active_ips: list[str]) -> dict:
+        """Количество активных IP на каждый ключ."""
+        email_ips = {}
+        for ip in active_ips:
+            email = self.email_for(ip)
+            if email:
+                email_ips.setdefault(email, set()).add(normalize_ip(ip))
+        return {email: len(ips) for email, ips in email_ips.items()}
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+
+import aiohttp
+from config import settings
+from config.settings import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
+YOOKASSA_API_URL = getattr(settings, "YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+YOOKASSA_TIMEOUT = getattr(settings, "YOOKASSA_TIMEOUT", 10)
+YOOKASSA_RETRIES = getattr(settings, "YOOKASSA_RETRIES", 3)
+YOOKASSA_MAX_CONNECTIONS = getattr(settings, "YOOKASSA_MAX_CONNECTIONS", 20)
+
+# Ответы, после которых запрос имеет смысл повторить с тем же Idempotence-Key
+RETRY_STATUSES = {202, 429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    """Ошибка API ЮКассы."""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class YooKassaClient:
+    """Асинхронный клиент API ЮКассы с общей keep-alive сессией."""
+
+    def __init__(
+        self,
+        shop_id: str,
+        secret_key: str,
+        api_url: str = YOOKASSA_API_URL,
+        timeout: float = YOOKASSA_TIMEOUT,
+        retries: int = YOOKASSA_RETRIES,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.retries = max(1, retries)
+        self._auth = aiohttp.BasicAuth(str(shop_id), secret_key)
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=YOOKASSA_MAX_CONNECTIONS, keepalive_timeout=60),
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, payload: dict | None, idempotence_key: str) -> dict:
+        # Ключ идемпотентности общий для всех попыток: ЮКасса не создаст второй платёж
+        headers = {"Idempotence-Key": idempotence_key}
+        error: YooKassaError | None = None
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                async with self._get_session().request(
+                    method, self.api_url + path, json=payload, headers=headers,
+                ) as resp:
+                    body = await resp.text()
+                    try:
+                        data = json.loads(body)
+                    except ValueError:
+                        # HTML-страница 502/504 от прокси или обрыв тела
+                        data = None
+                    if resp.status == 200 and isinstance(data, dict):
+                        return data
+                    if isinstance(data, dict) and data.get("description"):
+                        message = data["description"]
+                    elif data is None:
+                        message = f"HTTP {resp.status}, ответ не JSON: {body[:200]!r}"
+                    else:
+                        message = f"HTTP {resp.status}"
+                    error = YooKassaError(message, resp.status)
+                    if resp.status not in RETRY_STATUSES:
+                        raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = YooKassaError(repr(e))
+            logger.warning("ЮКасса %s %s: %s (попытка %s)", method, path, error, attempt + 1)
+        raise error
+
+    async def create_payment(self, payload: dict, idempotence_key: str) -> dict:
+        """Создать платёж, вернуть объект платежа из ответа API."""
+        return await self._request("POST", "/payments", payload, idempotence_key)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+yookassa_client = YooKassaClient(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)